@@ -0,0 +1,539 @@
+# app/batch.py
+"""
+Пакетная офлайн-обработка архива картинок и DICOM без HTTP.
+
+    python -m app.batch /data/archive --out /data/archive_results.csv
+    python -m app.batch --manifest files.csv --methods otsu_inv watershed pr2 --workers 4
+
+Конвейер:
+- источники — рекурсивно из каталога или из манифеста (CSV с колонкой path);
+- пул потоков-читателей с предвыборкой: чтение, sha256, декодирование,
+  запись исходника и превью так же, как это делает /api/images/upload
+  (content-addressed, картинки, уже зарегистрированные в БД, не пишутся заново);
+- пул процессов (картинки передаются через общую память, app/shm.py):
+  выбранные методы сегментации (маски — в кэш масок с теми же
+  ключами, что у /segment/all, уже посчитанные не пересчитываются) и PR2
+  (модель грузится один раз на процесс, в инициализаторе);
+- регистрация в БД пачками по BATCH_DB_CHUNK картинок одной транзакцией
+  (images, segmentations, pr2_results);
+- манифест результатов (CSV) дописывается только после commit пачки, поэтому
+  после падения повторный запуск с тем же --out пропускает всё, что уже в нём
+  со статусом ok/duplicate, а недоделанное считает заново (все записи
+  идемпотентны).
+
+Прогресс и итоговая скорость (картинок в секунду) — в stderr.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import (
+    BATCH_DB_CHUNK,
+    BATCH_PROGRESS_INTERVAL_S,
+    BATCH_READERS,
+    MEDIA_ROOT,
+    PR2_BACKEND,
+    REGION_GROWING_ENGINE,
+    UPLOAD_SUBDIR,
+    VOLUME_SUBDIR,
+)
+from app.shm import Lease, array_pool, submit_shared
+
+BATCH_METHODS = ("manual_inv", "otsu_inv", "adapt_mean", "adapt_gauss", "region_growing", "watershed", "pr2")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".dcm")
+
+MANIFEST_FIELDS = (
+    "source", "status", "content_hash", "image_id", "width", "height", "depth",
+    "masks", "pr2_result", "pr2_detections", "seconds", "error",
+)
+# статусы, которые при повторном запуске не пересчитываются
+DONE_STATUSES = ("ok", "duplicate")
+
+
+# ---------- источники ----------
+
+def iter_directory(root: Path) -> Iterator[Path]:
+    """Файлы с подходящими расширениями, рекурсивно, в стабильном порядке."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if Path(name).suffix.lower() in IMAGE_EXTENSIONS:
+                yield Path(dirpath) / name
+
+
+def iter_manifest(path: Path) -> Iterator[Path]:
+    """CSV с колонкой path (относительные пути — от каталога манифеста)."""
+    with path.open(newline="") as f:
+        for row in csv.DictReader(f):
+            src = Path(row["path"])
+            yield src if src.is_absolute() else path.parent / src
+
+
+def read_done(out: Path) -> Tuple[Set[str], Dict[str, str]]:
+    """Из прошлого манифеста: обработанные источники и content_hash -> источник."""
+    done: Set[str] = set()
+    hashes: Dict[str, str] = {}
+    if not out.exists():
+        return done, hashes
+    with out.open(newline="") as f:
+        for row in csv.DictReader(f):
+            if row["status"] in DONE_STATUSES:
+                done.add(row["source"])
+                if row["status"] == "ok" and row["content_hash"]:
+                    hashes[row["content_hash"]] = row["source"]
+    return done, hashes
+
+
+# ---------- чтение (потоки) ----------
+
+@dataclass
+class Item:
+    """Одна картинка по ходу конвейера -> строка манифеста и записи в БД."""
+
+    source: str
+    t0: float = field(default_factory=time.perf_counter)
+    status: str = "ok"
+    error: str = ""
+    content_hash: str = ""
+    image_id: Optional[int] = None
+    image_row: Optional[Dict[str, Any]] = None  # None — картинка уже есть в БД
+    width: int = 0
+    height: int = 0
+    depth: int = 1
+    masks: List[Tuple[str, str, str]] = field(default_factory=list)  # (метод, ключ, rel_path)
+    pr2: Optional[Dict[str, Any]] = None
+    seconds: float = 0.0
+
+    def manifest_row(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "status": self.status,
+            "content_hash": self.content_hash,
+            "image_id": self.image_id if self.image_id is not None else "",
+            "width": self.width,
+            "height": self.height,
+            "depth": self.depth,
+            "masks": json.dumps({method: rel for method, _, rel in self.masks}) if self.masks else "",
+            "pr2_result": self.pr2["result_path"] if self.pr2 else "",
+            "pr2_detections": len(self.pr2["detections"]) if self.pr2 else "",
+            "seconds": round(self.seconds, 3),
+            "error": self.error,
+        }
+
+
+class Reader:
+    """
+    Чтение и регистрация файлов на диске (как /api/images/upload). Один и тот
+    же content_hash обрабатывается один раз, остальные копии — "duplicate".
+    """
+
+    def __init__(self, claimed: Dict[str, str]):
+        self._claimed = dict(claimed)
+        self._lock = threading.Lock()
+
+    def _claim(self, content_hash: str, source: str) -> Optional[str]:
+        """None — хэш наш; иначе источник, который его уже обработал/обрабатывает."""
+        with self._lock:
+            owner = self._claimed.setdefault(content_hash, source)
+        return None if owner == source else owner
+
+    def read(self, item: Item) -> Optional[Lease]:
+        """RGB-превью для сегментации в общей памяти; None — дубликат (item.status уже выставлен)."""
+        from app.db import crud
+        from app.db.base import SessionLocal
+        from app.segmentation.core import decode_image_bytes, gray_to_rgb, load_planes
+        from app.segmentation.service import save_previews
+        from app.segmentation.volume import decode_dicom_upload
+
+        path = Path(item.source)
+        data = path.read_bytes()
+        content_hash = hashlib.sha256(data).hexdigest()
+        item.content_hash = content_hash
+        owner = self._claim(content_hash, item.source)
+        if owner is not None:
+            item.status, item.error = "duplicate", f"same content as {owner}"
+            return None
+
+        with SessionLocal() as db:
+            existing = crud.get_image_by_content_hash(db, content_hash)
+        if existing is not None and (MEDIA_ROOT / existing.preview_path).exists():
+            item.image_id = existing.id
+            item.width, item.height, item.depth = existing.width, existing.height, existing.depth or 1
+            return array_pool.share(load_planes(MEDIA_ROOT / existing.preview_path).rgb)
+
+        ext = path.suffix.lower() or ".bin"
+        is_dicom = ext == ".dcm"
+        depth = 1
+        volume_rel = None
+        # сначала декодируем: битый файл не попадает в uploads/
+        if is_dicom:
+            volume_rel = f"{UPLOAD_SUBDIR}/{VOLUME_SUBDIR}/{content_hash}.npy"
+            img, depth = decode_dicom_upload(data, MEDIA_ROOT / volume_rel)
+            if depth == 1:
+                volume_rel = None
+        else:
+            img = decode_image_bytes(data)
+
+        stored_rel = f"{UPLOAD_SUBDIR}/{content_hash}{ext}"
+        stored_path = MEDIA_ROOT / stored_rel
+        if not stored_path.exists():
+            tmp = stored_path.with_suffix(".part")
+            tmp.write_bytes(data)
+            tmp.replace(stored_path)
+        del data
+
+        preview_tiers = save_previews(img, content_hash)
+        h, w = img.shape[:2]
+        item.width, item.height, item.depth = w, h, depth
+        item.image_row = {
+            "original_filename": path.name,
+            "stored_path": stored_rel,
+            "preview_path": f"{UPLOAD_SUBDIR}/{content_hash}.png",
+            "is_dicom": is_dicom,
+            "width": w,
+            "height": h,
+            "content_hash": content_hash,
+            "depth": depth,
+            "volume_path": volume_rel,
+            "preview_tiers": preview_tiers,
+        }
+        return array_pool.share(gray_to_rgb(img))
+
+
+# ---------- сегментация (процессы) ----------
+
+def _init_worker(with_pr2: bool, num_threads: int) -> None:
+    """Процесс пула: параллелизм — процессами, модель PR2 — один раз здесь."""
+    cv2.setNumThreads(num_threads)
+    if with_pr2:
+        from app.yolo.pr2_yolo import warm_up_pr2_model
+
+        if PR2_BACKEND == "torch":
+            import torch
+
+            torch.set_num_threads(num_threads)
+        warm_up_pr2_model()
+
+
+def segment_image(
+    img_rgb: np.ndarray,
+    preview_rel: str,
+    stem: str,
+    methods: List[str],
+    seg_kwargs: Dict[str, Any],
+    pr2_options: Optional[Any],
+) -> Dict[str, Any]:
+    """
+    Маски выбранных методов (уже лежащие в кэше масок не пересчитываются)
+    и PR2. Возвращает {"masks": [(метод, ключ, rel_path)], "pr2": {...} | None}.
+    """
+    from app.segmentation.cache import content_hash, mask_cache, mask_cache_key
+    from app.segmentation.core import iter_segment_methods, method_params
+    from app.segmentation.executor import inline_tasks
+
+    img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+    gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
+
+    masks = []
+    if methods:
+        # ключ — по файлу превью, как у /segment/all
+        image_hash = content_hash(MEDIA_ROOT / preview_rel)
+        params = method_params(**seg_kwargs)
+        keys = {method: mask_cache_key(image_hash, method, params[method]) for method in methods}
+        done = {method: mask_cache.lookup(key) for method, key in keys.items()}
+        missing = [method for method, rel in done.items() if rel is None]
+        if missing:
+            with inline_tasks():
+                for method, mask in iter_segment_methods(
+                    img_rgb, methods=missing, img_bgr=img_bgr, gray=gray, **seg_kwargs
+                ):
+                    done[method] = mask_cache.put(keys[method], mask, remember=False)
+        masks = [(method, keys[method], done[method]) for method in methods]
+
+    pr2 = None
+    if pr2_options is not None:
+        from app.yolo.pr2_yolo import backend_name, run_pr2_inference_batch, weights_fingerprint
+
+        result_path, detections = run_pr2_inference_batch([(img_bgr, stem, pr2_options)])[0]
+        pr2 = {
+            "cache_key": pr2_options.cache_key,
+            "weights_hash": weights_fingerprint(),
+            "result_path": result_path,
+            "detections": detections,
+            "params": {
+                "backend": backend_name(),
+                "mode": pr2_options.mode,
+                "imgsz": pr2_options.imgsz,
+                "conf": pr2_options.conf,
+                "iou": pr2_options.iou,
+            },
+        }
+    return {"masks": masks, "pr2": pr2}
+
+
+# ---------- БД и манифест ----------
+
+def register(items: List[Item], seg_params: Dict[str, Any]) -> None:
+    """Все готовые картинки пачки — одной транзакцией: images, segmentations, pr2_results."""
+    from app.db import crud
+    from app.db.base import SessionLocal
+
+    ok = [item for item in items if item.status == "ok"]
+    if not ok:
+        return
+    with SessionLocal() as db:
+        new_rows = [item.image_row for item in ok if item.image_row is not None]
+        ids = crud.create_images_bulk(db, new_rows) if new_rows else {}
+        for item in ok:
+            if item.image_id is None:
+                item.image_id = ids[item.content_hash]
+
+        crud.create_segmentations_bulk(
+            db,
+            [
+                {
+                    "image_id": item.image_id,
+                    "method": method,
+                    "result_path": rel_path,
+                    "params": seg_params,
+                    "cache_key": key,
+                }
+                for item in ok
+                for method, key, rel_path in item.masks
+            ],
+        )
+        crud.save_pr2_results_bulk(
+            db, [{"image_id": item.image_id, **item.pr2} for item in ok if item.pr2 is not None]
+        )
+        db.commit()
+
+
+class Manifest:
+    """CSV результатов: дописывается и сбрасывается на диск после каждой пачки."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        new = not path.exists() or path.stat().st_size == 0
+        self._f = path.open("a", newline="")
+        self._writer = csv.DictWriter(self._f, fieldnames=MANIFEST_FIELDS)
+        if new:
+            self._writer.writeheader()
+
+    def write(self, items: Iterable[Item]) -> None:
+        for item in items:
+            self._writer.writerow(item.manifest_row())
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class Progress:
+    def __init__(self, total: Optional[int], interval: float):
+        self.total = total
+        self.interval = interval
+        self.t0 = time.perf_counter()
+        self._last = self.t0
+        self.counts = {"ok": 0, "failed": 0, "duplicate": 0}
+
+    def add(self, item: Item) -> None:
+        self.counts[item.status] += 1
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.t0
+        return self.counts["ok"] / elapsed if elapsed > 0 else 0.0
+
+    def line(self) -> str:
+        total = f"/{self.total}" if self.total is not None else ""
+        eta = ""
+        if self.total is not None and 0 < self.done < self.total:
+            per_item = (time.perf_counter() - self.t0) / self.done
+            eta = f", eta {per_item * (self.total - self.done):.0f}s"
+        return (
+            f"[batch] {self.done}{total} done: {self.counts['ok']} ok, {self.counts['failed']} failed, "
+            f"{self.counts['duplicate']} duplicate; {self.rate():.2f} images/s{eta}"
+        )
+
+    def maybe_print(self) -> None:
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            print(self.line(), file=sys.stderr, flush=True)
+
+
+# ---------- конвейер ----------
+
+def run(args: argparse.Namespace) -> Progress:
+    from app.db import models  # noqa: F401 — таблицы в Base.metadata
+    from app.db.base import Base, engine
+    from app.db.migrate import add_missing_columns
+    from app.segmentation.core import SEGMENTATION_METHODS
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+
+    methods = [m for m in args.methods if m in SEGMENTATION_METHODS]
+    pr2_options = None
+    if "pr2" in args.methods:
+        from app.yolo.pr2_yolo import PredictOptions, weights_fingerprint
+
+        weights_fingerprint()  # нет весов — падаем сразу, а не на каждой картинке
+        pr2_options = PredictOptions(mode=args.pr2_mode)
+
+    seg_kwargs = dict(
+        manual_thresh=args.manual_thresh,
+        adaptive_block_size=args.adaptive_block_size,
+        adaptive_C=args.adaptive_c,
+        region_seed=(0, 0),  # для каждой картинки — центр, см. ниже
+        region_diff_thresh=args.diff_thresh,
+        watershed_fg_fraction=args.watershed_fg_fraction,
+        region_engine=args.region_engine,
+    )
+
+    out = Path(args.out)
+    done_sources, done_hashes = read_done(out) if not args.restart else (set(), {})
+    if args.restart and out.exists():
+        out.unlink()
+    if args.manifest:
+        sources = [p for p in iter_manifest(Path(args.manifest)) if str(p) not in done_sources]
+    else:
+        sources = [p for p in iter_directory(Path(args.source)) if str(p) not in done_sources]
+    if done_sources:
+        print(f"[batch] resume: {len(done_sources)} already in {out}", file=sys.stderr)
+
+    progress = Progress(len(sources), args.progress_interval)
+    reader = Reader(done_hashes)
+    manifest = Manifest(out)
+    workers = args.workers or os.cpu_count() or 1
+    prefetch = args.prefetch or 2 * workers + args.readers
+
+    readers = ThreadPoolExecutor(max_workers=args.readers, thread_name_prefix="batch-read")
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(pr2_options is not None, max(1, (os.cpu_count() or 1) // workers)),
+    )
+    pending: Dict[Future, Tuple[str, Item]] = {}
+    finished: List[Item] = []
+    queue = iter(sources)
+
+    def flush() -> None:
+        if not finished:
+            return
+        if not args.no_db:
+            register(finished, {"batch": True, **seg_kwargs, "region_seed": None})
+        manifest.write(finished)
+        finished.clear()
+
+    def finish(item: Item) -> None:
+        item.seconds = time.perf_counter() - item.t0
+        progress.add(item)
+        finished.append(item)
+        if len(finished) >= args.db_chunk:
+            flush()
+
+    try:
+        while True:
+            while len(pending) < prefetch:
+                src = next(queue, None)
+                if src is None:
+                    break
+                item = Item(source=str(src))
+                pending[readers.submit(reader.read, item)] = ("read", item)
+            if not pending:
+                break
+
+            ready, _ = wait(pending, timeout=args.progress_interval, return_when=FIRST_COMPLETED)
+            for fut in ready:
+                stage, item = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as exc:  # noqa: BLE001 — битый файл не должен останавливать архив
+                    item.status, item.error = "failed", f"{type(exc).__name__}: {str(exc).splitlines()[0] if str(exc) else ''}"
+                    finish(item)
+                    continue
+
+                if stage == "read":
+                    if result is None:  # дубликат
+                        finish(item)
+                        continue
+                    h, w = result.handle.shape[:2]
+                    kwargs = dict(seg_kwargs, region_seed=(h // 2, w // 2))
+                    try:
+                        task = submit_shared(
+                            pool, segment_image, result, f"{UPLOAD_SUBDIR}/{item.content_hash}.png",
+                            item.content_hash, methods, kwargs, pr2_options,
+                        )
+                    finally:
+                        result.release()  # задача держит свою ссылку до завершения
+                    pending[task] = ("segment", item)
+                else:
+                    item.masks, item.pr2 = result["masks"], result["pr2"]
+                    finish(item)
+            progress.maybe_print()
+        flush()
+    finally:
+        # Ctrl+C / падение: готовое регистрируем, остальное досчитает повторный запуск
+        try:
+            flush()
+        finally:
+            manifest.close()
+            readers.shutdown(wait=False, cancel_futures=True)
+            pool.shutdown(wait=False, cancel_futures=True)
+    return progress
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from app.yolo.pr2_yolo import PR2_MODES
+
+    parser = argparse.ArgumentParser(prog="python -m app.batch", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("source", nargs="?", help="каталог с картинками/DICOM (рекурсивно)")
+    src.add_argument("--manifest", help="CSV с колонкой path вместо каталога")
+    parser.add_argument("--out", required=True, help="манифест результатов (CSV), по нему же — возобновление")
+    parser.add_argument("--restart", action="store_true", help="не возобновлять: начать --out заново")
+    parser.add_argument("--methods", nargs="+", default=list(BATCH_METHODS[:-1]), choices=BATCH_METHODS)
+    parser.add_argument("--workers", type=int, default=0, help="процессы сегментации (0 — по числу CPU)")
+    parser.add_argument("--readers", type=int, default=BATCH_READERS, help="потоки чтения/декодирования")
+    parser.add_argument("--prefetch", type=int, default=0, help="картинок в работе одновременно (0 — 2*workers+readers)")
+    parser.add_argument("--db-chunk", type=int, default=BATCH_DB_CHUNK, help="картинок на транзакцию БД и запись манифеста")
+    parser.add_argument("--no-db", action="store_true", help="не регистрировать в БД (только файлы и манифест)")
+    parser.add_argument("--progress-interval", type=float, default=BATCH_PROGRESS_INTERVAL_S)
+    # параметры методов — как в SegmentAllRequest; seed region growing — центр картинки
+    parser.add_argument("--manual-thresh", type=int, default=120)
+    parser.add_argument("--adaptive-block-size", type=int, default=35)
+    parser.add_argument("--adaptive-c", type=int, default=2)
+    parser.add_argument("--diff-thresh", type=int, default=12)
+    parser.add_argument("--watershed-fg-fraction", type=float, default=0.5)
+    parser.add_argument("--region-engine", choices=("bfs", "band", "tree"), default=REGION_GROWING_ENGINE)
+    parser.add_argument("--pr2-mode", choices=PR2_MODES, default="overlay")
+    args = parser.parse_args(argv)
+
+    progress = run(args)
+    print(progress.line().replace("[batch]", "[batch] finished:") +
+          f" in {time.perf_counter() - progress.t0:.1f}s", file=sys.stderr)
+    return 1 if progress.counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
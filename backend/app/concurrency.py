@@ -0,0 +1,71 @@
+# app/concurrency.py
+import contextlib
+import asyncio
+import logging
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Очередь переполнена — запрос нужно отклонить (503 + Retry-After)."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("server is busy")
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Ограничение для async-обработчиков:
+    - одновременно выполняется не больше max_concurrent запросов;
+    - ещё не больше max_queue ждут своей очереди;
+    - всё, что сверху, сразу получает Overloaded, а не копится в памяти.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, retry_after: int = 1):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.retry_after = retry_after
+        self._sem = asyncio.Semaphore(self.max_concurrent)
+        self._pending = 0  # выполняются + ждут
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._pending - self.max_concurrent)
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._pending >= self.max_concurrent + self.max_queue:
+            raise Overloaded(self.retry_after)
+        self._pending += 1
+        try:
+            async with self._sem:
+                yield
+        finally:
+            self._pending -= 1
+
+
+_pools_lock = threading.Lock()
+
+
+def drop_broken_pool(getter: Callable[[], Optional[Executor]], broken: Executor) -> bool:
+    """
+    Пул процессов сломан (исполнителя убили: OOM, падение в нативном коде) —
+    сбросить lru_cache у getter, следующий getter() поднимет новый пул.
+    Сбрасываем, только если в кэше всё ещё broken: остальные задачи того же
+    пула падают следом и не должны закрыть уже пересозданный.
+    """
+    with _pools_lock:
+        if getter.cache_info().currsize == 0 or getter() is not broken:
+            return False
+        getter.cache_clear()
+    broken.shutdown(wait=False, cancel_futures=True)
+    logger.warning("Process pool %s is broken, it will be recreated on the next task", getter.__name__)
+    return True
@@ -1,12 +1,19 @@
 # /home/korasad/Analis/webapp/backend/app/config.py
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-DB_PATH = BASE_DIR / "app.db"
+# переопределяются через окружение (например, для бенчмарков на отдельной БД)
+DB_PATH = Path(os.getenv("APP_DB_PATH", BASE_DIR / "app.db"))
 DB_URL = f"sqlite:///{DB_PATH}"
+# SQLite под конкурентной нагрузкой: сколько ждать снятия блокировки записи, мс
+DB_BUSY_TIMEOUT_MS = 5000
+# пул соединений (постоянные + временные сверх них)
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
 
-MEDIA_ROOT = BASE_DIR / "static"
+MEDIA_ROOT = Path(os.getenv("APP_MEDIA_ROOT", BASE_DIR / "static"))
 UPLOAD_SUBDIR = "uploads"
 RESULTS_SUBDIR = "results"
 
@@ -16,3 +23,156 @@ RESULTS_DIR = MEDIA_ROOT / RESULTS_SUBDIR
 # создаём каталоги, если их нет
 for p in (MEDIA_ROOT, UPLOAD_DIR, RESULTS_DIR):
     p.mkdir(parents=True, exist_ok=True)
+
+# размер куска при потоковой записи загрузки на диск
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# движок region growing по умолчанию (запрос может выбрать свой: region_growing.engine):
+# - "bfs"  — эталонный попиксельный обход, среднее области обновляется после
+#   каждого добавленного пикселя (как было всегда);
+# - "band" — векторизованный, волнами: на каждой волне среднее заморожено,
+#   берётся вся связная компонента полосы |gray - mean| <= diff_thresh, затем
+#   среднее пересчитывается. Маски совпадают с bfs только для однородных
+#   объектов с контрастной границей, поэтому band — по явному выбору.
+# - "tree" — по α-дереву (app/segmentation/alphatree.py): однородная компонента,
+#   где соседи отличаются не больше чем на α <= diff_thresh (нет такой — одна
+#   волна band). Другая семантика (с bfs/band не совпадает); разметки уровней
+#   строятся раз на изображение, поэтому это движок интерактивного
+#   /segment/region-growing.
+REGION_GROWING_ENGINE = "bfs"
+
+# уровни α-дерева (движок "tree"): diff_thresh округляется вниз до ближайшего
+# уровня. Каждый уровень — разметка uint16/int32 на пиксель в кэше ниже
+REGION_TREE_ALPHAS = (1, 2, 4, 6, 8, 12, 16, 24, 32)
+
+# интерактивный region growing (/segment/region-growing): бюджет кэша разметок
+# (полос band, уровней α-дерева) и готовых масок, байты (app/segmentation/interactive.py)
+REGION_INTERACTIVE_CACHE_BYTES = 256 * 1024 * 1024
+
+# ---------- параллельное выполнение сегментации ----------
+# потоки для OpenCV-методов (0 -> все методы последовательно в одном потоке)
+SEGMENTATION_THREAD_WORKERS = min(6, os.cpu_count() or 1)
+# процессы для bfs region growing (0 -> тоже в потоках)
+SEGMENTATION_PROCESS_WORKERS = 1
+# сколько запросов /segment/* обрабатываются одновременно
+SEGMENTATION_MAX_CONCURRENT = 2
+# сколько запросов могут ждать; остальные сразу получают 503
+SEGMENTATION_MAX_QUEUE = 8
+SEGMENTATION_RETRY_AFTER_S = 2
+
+# ---------- общая память для массивов, уходящих в процессы (app/shm.py) ----------
+# False — массивы в пулы процессов передаются через pickle, как обычные аргументы
+SHARED_MEMORY_ENABLED = True
+# массивы меньше этого уходят через pickle: на маленьких он дешевле отображения сегмента
+SHARED_MEMORY_MIN_BYTES = 256 * 1024
+# сколько байт освободившихся сегментов держать для повторного использования
+SHARED_MEMORY_IDLE_BYTES = 512 * 1024 * 1024
+
+# ---------- тайловый режим для очень больших изображений ----------
+# изображения от стольких пикселей сегментируются по тайлам (результат тот же)
+SEGMENTATION_TILED_MIN_PIXELS = 4096 * 4096
+# сторона тайла без перекрытия
+SEGMENTATION_TILE_SIZE = 2048
+
+# ---------- перебор параметра (/segment/sweep) ----------
+# сколько значений можно перебрать за один запрос
+SWEEP_MAX_VALUES = 256
+
+# ---------- многокадровые DICOM (объёмы) ----------
+# подкаталог в static/uploads для срезов (.npy, depth x h x w, uint8) и в static/results для масок
+VOLUME_SUBDIR = "volumes"
+# процессы для срезов объёма — отдельный пул, не SEGMENTATION_PROCESS_WORKERS:
+# срезы независимы и грузят все ядра (0 -> срезы в пуле потоков)
+VOLUME_PROCESS_WORKERS = os.cpu_count() or 1
+# сколько срезов одновременно отдано в пул (ограничивает память независимо от глубины)
+VOLUME_MAX_IN_FLIGHT = max(4, 2 * VOLUME_PROCESS_WORKERS)
+
+# ---------- кэш масок сегментации ----------
+# подкаталог в static/results, где лежат маски по ключу (хэш превью + метод + параметры)
+MASK_CACHE_SUBDIR = "masks"
+# бюджет in-memory LRU (байты)
+MASK_CACHE_MEMORY_BYTES = 256 * 1024 * 1024
+# формат масок на диске: "msk" — бит на пиксель + zlib (app/segmentation/maskcodec.py),
+# PNG для фронта собирается на лету в /api/masks; "png" — как раньше, 8-битный PNG в /static
+MASK_STORAGE_FORMAT = "msk"
+# бюджет LRU уже закодированных PNG для /api/masks (байты)
+MASK_PNG_CACHE_BYTES = 64 * 1024 * 1024
+# бюджет кэша декодированных превью (RGB + BGR + серый), байты
+IMAGE_CACHE_MEMORY_BYTES = 256 * 1024 * 1024
+# отрисовки по первому GET (PNG масок для /api/masks, оверлеи PR2): подкаталог
+# в static/results и бюджет на диске, байты; сверх него удаляются давно не запрошенные
+RENDER_CACHE_SUBDIR = "rendered"
+RENDER_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# ---------- кодирование изображений ----------
+# профиль на тип артефакта: codec — "png" / "webp" / "jpeg", level — сжатие PNG (0-9),
+# quality — WebP/JPEG (0-100, для WebP 101 — без потерь). Цифры — benchmarks/bench_encode.py.
+# По полному превью считается сегментация, а маски бинарные — у них только PNG.
+ENCODE_PROFILES = {
+    # фото: level 1 в 1.6 раза быстрее дефолтного 3, файл больше на ~5%
+    "preview": {"codec": "png", "level": 1},
+    # бинарная маска: level 6 почти не медленнее, а файл втрое меньше
+    "mask": {"codec": "png", "level": 6},
+    "overlay": {"codec": "png", "level": 1},
+}
+# уменьшенные превью для просмотрщика (длинная сторона max_side), пишутся при загрузке;
+# сначала грузится thumb, потом screen, полное превью — по необходимости.
+# screen — JPEG: WebP вдвое меньше, но кодируется в 30 раз дольше и тормозит загрузку
+PREVIEW_TIERS = {
+    "thumb": {"codec": "webp", "quality": 80, "max_side": 256},
+    "screen": {"codec": "jpeg", "quality": 85, "max_side": 1600},
+}
+
+# ---------- PR2 (YOLO) ----------
+# micro-batching: сколько одновременных запросов склеиваем в один model.predict
+PR2_MAX_BATCH_SIZE = 8
+# сколько ждём добора пачки после первого запроса, мс
+PR2_MAX_WAIT_MS = 10
+# процессы-исполнители инференса, у каждого своя копия модели (0 -> потоки Starlette)
+PR2_INFERENCE_WORKERS = 1
+# torch.set_num_threads (или intra_op потоки onnxruntime) в каждом исполнителе
+PR2_TORCH_THREADS = max(1, (os.cpu_count() or 1) // max(1, PR2_INFERENCE_WORKERS))
+# сколько запросов могут ждать/считаться одновременно; остальные получают 503
+PR2_MAX_PENDING = 32
+PR2_RETRY_AFTER_S = 5
+# загрузить веса и сделать холостой прогон 640x640 при старте приложения
+PR2_WARMUP_ON_STARTUP = True
+# параметры predict по умолчанию (переопределяются в запросе)
+PR2_IMGSZ = 640
+PR2_CONF = 0.25
+PR2_IOU = 0.5
+# бэкенд инференса: "torch" (ultralytics.YOLO) или "onnx" (onnxruntime из requirements-onnx.txt,
+# app/yolo/onnx_backend.py)
+PR2_BACKEND = "torch"
+# ONNX-модель: экспортируется из .pt при первом запуске (нужен ultralytics) или кладётся готовой
+PR2_ONNX_PATH = BASE_DIR / "weights" / "pr2_yolo_isic_best.onnx"
+# int8-вариант (динамическая квантизация весов), создаётся из PR2_ONNX_PATH
+PR2_ONNX_INT8 = False
+PR2_ONNX_INT8_PATH = BASE_DIR / "weights" / "pr2_yolo_isic_best.int8.onnx"
+
+# ---------- метрики (/metrics, Server-Timing) ----------
+# время стадий, латентность запросов, записанные байты; False — декораторы и
+# middleware не подключаются вовсе (app/metrics.py)
+METRICS_ENABLED = True
+
+# ---------- фоновые задачи (/api/jobs) ----------
+# сколько задач выполняются одновременно (in-process воркеры)
+JOB_WORKERS = 2
+# сколько задач могут стоять в очереди; дальше — 503
+JOB_MAX_QUEUE = 64
+# для скольких последних задач держим в памяти историю событий (SSE)
+JOB_EVENTS_RETENTION = 256
+# сколько раз задача повторяет попытку, если сегментация/PR2 перегружены (Overloaded);
+# пауза растёт вдвое от Retry-After до JOB_OVERLOAD_BACKOFF_MAX_S, потом задача failed
+JOB_OVERLOAD_RETRIES = 6
+JOB_OVERLOAD_BACKOFF_MAX_S = 30
+# SSE для задачи, чья история уже вытеснена из памяти: как часто перечитывать её из БД
+JOB_EVENTS_POLL_S = 1.0
+
+# ---------- пакетная обработка (python -m app.batch) ----------
+# потоки чтения/декодирования файлов (процессы сегментации — по числу CPU)
+BATCH_READERS = 4
+# сколько картинок регистрируется в БД одной транзакцией (и дописывается в манифест)
+BATCH_DB_CHUNK = 64
+# как часто печатать прогресс, секунды
+BATCH_PROGRESS_INTERVAL_S = 5.0
@@ -1,13 +1,37 @@
 # /home/korasad/Analis/webapp/backend/app/db/base.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-from app.config import DB_URL
+from app.config import DB_BUSY_TIMEOUT_MS, DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_URL
 
-engine = create_engine(
-    DB_URL,
-    connect_args={"check_same_thread": False},  # нужно для sqlite в однопоточном режиме
-)
+
+def _configure_sqlite(dbapi_conn, _record) -> None:
+    cur = dbapi_conn.cursor()
+    # WAL: читатели не блокируют писателя и наоборот; NORMAL — fsync только на checkpoint
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    # ждать блокировку, а не сразу падать с "database is locked"
+    cur.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+    cur.close()
+
+
+def create_db_engine(url: str) -> Engine:
+    """Движок SQLite, настроенный для одновременных запросов из пула потоков."""
+    engine = create_engine(
+        url,
+        connect_args={
+            "check_same_thread": False,  # соединения из пула переходят между потоками
+            "timeout": DB_BUSY_TIMEOUT_MS / 1000,
+        },
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    event.listen(engine, "connect", _configure_sqlite)
+    return engine
+
+
+engine = create_db_engine(DB_URL)
 
 SessionLocal = sessionmaker(
     bind=engine,
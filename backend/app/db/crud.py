@@ -1,6 +1,8 @@
 # /home/korasad/Analis/webapp/backend/app/db/crud.py
-from typing import Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
 
 from app.db import models
@@ -10,6 +12,15 @@ def get_image(db: Session, image_id: int) -> Optional[models.Image]:
     return db.query(models.Image).filter(models.Image.id == image_id).first()
 
 
+def get_image_by_content_hash(db: Session, content_hash: str) -> Optional[models.Image]:
+    return (
+        db.query(models.Image)
+        .filter(models.Image.content_hash == content_hash)
+        .order_by(models.Image.id.desc())
+        .first()
+    )
+
+
 def create_image(
     db: Session,
     *,
@@ -19,6 +30,10 @@ def create_image(
     is_dicom: bool,
     width: int,
     height: int,
+    content_hash: Optional[str] = None,
+    depth: int = 1,
+    volume_path: Optional[str] = None,
+    preview_tiers: Optional[Dict[str, str]] = None,
 ) -> models.Image:
     image = models.Image(
         original_filename=original_filename,
@@ -27,6 +42,10 @@ def create_image(
         is_dicom=is_dicom,
         width=width,
         height=height,
+        content_hash=content_hash,
+        depth=depth,
+        volume_path=volume_path,
+        preview_tiers=preview_tiers,
     )
     db.add(image)
     db.commit()
@@ -34,6 +53,20 @@ def create_image(
     return image
 
 
+def get_segmentation_by_cache_key(
+    db: Session, image_id: int, cache_key: str
+) -> Optional[models.Segmentation]:
+    return (
+        db.query(models.Segmentation)
+        .filter(
+            models.Segmentation.image_id == image_id,
+            models.Segmentation.cache_key == cache_key,
+        )
+        .order_by(models.Segmentation.id.desc())
+        .first()
+    )
+
+
 def create_segmentation(
     db: Session,
     *,
@@ -41,14 +74,250 @@ def create_segmentation(
     method: str,
     result_path: str,
     params: dict | None = None,
+    cache_key: str | None = None,
 ) -> models.Segmentation:
     seg = models.Segmentation(
         image_id=image_id,
         method=method,
         result_path=result_path,
         params=params or {},
+        cache_key=cache_key,
     )
     db.add(seg)
     db.commit()
     db.refresh(seg)
     return seg
+
+
+def get_or_create_segmentation(
+    db: Session,
+    *,
+    image_id: int,
+    method: str,
+    result_path: str,
+    params: dict | None = None,
+    cache_key: str,
+) -> models.Segmentation:
+    """Повтор с тем же ключом кэша отдаёт существующую запись вместо новой."""
+    seg = get_segmentation_by_cache_key(db, image_id, cache_key)
+    if seg is not None:
+        return seg
+    return create_segmentation(
+        db,
+        image_id=image_id,
+        method=method,
+        result_path=result_path,
+        params=params,
+        cache_key=cache_key,
+    )
+
+
+def get_or_create_segmentations_bulk(
+    db: Session,
+    *,
+    image_id: int,
+    items: Sequence[Tuple[str, str, str]],
+    params: dict | None = None,
+) -> List[int]:
+    """
+    Записи для всех масок одного запроса: items — (method, result_path, cache_key).
+
+    Один SELECT по уже существующим ключам, недостающие строки — одним INSERT ... RETURNING
+    в одной транзакции (один commit, без refresh). Возвращает id в порядке items.
+    """
+    keys = [cache_key for _, _, cache_key in items]
+    ids = dict(
+        db.query(models.Segmentation.cache_key, func.max(models.Segmentation.id))
+        .filter(
+            models.Segmentation.image_id == image_id,
+            models.Segmentation.cache_key.in_(keys),
+        )
+        .group_by(models.Segmentation.cache_key)
+        .all()
+    )
+
+    missing = [
+        {
+            "image_id": image_id,
+            "method": method,
+            "result_path": result_path,
+            "params": params or {},
+            "cache_key": cache_key,
+        }
+        for method, result_path, cache_key in items
+        if cache_key not in ids
+    ]
+    if missing:
+        rows = db.execute(
+            insert(models.Segmentation).returning(
+                models.Segmentation.id,
+                models.Segmentation.cache_key,
+                sort_by_parameter_order=True,
+            ),
+            missing,
+        ).all()
+        db.commit()
+        ids.update({cache_key: seg_id for seg_id, cache_key in rows})
+
+    return [ids[cache_key] for cache_key in keys]
+
+
+def create_images_bulk(db: Session, rows: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Записи картинок пачкой: rows — kwargs как у create_image (content_hash обязателен).
+    Уже существующие content_hash не дублируются. Возвращает content_hash -> id.
+    Без commit — вызывающий коммитит всё одной транзакцией.
+    """
+    hashes = list(dict.fromkeys(row["content_hash"] for row in rows))
+    ids = dict(
+        db.query(models.Image.content_hash, func.max(models.Image.id))
+        .filter(models.Image.content_hash.in_(hashes))
+        .group_by(models.Image.content_hash)
+        .all()
+    )
+    missing = {row["content_hash"]: row for row in rows if row["content_hash"] not in ids}
+    if missing:
+        inserted = db.execute(
+            insert(models.Image).returning(models.Image.id, models.Image.content_hash),
+            list(missing.values()),
+        ).all()
+        ids.update({content_hash: image_id for image_id, content_hash in inserted})
+    return ids
+
+
+def create_segmentations_bulk(db: Session, rows: Sequence[Dict[str, Any]]) -> None:
+    """
+    Записи масок пачкой по нескольким картинкам: rows — image_id, method,
+    result_path, params, cache_key. Пары (image_id, cache_key), которые уже
+    есть, пропускаются. Без commit.
+    """
+    if not rows:
+        return
+    existing = set(
+        db.query(models.Segmentation.image_id, models.Segmentation.cache_key)
+        .filter(models.Segmentation.cache_key.in_({row["cache_key"] for row in rows}))
+        .all()
+    )
+    missing = {}
+    for row in rows:
+        pair = (row["image_id"], row["cache_key"])
+        if pair not in existing:
+            missing.setdefault(pair, row)
+    if missing:
+        db.execute(insert(models.Segmentation), list(missing.values()))
+
+
+def save_pr2_results_bulk(db: Session, rows: Sequence[Dict[str, Any]]) -> None:
+    """
+    Как save_pr2_result для нескольких картинок (rows — его kwargs):
+    старые записи с тем же ключом или другими весами удаляются. Без commit.
+    """
+    for row in rows:
+        db.query(models.Pr2Result).filter(
+            models.Pr2Result.image_id == row["image_id"],
+            (models.Pr2Result.cache_key == row["cache_key"])
+            | (models.Pr2Result.weights_hash != row["weights_hash"]),
+        ).delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(models.Pr2Result), list(rows))
+
+
+def get_pr2_result(db: Session, image_id: int, cache_key: str) -> Optional[models.Pr2Result]:
+    return (
+        db.query(models.Pr2Result)
+        .filter(
+            models.Pr2Result.image_id == image_id,
+            models.Pr2Result.cache_key == cache_key,
+        )
+        .order_by(models.Pr2Result.id.desc())
+        .first()
+    )
+
+
+def save_pr2_result(
+    db: Session,
+    *,
+    image_id: int,
+    cache_key: str,
+    weights_hash: str,
+    result_path: str,
+    detections: list,
+    params: dict | None = None,
+) -> None:
+    """
+    Запись результата PR2. Старые записи картинки с тем же ключом и
+    с другими весами удаляются в той же транзакции.
+    """
+    db.query(models.Pr2Result).filter(
+        models.Pr2Result.image_id == image_id,
+        (models.Pr2Result.cache_key == cache_key) | (models.Pr2Result.weights_hash != weights_hash),
+    ).delete(synchronize_session=False)
+    db.add(
+        models.Pr2Result(
+            image_id=image_id,
+            cache_key=cache_key,
+            weights_hash=weights_hash,
+            params=params or {},
+            result_path=result_path,
+            detections=detections,
+        )
+    )
+    db.commit()
+
+
+def create_job(
+    db: Session,
+    *,
+    job_id: str,
+    kind: str,
+    image_id: int,
+    params: dict | None = None,
+) -> models.Job:
+    job = models.Job(
+        id=job_id,
+        kind=kind,
+        image_id=image_id,
+        status="queued",
+        params=params or {},
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_job(db: Session, job_id: str) -> Optional[models.Job]:
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+
+def get_unfinished_jobs(db: Session) -> List[models.Job]:
+    return (
+        db.query(models.Job)
+        .filter(models.Job.status.in_(("queued", "running")))
+        .order_by(models.Job.created_at)
+        .all()
+    )
+
+
+def update_job_status(
+    db: Session,
+    job_id: str,
+    status: str,
+    *,
+    result: dict | None = None,
+    error: str | None = None,
+) -> Optional[models.Job]:
+    job = get_job(db, job_id)
+    if job is None:
+        return None
+    job.status = status
+    now = datetime.utcnow()
+    if status == "running":
+        job.started_at = now
+    elif status in ("done", "failed"):
+        job.finished_at = now
+        job.result = result
+        job.error = error
+    db.commit()
+    db.refresh(job)
+    return job
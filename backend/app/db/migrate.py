@@ -0,0 +1,27 @@
+# app/db/migrate.py
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.db.base import Base
+
+
+def add_missing_columns(engine: Engine) -> None:
+    """
+    create_all не трогает уже существующие таблицы, поэтому новые колонки
+    (и их индексы) в старой app.db досоздаём сами через ALTER TABLE.
+    """
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                col_type = col.type.compile(dialect=engine.dialect)
+                conn.execute(
+                    text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col_type}')
+                )
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -24,6 +24,10 @@ class Image(Base):
     is_dicom = Column(Boolean, default=False, nullable=False)
     width = Column(Integer, nullable=False)
     height = Column(Integer, nullable=False)
+    content_hash = Column(String, nullable=True, index=True)  # sha256 исходного файла (дедупликация загрузок)
+    depth = Column(Integer, default=1, nullable=True)  # число срезов (многокадровый DICOM)
+    volume_path = Column(String, nullable=True)  # срезы .npy (depth, h, w), например "uploads/volumes/<hash>.npy"
+    preview_tiers = Column(JSON, nullable=True)  # уменьшенные превью: {"thumb": "uploads/<hash>_thumb.webp", ...}
     created_at = Column(DateTime, default=datetime.utcnow)
 
     segmentations = relationship(
@@ -31,6 +35,11 @@ class Image(Base):
         back_populates="image",
         cascade="all, delete-orphan",
     )
+    pr2_results = relationship(
+        "Pr2Result",
+        back_populates="image",
+        cascade="all, delete-orphan",
+    )
 
 
 class Segmentation(Base):
@@ -40,7 +49,38 @@ class Segmentation(Base):
     image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"))
     method = Column(String, nullable=False)  # "manual_inv", "otsu_inv", "adapt_mean", ...
     params = Column(JSON, nullable=True)
-    result_path = Column(String, nullable=False)  # относительный путь, например "results/1_otsu_inv.png"
+    result_path = Column(String, nullable=False)  # относительный путь, например "results/masks/<key>.msk"
+    cache_key = Column(String, nullable=True, index=True)  # ключ кэша масок (хэш превью + метод + параметры)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     image = relationship("Image", back_populates="segmentations")
+
+
+class Pr2Result(Base):
+    __tablename__ = "pr2_results"
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"), index=True)
+    cache_key = Column(String, nullable=False, index=True)  # sha256(бэкенд, веса, imgsz/conf/iou, режим)
+    weights_hash = Column(String, nullable=False)  # sha256 файла весов на момент прогона
+    params = Column(JSON, nullable=True)  # {"backend", "mode", "imgsz", "conf", "iou"}
+    result_path = Column(String, nullable=False)  # оверлей, например "results/pr2/<stem>_pr2_<tag>_overlay.png"
+    detections = Column(JSON, nullable=False)  # как в ответе /api/pr2/predict
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    image = relationship("Image", back_populates="pr2_results")
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True, index=True)  # uuid4().hex
+    kind = Column(String, nullable=False)  # "segment_all" | "segment_volume" | "pr2"
+    image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"), index=True)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued/running/done/failed
+    params = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)  # тело ответа синхронного эндпоинта
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
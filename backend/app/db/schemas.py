@@ -1,7 +1,10 @@
 # /home/korasad/Analis/webapp/backend/app/db/schemas.py
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from app.config import PR2_CONF, PR2_IMGSZ, PR2_IOU
 
 
 class ImageRead(BaseModel):
@@ -11,6 +14,9 @@ class ImageRead(BaseModel):
     width: int
     height: int
     preview_url: str
+    depth: int = 1  # > 1 — объём, маски по срезам через /segment/volume
+    # уровни превью для просмотрщика: "thumb", "screen" (если картинка больше), всегда "full"
+    previews: Dict[str, str] = {}
 
     class Config:
         orm_mode = True
@@ -20,6 +26,8 @@ class RegionGrowingParams(BaseModel):
     seed_x: int  # колонка (по ширине, X)
     seed_y: int  # строка (по высоте, Y)
     diff_thresh: int = 12
+    # None -> REGION_GROWING_ENGINE из config
+    engine: Optional[Literal["bfs", "band", "tree"]] = None
 
 
 class SegmentAllRequest(BaseModel):
@@ -44,14 +52,121 @@ class SegmentationBatchResponse(BaseModel):
     image_id: int
     results: List[SegmentationRead]
     
+class VolumeSliceMasks(BaseModel):
+    index: int
+    results: Dict[str, str]  # метод -> URL маски среза
+
+
+class VolumeSegmentationResponse(BaseModel):
+    image_id: int
+    depth: int
+    slices: List[VolumeSliceMasks]
+
+
+class RegionGrowingRequest(BaseModel):
+    seed_x: int  # колонка (по ширине, X)
+    seed_y: int  # строка (по высоте, Y)
+    diff_thresh: int = 12
+    # tree — α-дерево, строится раз на изображение (быстро для любых seed и порогов);
+    # band — маски как у /segment/all с engine="band", но новый seed/порог считается заново
+    engine: Literal["tree", "band"] = "tree"
+    # rle — маска прямо в ответе; url — файл в кэше масок (как у /segment/all)
+    output: Literal["rle", "url"] = "rle"
+
+
+class RegionGrowingResponse(BaseModel):
+    image_id: int
+    area: int
+    area_fraction: float
+    bbox: Optional[List[int]] = None  # [x_min, y_min, x_max, y_max] включительно
+    cached: bool  # ответ из кэша, без пересчёта
+    # {"size": [h, w], "order": "C", "counts": [...]}, первая серия — нули
+    rle: Optional[Dict[str, Any]] = None
+    result_url: Optional[str] = None
+
+
+class SweepRange(BaseModel):
+    start: float
+    stop: float  # включительно
+    step: float
+
+
+class SegmentSweepRequest(BaseModel):
+    # какой параметр перебираем; остальные методы не считаются
+    parameter: Literal["manual_thresh", "adaptive_C", "watershed_fg_fraction"]
+    # либо список значений, либо диапазон
+    values: Optional[List[float]] = None
+    range: Optional[SweepRange] = None
+    adaptive_block_size: int = 35  # для adaptive_C
+    # stats — только площадь и bbox; masks — ещё и маски (в кэш, как у /segment/all)
+    output: Literal["stats", "masks"] = "stats"
+
+
+class SweepResult(BaseModel):
+    value: Union[int, float]  # int для manual_thresh/adaptive_C, float для watershed_fg_fraction
+    method: str
+    area: int  # пикселей в маске
+    area_fraction: float
+    bbox: Optional[List[int]] = None  # [x_min, y_min, x_max, y_max] включительно; None — маска пустая
+    result_url: Optional[str] = None  # только для output="masks"
+
+
+class SegmentSweepResponse(BaseModel):
+    image_id: int
+    parameter: str
+    results: List[SweepResult]
+
+
 class Pr2Detection(BaseModel):
     class_id: int
     class_name: str
     confidence: float
     bbox_xyxy: list[float]
+    # mode=polygons: контур маски [[x, y], ...] в координатах исходника
+    polygon: Optional[List[List[float]]] = None
+    # mode=rle: маска как в /api/masks/{key}?format=rle
+    rle: Optional[Dict[str, Any]] = None
+
+
+class Pr2Options(BaseModel):
+    # overlay — оверлей рисуется сразу; polygons / rle — маски в ответе,
+    # оверлей рисуется при первом запросе overlay_url
+    mode: Literal["overlay", "polygons", "rle"] = "overlay"
+    imgsz: int = Field(PR2_IMGSZ, ge=32, le=4096)
+    conf: float = Field(PR2_CONF, ge=0.0, le=1.0)
+    iou: float = Field(PR2_IOU, ge=0.0, le=1.0)
 
 
 class Pr2Result(BaseModel):
     image_id: int
     overlay_url: str
-    detections: List[Pr2Detection]
\ No newline at end of file
+    detections: List[Pr2Detection]
+
+
+class Pr2BatchRequest(Pr2Options):
+    image_ids: List[int]
+
+
+class Pr2BatchError(BaseModel):
+    image_id: int
+    detail: str
+
+
+class Pr2BatchResponse(BaseModel):
+    results: List[Pr2Result]
+    errors: List[Pr2BatchError]
+
+
+class JobRead(BaseModel):
+    id: str
+    kind: str
+    image_id: int
+    status: str  # queued/running/done/failed
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,87 @@
+# app/http_cache.py
+"""
+Ответы для ресурсов, неизменных по ключу (маски, отрисовки): strong ETag
+от ключа, Cache-Control: immutable, условные запросы и диапазоны байт.
+
+- If-None-Match (список ETag или *) -> 304 без чтения и отрисовки;
+- Range: bytes=a-b / a- / -n -> 206 с Content-Range, за пределами размера
+  -> 416; несколько диапазонов сразу не поддерживаем — отдаём всё (200),
+  как разрешает RFC 9110;
+- If-Range с другим ETag -> Range игнорируется, отдаём всё.
+"""
+import re
+from typing import Callable, Optional, Tuple, Union
+
+from fastapi import Request, Response
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_UNSATISFIABLE = "unsatisfiable"
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match: слабое сравнение (W/"x" совпадает с "x"), * — любой."""
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def parse_range(header: str, size: int) -> Union[None, str, Tuple[int, int]]:
+    """(первый, последний байт включительно), _UNSATISFIABLE или None — Range не применяем."""
+    m = _RANGE_RE.match(header.strip())
+    if m is None:
+        return None  # другие единицы, несколько диапазонов, мусор
+    first, last = m.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # суффикс: последние n байт
+        n = int(last)
+        if n == 0 or size == 0:
+            return _UNSATISFIABLE
+        return max(0, size - n), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return _UNSATISFIABLE
+    if end < start:
+        return None
+    return start, end
+
+
+def immutable_response(
+    request: Request,
+    etag: str,
+    media_type: str,
+    load: Callable[[], bytes],
+    headers: Optional[dict] = None,
+) -> Response:
+    """
+    Ответ по неизменному ресурсу. load() вызывается, только если тело нужно
+    (не 304). Синхронная: звать через run_in_threadpool, load читает/рисует.
+    """
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes", **(headers or {})}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    data = load()
+    size = len(data)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range == _UNSATISFIABLE:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            return Response(
+                content=data[start : end + 1],
+                status_code=206,
+                media_type=media_type,
+                headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"},
+            )
+    return Response(content=data, media_type=media_type, headers=headers)
@@ -0,0 +1,301 @@
+# app/jobs.py
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from uuid import uuid4
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.concurrency import Overloaded
+from app.config import (
+    JOB_EVENTS_RETENTION,
+    JOB_MAX_QUEUE,
+    JOB_OVERLOAD_BACKOFF_MAX_S,
+    JOB_OVERLOAD_RETRIES,
+    JOB_WORKERS,
+    MEDIA_ROOT,
+)
+from app.db import crud, models, schemas
+from app.db.base import SessionLocal
+from app.segmentation.cache import mask_url
+from app.segmentation.core import SEGMENTATION_METHODS
+from app.segmentation.executor import run_segmentation
+from app.segmentation.service import iter_cached_masks, segment_kwargs
+from app.segmentation.volume import iter_volume_masks
+from app.yolo.pr2_yolo import PredictOptions, pr2_overlay_url
+from app.yolo.workers import predict_stored_image
+
+logger = logging.getLogger(__name__)
+
+# publish(event, data) — можно вызывать из любого потока
+Publish = Callable[[str, Dict[str, Any]], None]
+JobHandler = Callable[[models.Job, Publish], Awaitable[Dict[str, Any]]]
+T = TypeVar("T")
+
+
+class JobEvents:
+    """История событий задачи + ожидание новых (для SSE, в т.ч. подключившихся позже)."""
+
+    def __init__(self) -> None:
+        self.history: List[Tuple[str, Dict[str, Any]]] = []
+        self.finished = False
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, data: Dict[str, Any], final: bool = False) -> None:
+        # только из потока event loop (см. JobQueue._publisher)
+        self.history.append((event, data))
+        if final:
+            self.finished = True
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def stream(self) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        idx = 0
+        while True:
+            changed = self._changed
+            while idx < len(self.history):
+                yield self.history[idx]
+                idx += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+
+class JobQueue:
+    """
+    Локальная очередь задач без внешнего брокера: asyncio.Queue + N воркеров
+    в event loop приложения. Состояние каждой задачи хранится в таблице jobs,
+    незавершённые задачи подхватываются заново при старте.
+    """
+
+    def __init__(self, workers: int, max_queue: int, retention: int):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.retention = retention
+        self._handlers: Dict[str, JobHandler] = {}
+        self._events: "OrderedDict[str, JobEvents]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [self._loop.create_task(self._worker()) for _ in range(self.workers)]
+
+        # задачи, не доделанные прошлым процессом, запускаем заново (результаты кэшируются)
+        for job_id in await run_in_threadpool(_requeue_unfinished):
+            self._enqueue(job_id)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, db: Session, kind: str, image_id: int, params: Dict[str, Any]) -> models.Job:
+        """Только из потока event loop (async-эндпоинты): очередь и события — asyncio."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue is None:
+            raise RuntimeError("Job queue is not started")
+        if self._queue.qsize() >= self.max_queue:
+            raise Overloaded()
+
+        job = crud.create_job(db, job_id=uuid4().hex, kind=kind, image_id=image_id, params=params)
+        self._enqueue(job.id)
+        return job
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def events(self, job_id: str) -> Optional[JobEvents]:
+        return self._events.get(job_id)
+
+    def _enqueue(self, job_id: str) -> None:
+        self._events[job_id] = JobEvents()
+        while len(self._events) > self.retention:
+            self._events.popitem(last=False)
+        self._events[job_id].publish("status", {"status": "queued"})
+        self._queue.put_nowait(job_id)
+
+    def _publisher(self, events: JobEvents) -> Publish:
+        loop = self._loop
+
+        def publish(event: str, data: Dict[str, Any]) -> None:
+            loop.call_soon_threadsafe(events.publish, event, data)
+
+        return publish
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:  # noqa: BLE001 — воркер не должен умирать
+                logger.exception("Job %s crashed", job_id)
+
+    async def _run(self, job_id: str) -> None:
+        events = self._events.get(job_id) or JobEvents()
+        # запись в БД синхронная — в пуле потоков, не в event loop
+        job = await run_in_threadpool(_set_job_status, job_id, "running")
+        if job is None:
+            return
+        events.publish("status", {"status": "running"})
+
+        try:
+            result = await self._handlers[job.kind](job, self._publisher(events))
+        except Exception as exc:  # noqa: BLE001 — ошибка сохраняется в задаче
+            logger.exception("Job %s failed", job_id)
+            await run_in_threadpool(_set_job_status, job_id, "failed", error=str(exc))
+            final = ("failed", {"status": "failed", "error": str(exc)})
+        else:
+            await run_in_threadpool(_set_job_status, job_id, "done", result=result)
+            final = ("done", {"status": "done", "result": result})
+
+        # события из потоков могли ещё не долететь — финальное ставим за ними
+        self._loop.call_soon(events.publish, *final, True)
+
+
+def _requeue_unfinished() -> List[str]:
+    with SessionLocal() as db:
+        jobs = crud.get_unfinished_jobs(db)
+        for job in jobs:
+            if job.status == "running":
+                crud.update_job_status(db, job.id, "queued")
+        return [job.id for job in jobs]
+
+
+def _set_job_status(job_id: str, status: str, **fields: Any) -> Optional[models.Job]:
+    with SessionLocal() as db:
+        return crud.update_job_status(db, job_id, status, **fields)
+
+
+def _get_image(image_id: int) -> Optional[models.Image]:
+    with SessionLocal() as db:
+        return crud.get_image(db, image_id)
+
+
+async def _retry_overloaded(call: Callable[[], Awaitable[T]]) -> T:
+    """
+    Фоновой задаче некуда спешить: на Overloaded ждём и пробуем снова, пауза
+    от Retry-After удваивается до JOB_OVERLOAD_BACKOFF_MAX_S. После
+    JOB_OVERLOAD_RETRIES повторов задача завершается ошибкой.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except Overloaded as exc:
+            if attempt >= JOB_OVERLOAD_RETRIES:
+                raise RuntimeError(f"Server stayed busy after {attempt + 1} attempts") from exc
+            await asyncio.sleep(min(exc.retry_after * 2**attempt, JOB_OVERLOAD_BACKOFF_MAX_S))
+            attempt += 1
+
+
+# ---------- обработчики ----------
+
+def _segment_job_sync(image_id: int, params: schemas.SegmentAllRequest, publish: Publish) -> Dict[str, Any]:
+    with SessionLocal() as db:
+        image = crud.get_image(db, image_id)
+        if image is None:
+            raise LookupError("Image not found")
+
+        results: Dict[str, schemas.SegmentationRead] = {}
+        # маски из кэша уходят сразу, остальные — по мере готовности
+        for method_name, cache_key, rel_path in iter_cached_masks(
+            MEDIA_ROOT / image.preview_path, params
+        ):
+            seg = crud.get_or_create_segmentation(
+                db,
+                image_id=image.id,
+                method=method_name,
+                result_path=rel_path,
+                params=params.model_dump(),
+                cache_key=cache_key,
+            )
+            item = schemas.SegmentationRead(
+                id=seg.id,
+                method=seg.method,
+                result_url=mask_url(seg.result_path),
+            )
+            results[method_name] = item
+            publish("mask", item.model_dump())
+
+    return schemas.SegmentationBatchResponse(
+        image_id=image_id,
+        results=[results[m] for m in SEGMENTATION_METHODS],
+    ).model_dump()
+
+
+async def _segment_job(job: models.Job, publish: Publish) -> Dict[str, Any]:
+    params = schemas.SegmentAllRequest(**job.params)
+    # через segmentation_gate, как и /segment/*: задачи не обгоняют лимиты HTTP-запросов
+    return await _retry_overloaded(
+        lambda: run_segmentation(_segment_job_sync, job.image_id, params, publish)
+    )
+
+
+def _segment_volume_job_sync(
+    image_id: int, params: schemas.SegmentAllRequest, publish: Publish
+) -> Dict[str, Any]:
+    with SessionLocal() as db:
+        image = crud.get_image(db, image_id)
+    if image is None:
+        raise LookupError("Image not found")
+    if not image.volume_path:
+        raise ValueError("Image is not a multi-frame volume")
+
+    slices = []
+    for index, rel_paths in iter_volume_masks(MEDIA_ROOT / image.volume_path, segment_kwargs(params)):
+        item = schemas.VolumeSliceMasks(
+            index=index,
+            results={m: mask_url(rel, m) for m, rel in rel_paths.items()},
+        )
+        slices.append(item)
+        publish("slice", item.model_dump())
+
+    return schemas.VolumeSegmentationResponse(
+        image_id=image_id,
+        depth=len(slices),
+        slices=slices,
+    ).model_dump()
+
+
+async def _segment_volume_job(job: models.Job, publish: Publish) -> Dict[str, Any]:
+    params = schemas.SegmentAllRequest(**job.params)
+    return await _retry_overloaded(
+        lambda: run_segmentation(_segment_volume_job_sync, job.image_id, params, publish)
+    )
+
+
+async def _pr2_job(job: models.Job, publish: Publish) -> Dict[str, Any]:
+    options = schemas.Pr2Options(**(job.params or {}))
+    image = await run_in_threadpool(_get_image, job.image_id)
+    if image is None:
+        raise LookupError("Image not found")
+
+    rel_result_path, detections = await _retry_overloaded(
+        lambda: predict_stored_image(
+            image, PredictOptions(options.mode, options.imgsz, options.conf, options.iou)
+        )
+    )
+
+    return schemas.Pr2Result(
+        image_id=image.id,
+        overlay_url=pr2_overlay_url(image.id, rel_result_path),
+        detections=[schemas.Pr2Detection(**d) for d in detections],
+    ).model_dump()
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_MAX_QUEUE, JOB_EVENTS_RETENTION)
+job_queue.register("segment_all", _segment_job)
+job_queue.register("segment_volume", _segment_volume_job)
+job_queue.register("pr2", _pr2_job)
@@ -2,14 +2,22 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
 
-from app.config import MEDIA_ROOT
+from app import metrics
+from app.config import MEDIA_ROOT, METRICS_ENABLED, PR2_WARMUP_ON_STARTUP
 from app.db.base import Base, engine
-from app.routers import images, pr2
+from app.db.migrate import add_missing_columns
+from app.jobs import job_queue
+from app.routers import images, jobs, masks, pr2
+from app.segmentation.executor import segmentation_gate, shutdown_executors
+from app.shm import array_pool
+from app.yolo.workers import pr2_batcher, shutdown_inference_pool, warm_up_inference
 
 # создаём таблицы
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
 
 app = FastAPI(title="Medical Segmentation API")
 
@@ -29,19 +37,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# латентность запросов + Server-Timing по стадиям (внешний слой, чтобы учесть всё)
+if METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware, timing_allow_origin=origins)
+    metrics.register_gauge("pr2_queue_depth", "PR2 requests waiting for a batch", lambda: pr2_batcher.queue_depth)
+    metrics.register_gauge("pr2_pending", "PR2 requests queued or running", lambda: pr2_batcher.pending)
+    metrics.register_gauge(
+        "segmentation_queue_depth", "Segmentation requests waiting for a slot", lambda: segmentation_gate.queued
+    )
+    metrics.register_gauge("jobs_queue_depth", "Background jobs waiting for a worker", lambda: job_queue.queue_depth)
+
 # роутеры
 app.include_router(images.router)
 app.include_router(pr2.router)
+app.include_router(jobs.router)
+app.include_router(masks.router)
 
 # статика (uploads/results)
 app.mount("/static", StaticFiles(directory=str(MEDIA_ROOT)), name="static")
 
 
+@app.on_event("startup")
+async def _start_jobs():
+    await job_queue.start()
+
+
+@app.on_event("startup")
+async def _warm_up_pr2():
+    # веса + холостой прогон заранее, чтобы первый пользователь не ждал загрузку модели
+    if PR2_WARMUP_ON_STARTUP:
+        await run_in_threadpool(warm_up_inference)
+
+
+@app.on_event("shutdown")
+async def _shutdown_executors():
+    await job_queue.stop()
+    await pr2_batcher.close()
+    shutdown_inference_pool()
+    shutdown_executors()
+    array_pool.close()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus (пусто при METRICS_ENABLED = False)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # опционально: если зайти напрямую на backend по /
 @app.get("/", include_in_schema=False)
 def root():
@@ -0,0 +1,268 @@
+# app/metrics.py
+"""
+Метрики в формате Prometheus (/metrics) и Server-Timing по стадиям запроса.
+
+- stage("name") / @timed("name") — время стадии: в гистограмму
+  stage_duration_seconds{stage=...} и в список стадий текущего запроса
+  (contextvar, переходит в run_in_threadpool и в пул потоков сегментации;
+  из пулов процессов стадии не возвращаются);
+- MetricsMiddleware — http_request_duration_seconds и заголовок
+  Server-Timing (сумма по одноимённым стадиям + total);
+- count_bytes(kind, n) — записанные на диск байты;
+- register_gauge(name, help, fn) — значения, которые читаются при /metrics
+  (глубины очередей).
+
+При METRICS_ENABLED = False timed возвращает функцию как есть, stage —
+пустой контекст-менеджер, middleware не подключается.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.config import METRICS_ENABLED
+
+# границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}" for k, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> (счётчики по корзинам + переполнение, сумма)
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][i] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        for key, (counts, total) in items:
+            acc = 0
+            for bound, n in zip((*map(_fmt, self.buckets), "+Inf"), counts):
+                acc += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {acc}")
+        return lines
+
+
+class Gauge:
+    """Значение на момент /metrics: fn() -> число."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name, self.help, self.fn = name, help, fn
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self.fn())
+        except Exception:  # noqa: BLE001 — сломанный gauge не должен ронять /metrics
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_fmt(value)}"]
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+STAGE_LATENCY = Histogram("stage_duration_seconds", "Latency of request stages", ("stage",))
+BYTES_WRITTEN = Counter("bytes_written_total", "Bytes written to disk", ("kind",))
+MODEL_LOAD = Histogram(
+    "model_load_seconds", "PR2 model load and warm-up time", ("backend",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+_metrics: List[Any] = [REQUEST_LATENCY, STAGE_LATENCY, BYTES_WRITTEN, MODEL_LOAD]
+
+# стадии текущего запроса: [(имя, секунды)]; None — вне запроса
+_request_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_stages", default=None
+)
+
+
+def register_gauge(name: str, help: str, fn: Callable[[], float]) -> None:
+    _metrics.append(Gauge(name, help, fn))
+
+
+def record_stage(name: str, seconds: float) -> None:
+    if not METRICS_ENABLED:
+        return
+    STAGE_LATENCY.observe(seconds, name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+@contextlib.contextmanager
+def _stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - t0)
+
+
+def stage(name: str):
+    """with stage("decode"): ... — время блока как стадия name."""
+    if not METRICS_ENABLED:
+        return contextlib.nullcontext()
+    return _stage(name)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Декоратор: каждый вызов функции — стадия name."""
+
+    def decorate(fn: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - t0)
+
+        return wrapper
+
+    return decorate
+
+
+def count_bytes(kind: str, n: int) -> None:
+    if METRICS_ENABLED:
+        BYTES_WRITTEN.inc(kind, value=n)
+
+
+def count_file_bytes(kind: str, path) -> None:
+    """Как count_bytes, для файлов, которые пишет сам OpenCV (stat — только при включённых метриках)."""
+    if METRICS_ENABLED:
+        BYTES_WRITTEN.inc(kind, value=path.stat().st_size)
+
+
+def observe_model_load(backend: str, seconds: float) -> None:
+    if METRICS_ENABLED:
+        MODEL_LOAD.observe(seconds, backend)
+
+
+def render() -> str:
+    if not METRICS_ENABLED:
+        return ""
+    lines: List[str] = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing: одноимённые стадии суммируются, порядок — первого появления."""
+    summed: Dict[str, List[float]] = {}
+    for name, seconds in stages:
+        entry = summed.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [
+        f"{name};dur={seconds * 1e3:.2f}" + (f';desc="x{n}"' if n > 1 else "")
+        for name, (seconds, n) in summed.items()
+    ]
+    parts.append(f"total;dur={total * 1e3:.2f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: латентность запросов по шаблону маршрута и Server-Timing.
+    timing_allow_origin — для Timing-Allow-Origin (иначе браузер не покажет
+    Server-Timing кросс-доменному фронту).
+    """
+
+    def __init__(self, app, timing_allow_origin: Sequence[str] = ()):
+        self.app = app
+        self.timing_allow_origin = ", ".join(timing_allow_origin).encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages: List[Tuple[str, float]] = []
+        token = _request_stages.set(stages)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stages, time.perf_counter() - t0).encode("latin-1")))
+                if self.timing_allow_origin:
+                    headers.append((b"timing-allow-origin", self.timing_allow_origin))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stages.reset(token)
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - t0,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status),
+            )
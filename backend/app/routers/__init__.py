@@ -1 +1 @@
-from . import images, pr2  # чтобы from app.routers import images, pr2 работало
+from . import images, jobs, masks, pr2  # чтобы from app.routers import images, jobs, pr2 работало
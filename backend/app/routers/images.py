@@ -1,27 +1,40 @@
 # /home/korasad/Analis/webapp/backend/app/routers/images.py
-import shutil
+import hashlib
 from pathlib import Path
+from typing import BinaryIO
 from uuid import uuid4
 
+import numpy as np
+
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app.config import (
     MEDIA_ROOT,
-    RESULTS_DIR,
-    RESULTS_SUBDIR,
+    UPLOAD_CHUNK_SIZE,
     UPLOAD_DIR,
     UPLOAD_SUBDIR,
+    VOLUME_SUBDIR,
 )
+from app.concurrency import Overloaded
 from app.db import crud, models, schemas
 from app.db.deps import get_db
-from app.segmentation.core import (
-    dicom_to_rgb,
-    load_rgb_image,
-    save_mask,
-    save_rgb_image,
-    segment_all_methods,
+from app.metrics import count_bytes, stage
+from app.segmentation.cache import image_cache, mask_cache, mask_url, png_cache
+from app.segmentation.executor import run_segmentation
+from app.segmentation.core import decode_image_bytes
+from app.segmentation.interactive import region_cache
+from app.segmentation.renders import render_cache
+from app.segmentation.service import (
+    region_growing_cached,
+    save_previews,
+    segment_cached,
+    segment_sweep,
+    segment_volume,
 )
+from app.segmentation.volume import decode_dicom_upload
+from app.shm import array_pool
 
 router = APIRouter(prefix="/api/images", tags=["images"])
 
@@ -30,57 +43,144 @@ def _build_static_url(rel_path: str) -> str:
     return f"/static/{rel_path}"
 
 
+def _write_chunk(f: BinaryIO, digest: "hashlib._Hash", chunk: bytes) -> None:
+    digest.update(chunk)
+    f.write(chunk)
+
+
+async def _stream_to_disk(file: UploadFile, path: Path) -> tuple[int, str]:
+    """
+    Копируем загрузку на диск кусками по UPLOAD_CHUNK_SIZE, не блокируя event loop.
+    Попутно считаем sha256; в памяти держим только текущий кусок.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    f = await run_in_threadpool(path.open, "wb")
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            await run_in_threadpool(_write_chunk, f, digest, chunk)
+    finally:
+        await run_in_threadpool(f.close)
+    return size, digest.hexdigest()
+
+
+def _decode_upload(path: Path, is_dicom: bool, volume_path: Path) -> tuple[np.ndarray, int]:
+    """
+    Декодирование записанной загрузки без копии в памяти: картинка — через
+    mmap файла, DICOM — по пути (несжатые пиксели тоже через memmap).
+    Многокадровый DICOM раскладывается по срезам в volume_path.
+    ValueError — файл не декодируется.
+    """
+    if is_dicom:
+        return decode_dicom_upload(path, volume_path)
+    if path.stat().st_size == 0:
+        raise ValueError("Empty file")
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    try:
+        return decode_image_bytes(data), 1
+    finally:
+        data._mmap.close()  # до переименования файла (Windows не даст переименовать открытый)
+
+
+def _discard_upload(part_path: Path, volume_path: Path) -> None:
+    part_path.unlink(missing_ok=True)
+    volume_path.unlink(missing_ok=True)
+    volume_path.with_suffix(".tmp.npy").unlink(missing_ok=True)
+
+
+def _image_read(image: models.Image) -> schemas.ImageRead:
+    previews = {tier: _build_static_url(rel) for tier, rel in (image.preview_tiers or {}).items()}
+    previews["full"] = _build_static_url(image.preview_path)
+    return schemas.ImageRead(
+        id=image.id,
+        original_filename=image.original_filename,
+        is_dicom=image.is_dicom,
+        width=image.width,
+        height=image.height,
+        preview_url=_build_static_url(image.preview_path),
+        depth=image.depth or 1,
+        previews=previews,
+    )
+
+
+def _files_exist(image: models.Image) -> bool:
+    paths = [image.stored_path, image.preview_path, *(image.preview_tiers or {}).values()]
+    if image.volume_path:
+        paths.append(image.volume_path)
+    return all((MEDIA_ROOT / rel).exists() for rel in paths)
+
+
 @router.post("/upload", response_model=schemas.ImageRead)
 async def upload_image(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
 ):
     ext = Path(file.filename).suffix.lower()
-    uid = uuid4().hex
 
     if not ext:
         ext = ".bin"
 
-    stored_name = f"{uid}{ext}"
-    stored_rel = f"{UPLOAD_SUBDIR}/{stored_name}"
-    stored_path = UPLOAD_DIR / stored_name
+    # сначала пишем во временный файл: имя зависит от содержимого, которое ещё не прочитано
+    part_path = UPLOAD_DIR / f"{uuid4().hex}.part"
+    try:
+        with stage("upload_receive"):
+            size, content_hash = await _stream_to_disk(file, part_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    count_bytes("upload", size)
 
-    with stored_path.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # такой файл уже загружали — отдаём существующую запись, ничего не декодируя
+    with stage("db"):
+        existing = crud.get_image_by_content_hash(db, content_hash)
+    if existing is not None and await run_in_threadpool(_files_exist, existing):
+        await run_in_threadpool(part_path.unlink)
+        return _image_read(existing)
 
     is_dicom = ext == ".dcm"
 
-    if is_dicom:
-        img_rgb = dicom_to_rgb(stored_path)
-    else:
-        # читаем и конвертим все в PNG для унификации
-        img_rgb = load_rgb_image(stored_path)
-
-    h, w = img_rgb.shape[:2]
-
-    preview_name = f"{uid}.png"
-    preview_rel = f"{UPLOAD_SUBDIR}/{preview_name}"
-    preview_path = UPLOAD_DIR / preview_name
-    save_rgb_image(img_rgb, preview_path)
-
-    image = crud.create_image(
-        db,
-        original_filename=file.filename,
-        stored_path=stored_rel,
-        preview_path=preview_rel,
-        is_dicom=is_dicom,
-        width=w,
-        height=h,
-    )
+    # декодируем до переименования, в пуле потоков: битый файл не попадает в uploads/.
+    # Всё конвертим в PNG для унификации (DICOM — одноканальным PNG).
+    # Многокадровый DICOM раскладываем по срезам, превью — средний срез.
+    # ValueError: не картинка, не DICOM, цветной или неполный многокадровый DICOM
+    volume_rel = f"{UPLOAD_SUBDIR}/{VOLUME_SUBDIR}/{content_hash}.npy"
+    try:
+        img, depth = await run_in_threadpool(_decode_upload, part_path, is_dicom, MEDIA_ROOT / volume_rel)
+    except BaseException as exc:
+        await run_in_threadpool(_discard_upload, part_path, MEDIA_ROOT / volume_rel)
+        if isinstance(exc, ValueError):
+            raise HTTPException(status_code=400, detail="Uploaded file could not be decoded")
+        raise
+    if depth == 1:
+        volume_rel = None
 
-    return schemas.ImageRead(
-        id=image.id,
-        original_filename=image.original_filename,
-        is_dicom=image.is_dicom,
-        width=image.width,
-        height=image.height,
-        preview_url=_build_static_url(image.preview_path),
-    )
+    # content-addressed хранение: одинаковые файлы ложатся в одно и то же место
+    stored_name = f"{content_hash}{ext}"
+    stored_rel = f"{UPLOAD_SUBDIR}/{stored_name}"
+    await run_in_threadpool(part_path.replace, UPLOAD_DIR / stored_name)
+
+    h, w = img.shape[:2]
+
+    preview_rel = f"{UPLOAD_SUBDIR}/{content_hash}.png"
+    preview_tiers = await run_in_threadpool(save_previews, img, content_hash)
+
+    with stage("db"):
+        image = crud.create_image(
+            db,
+            original_filename=file.filename,
+            stored_path=stored_rel,
+            preview_path=preview_rel,
+            is_dicom=is_dicom,
+            width=w,
+            height=h,
+            content_hash=content_hash,
+            depth=depth,
+            volume_path=volume_rel,
+            preview_tiers=preview_tiers,
+        )
+
+    return _image_read(image)
 
 
 @router.post("/{image_id}/segment/all", response_model=schemas.SegmentationBatchResponse)
@@ -94,48 +194,180 @@ async def segment_all(
         raise HTTPException(status_code=404, detail="Image not found")
 
     img_path = MEDIA_ROOT / image.preview_path
-    img_rgb = load_rgb_image(img_path)
-
-    # seed_y/seed_x -> (row, col)
-    seed = (params.region_growing.seed_y, params.region_growing.seed_x)
-
-    masks = segment_all_methods(
-        img_rgb,
-        manual_thresh=params.manual_thresh,
-        adaptive_block_size=params.adaptive_block_size,
-        adaptive_C=params.adaptive_C,
-        region_seed=seed,
-        region_diff_thresh=params.region_growing.diff_thresh,
-        watershed_fg_fraction=params.watershed_fg_fraction,
-    )
 
+    try:
+        cached = await run_segmentation(segment_cached, img_path, params)
+    except Overloaded as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="Segmentation queue is full, try again later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
 
-    results_out: list[schemas.SegmentationRead] = []
-
-    # сохраняем маски и создаём записи в БД
-    for method_name, mask in masks.items():
-        out_name = f"{image.id}_{method_name}.png"
-        rel_path = f"{RESULTS_SUBDIR}/{out_name}"
-        full_path = RESULTS_DIR / out_name
-        save_mask(mask, full_path)
-
-        seg = crud.create_segmentation(
+    # все записи одной транзакцией; повторный запрос с теми же параметрами
+    # отдаёт уже существующие записи
+    with stage("db"):
+        seg_ids = crud.get_or_create_segmentations_bulk(
             db,
             image_id=image.id,
-            method=method_name,
-            result_path=rel_path,
+            items=[(method_name, rel_path, cache_key) for method_name, cache_key, rel_path in cached],
             params=params.model_dump(),
         )
 
-        results_out.append(
-            schemas.SegmentationRead(
-                id=seg.id,
-                method=seg.method,
-                result_url=_build_static_url(seg.result_path),
-            )
+    results_out = [
+        schemas.SegmentationRead(
+            id=seg_id,
+            method=method_name,
+            result_url=mask_url(rel_path),
         )
+        for seg_id, (method_name, _, rel_path) in zip(seg_ids, cached)
+    ]
 
     return schemas.SegmentationBatchResponse(
         image_id=image.id,
         results=results_out,
     )
+
+
+@router.post("/{image_id}/segment/region-growing", response_model=schemas.RegionGrowingResponse)
+async def segment_region_growing(
+    image_id: int,
+    params: schemas.RegionGrowingRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    Только region growing — для кликов seed за seed'ом.
+    engine="tree" (по умолчанию): α-дерево строится раз на изображение, любой
+    seed и порог — выбор узла по готовой разметке (маски не как у band).
+    engine="band": маски как у /segment/all с band; из кэша отвечаются только
+    клики в ту же область с тем же порогом.
+    """
+    image = crud.get_image(db, image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    try:
+        item = await run_segmentation(region_growing_cached, MEDIA_ROOT / image.preview_path, params)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Overloaded as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="Segmentation queue is full, try again later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
+    total = image.width * image.height
+    return schemas.RegionGrowingResponse(
+        image_id=image.id,
+        area=item["area"],
+        area_fraction=round(item["area"] / total, 6) if total else 0.0,
+        bbox=item["bbox"],
+        cached=item["cached"],
+        rle=item.get("rle"),
+        result_url=mask_url(item["rel_path"]) if "rel_path" in item else None,
+    )
+
+
+@router.post("/{image_id}/segment/sweep", response_model=schemas.SegmentSweepResponse)
+async def segment_sweep_param(
+    image_id: int,
+    params: schemas.SegmentSweepRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    Перебор одного параметра (manual_thresh, adaptive_C или
+    watershed_fg_fraction) за один проход: площадь и bbox маски на каждое
+    значение, для output="masks" — и сами маски. Маски кладутся в тот же
+    кэш, так что /segment/all с выбранным значением их не пересчитывает.
+    """
+    image = crud.get_image(db, image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    try:
+        items = await run_segmentation(segment_sweep, MEDIA_ROOT / image.preview_path, params)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Overloaded as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="Segmentation queue is full, try again later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
+    total = image.width * image.height
+    return schemas.SegmentSweepResponse(
+        image_id=image.id,
+        parameter=params.parameter,
+        results=[
+            schemas.SweepResult(
+                value=item["value"],
+                method=item["method"],
+                area=item["area"],
+                area_fraction=round(item["area"] / total, 6) if total else 0.0,
+                bbox=item["bbox"],
+                result_url=mask_url(item["rel_path"]) if "rel_path" in item else None,
+            )
+            for item in items
+        ],
+    )
+
+
+@router.post(
+    "/{image_id}/segment/volume",
+    response_model=schemas.VolumeSegmentationResponse,
+)
+async def segment_volume_all(
+    image_id: int,
+    params: schemas.SegmentAllRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    Все методы по каждому срезу многокадрового DICOM. Срезы считаются
+    в пуле процессов по несколько штук, маски пишутся по мере готовности;
+    повтор с теми же параметрами отдаёт уже посчитанные маски.
+    """
+    image = crud.get_image(db, image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not image.volume_path:
+        raise HTTPException(status_code=400, detail="Image is not a multi-frame volume")
+
+    try:
+        slices = await run_segmentation(segment_volume, MEDIA_ROOT / image.volume_path, params)
+    except Overloaded as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="Segmentation queue is full, try again later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
+    return schemas.VolumeSegmentationResponse(
+        image_id=image.id,
+        depth=len(slices),
+        slices=[
+            schemas.VolumeSliceMasks(
+                index=index,
+                results={m: mask_url(rel, m) for m, rel in rel_paths.items()},
+            )
+            for index, rel_paths in slices
+        ],
+    )
+
+
+@router.get("/cache/stats")
+def cache_stats():
+    """
+    Счётчики попаданий/промахов кэша масок, PNG для /api/masks (в памяти и
+    отрисовок на диске), декодированных превью и region growing; сегменты
+    общей памяти для пулов процессов.
+    """
+    return {
+        "masks": mask_cache.stats(),
+        "mask_png": png_cache.stats(),
+        "renders": render_cache.stats(),
+        "images": image_cache.stats(),
+        "region_growing": region_cache.stats(),
+        "shared_memory": array_pool.stats(),
+    }
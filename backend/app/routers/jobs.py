@@ -0,0 +1,138 @@
+# app/routers/jobs.py
+import asyncio
+import json
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.concurrency import Overloaded
+from app.config import JOB_EVENTS_POLL_S
+from app.db import crud, models, schemas
+from app.db.base import SessionLocal
+from app.db.deps import get_db
+from app.jobs import job_queue
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+
+def _submit(db: Session, kind: str, image_id: int, params: dict) -> models.Job:
+    # из async-эндпоинтов: job_queue.submit трогает asyncio.Queue и события,
+    # это можно только в потоке event loop
+    if not crud.get_image(db, image_id):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        return job_queue.submit(db, kind, image_id, params)
+    except Overloaded as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="Job queue is full, try again later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
+
+def _job_read(job: models.Job) -> schemas.JobRead:
+    return schemas.JobRead(
+        id=job.id,
+        kind=job.kind,
+        image_id=job.image_id,
+        status=job.status,
+        result=job.result,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _load_job(job_id: str) -> Optional[schemas.JobRead]:
+    with SessionLocal() as db:
+        job = crud.get_job(db, job_id)
+        return _job_read(job) if job is not None else None
+
+
+@router.post("/segment/{image_id}", response_model=schemas.JobRead, status_code=202)
+async def submit_segment_all(
+    image_id: int,
+    params: schemas.SegmentAllRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    То же, что /api/images/{id}/segment/all, но в фоне: сразу возвращает id задачи.
+    """
+    return _job_read(_submit(db, "segment_all", image_id, params.model_dump()))
+
+
+@router.post("/segment-volume/{image_id}", response_model=schemas.JobRead, status_code=202)
+async def submit_segment_volume(
+    image_id: int,
+    params: schemas.SegmentAllRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    То же, что /api/images/{id}/segment/volume, но в фоне; по SSE приходит событие на каждый срез.
+    """
+    return _job_read(_submit(db, "segment_volume", image_id, params.model_dump()))
+
+
+@router.post("/pr2/{image_id}", response_model=schemas.JobRead, status_code=202)
+async def submit_pr2(
+    image_id: int,
+    options: Annotated[schemas.Pr2Options, Query()],
+    db: Session = Depends(get_db),
+):
+    """
+    То же, что /api/pr2/predict/{id}, но в фоне: сразу возвращает id задачи.
+    """
+    return _job_read(_submit(db, "pr2", image_id, options.model_dump()))
+
+
+@router.get("/{job_id}", response_model=schemas.JobRead)
+def get_job(job_id: str, db: Session = Depends(get_db)):
+    job = crud.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_read(job)
+
+
+@router.get("/{job_id}/events")
+def job_events(job_id: str, db: Session = Depends(get_db)):
+    """
+    Server-Sent Events: status (queued/running), mask (по одной на готовый метод),
+    в конце done (с result) или failed (с error).
+    """
+    job = crud.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    state = _job_read(job)
+    events = job_queue.events(job_id)
+
+    async def stream():
+        if events is None:
+            # истории в памяти уже нет — отдаём состояние из БД при каждой смене
+            # статуса, пока задача не завершится
+            current = state
+            yield _sse(current.status, current.model_dump())
+            while current.status not in ("done", "failed"):
+                await asyncio.sleep(JOB_EVENTS_POLL_S)
+                polled = await run_in_threadpool(_load_job, job_id)
+                if polled is None:
+                    return
+                if polled.status != current.status:
+                    yield _sse(polled.status, polled.model_dump())
+                current = polled
+            return
+        async for event, data in events.stream():
+            yield _sse(event, data)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
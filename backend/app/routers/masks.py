@@ -0,0 +1,135 @@
+# app/routers/masks.py
+"""
+Маски в компактном формате (.msk): PNG для фронта собирается при первом
+запросе (дальше — из памяти или дискового кэша отрисовок), API-клиенты могут
+забрать RLE (JSON) или сам .msk без кодирования картинки.
+
+Ключ маски — хэш содержимого превью + метод + параметры, поэтому ответ
+по ключу никогда не меняется: immutable + ETag, 304 и Range (app/http_cache.py).
+"""
+import json
+import re
+from pathlib import Path
+from typing import Dict, Literal
+
+import numpy as np
+from fastapi import APIRouter, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
+
+from app.config import RESULTS_DIR, VOLUME_SUBDIR
+from app.http_cache import immutable_response
+from app.segmentation.cache import mask_cache, png_cache
+from app.segmentation.core import SEGMENTATION_METHODS
+from app.segmentation.maskcodec import encode_png, mask_to_rle, read_layers
+from app.segmentation.renders import render_cache
+
+router = APIRouter(prefix="/api/masks", tags=["masks"])
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+MaskFormat = Literal["rle", "msk"]
+
+
+def _check_key(key: str) -> None:
+    if not _KEY_RE.match(key):
+        raise HTTPException(status_code=404, detail="Mask not found")
+
+
+def _png(cache_key: tuple, load) -> bytes:
+    """PNG из LRU в памяти, иначе с диска (render_cache), иначе load() -> маска -> PNG."""
+    data = png_cache.get(cache_key)
+    if data is None:
+        data = render_cache.get_or_render("-".join(cache_key) + ".png", lambda: encode_png(load()))
+        png_cache.put(cache_key, data)
+    return data
+
+
+def _png_response(request: Request, cache_key: tuple, etag: str, load) -> Response:
+    """Ответ PNG маски (в пуле потоков): 304 — без чтения и кодирования."""
+    return immutable_response(request, etag, "image/png", lambda: _png(cache_key, load))
+
+
+def _rle_json(payload: object) -> bytes:
+    # counts бывают длинными — сериализуем сами, без валидации pydantic
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def _volume_slice_path(key: str, index: int) -> Path:
+    _check_key(key)
+    path = RESULTS_DIR / VOLUME_SUBDIR / key / f"{index:05d}.msk"
+    if index < 0 or not path.exists():
+        raise HTTPException(status_code=404, detail="Mask not found")
+    return path
+
+
+def _volume_layers(key: str, index: int) -> Dict[str, np.ndarray]:
+    return read_layers(_volume_slice_path(key, index))
+
+
+def _stored_mask(key: str) -> np.ndarray:
+    _check_key(key)
+    mask = mask_cache.get(key)
+    if mask is None:
+        raise HTTPException(status_code=404, detail="Mask not found")
+    return mask
+
+
+@router.get("/volumes/{key}/{index}/{method}.png")
+async def volume_slice_png(key: str, index: int, method: str, request: Request):
+    """Маска одного метода для среза объёма, PNG."""
+    if method not in SEGMENTATION_METHODS:
+        raise HTTPException(status_code=404, detail="Mask not found")
+
+    def load() -> np.ndarray:
+        layers = _volume_layers(key, index)
+        if method not in layers:
+            raise HTTPException(status_code=404, detail="Mask not found")
+        return layers[method]
+
+    etag = f'"{key}-{index}-{method}"'
+    return await run_in_threadpool(_png_response, request, ("volume", key, str(index), method), etag, load)
+
+
+@router.get("/volumes/{key}/{index}")
+async def volume_slice(key: str, index: int, request: Request, format: MaskFormat = "rle"):
+    """Все методы среза одним ответом: {метод: RLE} или исходный многослойный .msk."""
+    path = _volume_slice_path(key, index)
+    etag = f'"{key}-{index}-{format}"'
+    if format == "msk":
+        return await run_in_threadpool(
+            immutable_response, request, etag, "application/octet-stream", path.read_bytes
+        )
+
+    def load() -> bytes:
+        return _rle_json({name: mask_to_rle(mask) for name, mask in read_layers(path).items()})
+
+    return await run_in_threadpool(immutable_response, request, etag, "application/json", load)
+
+
+@router.get("/{key}.png")
+async def mask_png(key: str, request: Request):
+    """Маска как PNG 0/255 (то, что раньше лежало в /static/results/masks)."""
+    _check_key(key)
+    return await run_in_threadpool(_png_response, request, ("mask", key), f'"{key}"', lambda: _stored_mask(key))
+
+
+@router.get("/{key}")
+async def mask_data(key: str, request: Request, format: MaskFormat = "rle"):
+    """
+    Маска без кодирования картинки: format=rle — JSON
+    {"size": [h, w], "order": "C", "counts": [...]} (первая серия — нули),
+    format=msk — байты .msk (см. app/segmentation/maskcodec.py).
+    """
+    _check_key(key)
+    etag = f'"{key}-{format}"'
+    path = mask_cache.path(key, "msk")
+    if format == "msk":
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Mask not found")
+        return await run_in_threadpool(
+            immutable_response, request, etag, "application/octet-stream", path.read_bytes
+        )
+    return await run_in_threadpool(
+        immutable_response, request, etag, "application/json", lambda: _rle_json(mask_to_rle(_stored_mask(key)))
+    )
+
@@ -1,40 +1,144 @@
 # app/routers/pr2.py
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import re
+from concurrent.futures import BrokenExecutor
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from app.concurrency import Overloaded
 from app.config import MEDIA_ROOT
-from app.db import crud, schemas
+from app.db import crud, models, schemas
 from app.db.deps import get_db
-from app.yolo.pr2_yolo import run_pr2_inference
+from app.http_cache import immutable_response
+from app.segmentation.encoding import PROFILES
+from app.yolo.pr2_yolo import PredictOptions, overlay_bytes, pr2_overlay_url
+from app.yolo.workers import pr2_batcher, predict_stored_image, result_cache_stats
 
 router = APIRouter(prefix="/api/pr2", tags=["pr2"])
 
 
-def _build_static_url(rel_path: str) -> str:
-    # такой же, как в images.py
-    return f"/static/{rel_path}"
+_OVERLAY_NAME_RE = re.compile(r"^[0-9A-Za-z_-]+\.(png|webp|jpg)$")
+
+
+async def _predict_image(image: models.Image, options: schemas.Pr2Options) -> schemas.Pr2Result:
+    try:
+        rel_result_path, detections = await predict_stored_image(
+            image, PredictOptions(options.mode, options.imgsz, options.conf, options.iou)
+        )
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Overloaded as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="PR2 inference pool is saturated, try again later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    except BrokenExecutor:
+        # исполнитель упал на этой пачке, пул уже пересоздаётся
+        raise HTTPException(
+            status_code=503,
+            detail="PR2 inference worker crashed, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+    return schemas.Pr2Result(
+        image_id=image.id,
+        overlay_url=pr2_overlay_url(image.id, rel_result_path),
+        detections=[schemas.Pr2Detection(**d) for d in detections],
+    )
+
+
+@router.post("/predict/batch", response_model=schemas.Pr2BatchResponse)
+async def pr2_predict_batch(
+    req: schemas.Pr2BatchRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    Запуск YOLO-модели ПР2 на нескольких изображениях сразу.
+    """
+    results: list[schemas.Pr2Result] = []
+    errors: list[schemas.Pr2BatchError] = []
+
+    images = []
+    for image_id in req.image_ids:
+        image = crud.get_image(db, image_id=image_id)
+        if image is None:
+            errors.append(schemas.Pr2BatchError(image_id=image_id, detail="Image not found"))
+        else:
+            images.append(image)
+
+    outcomes = await asyncio.gather(
+        *(_predict_image(image, req) for image in images),
+        return_exceptions=True,
+    )
+    for image, outcome in zip(images, outcomes):
+        if isinstance(outcome, HTTPException):
+            errors.append(schemas.Pr2BatchError(image_id=image.id, detail=str(outcome.detail)))
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results.append(outcome)
+
+    return schemas.Pr2BatchResponse(results=results, errors=errors)
 
 
 @router.post("/predict/{image_id}", response_model=schemas.Pr2Result)
-def pr2_predict(image_id: int, db: Session = Depends(get_db)):
+async def pr2_predict(
+    image_id: int,
+    options: Annotated[schemas.Pr2Options, Query()],
+    db: Session = Depends(get_db),
+):
     """
     Запуск YOLO-модели ПР2 на загруженном изображении.
+
+    ?mode=polygons|rle — маски экземпляров в detections, без отрисовки оверлея;
+    ?imgsz=&conf=&iou= — параметры predict.
     """
     image = crud.get_image(db, image_id=image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    # Берём исходное изображение (stored_path → uploads/uid.ext)
-    img_path = MEDIA_ROOT / image.stored_path
-    if not img_path.exists():
-        raise HTTPException(
-            status_code=404, detail="Stored image file not found on disk"
+    return await _predict_image(image, options)
+
+
+@router.get("/overlay/{image_id}/{name}")
+async def pr2_overlay(image_id: int, name: str, request: Request, db: Session = Depends(get_db)):
+    """
+    Оверлей PR2: рисуется при первом запросе по сохранённым детекциям, потом
+    отдаётся из кэша отрисовок. Имя задаёт исходник, веса и параметры predict,
+    так что ответ по нему не меняется: immutable + ETag, 304 и Range.
+    """
+    image = crud.get_image(db, image_id=image_id)
+    source = MEDIA_ROOT / image.stored_path if image else None
+    if (
+        source is None
+        or not _OVERLAY_NAME_RE.match(name)
+        or not name.startswith(f"{source.stem}_pr2_")
+    ):
+        raise HTTPException(status_code=404, detail="Overlay not found")
+    try:
+        return await run_in_threadpool(
+            immutable_response,
+            request,
+            f'"{name}"',
+            PROFILES["overlay"].media_type,
+            lambda: overlay_bytes(name, source),
         )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Overlay not found")
 
-    rel_result_path, detections = run_pr2_inference(img_path)
 
-    return schemas.Pr2Result(
-        image_id=image.id,
-        overlay_url=_build_static_url(rel_result_path),
-        detections=[schemas.Pr2Detection(**d) for d in detections],
-    )
+@router.get("/stats")
+def pr2_stats():
+    """Задержки запросов, достигнутые размеры пачек micro-batching и кэш результатов."""
+    return {
+        **pr2_batcher.stats.snapshot(),
+        "queue_depth": pr2_batcher.queue_depth,
+        "pending": pr2_batcher.pending,
+        "result_cache": dict(result_cache_stats),
+    }
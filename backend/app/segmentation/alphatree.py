@@ -0,0 +1,159 @@
+# app/segmentation/alphatree.py
+"""
+Region growing по α-дереву (движок "tree").
+
+α-компонента — связная (4-связность) область, в которой соседние пиксели
+отличаются не больше чем на α. С ростом α компоненты только сливаются,
+поэтому разметки на уровнях REGION_TREE_ALPHAS вложены друг в друга и
+образуют дерево (α-tree, quasi-flat zones). Строится оно по превью после
+медианы 5x5 (иначе шум рвёт однородные области на мелкие куски): одна
+cv2.connectedComponents на уровень по решётке 2h-1 x 2w-1, где между
+пикселями лежат «рёбра» |разность| <= α. От seed и diff_thresh разметки
+не зависят — дерево строится один раз на изображение.
+
+Область для (seed, diff_thresh): идём по уровням от наибольшего α <= diff_thresh
+вниз и берём первую однородную компоненту seed — её среднее отличается от
+опорной яркости seed (среднее окна 5x5, один шумный пиксель её не сбивает)
+не больше чем на diff_thresh, и её СКО не больше diff_thresh (яркость —
+по исходному превью). Такая маска — готовая разметка, без заливок.
+
+Если однородной компоненты нет (мягкая граница, плавный градиент — по ним
+α-связность «протекает»), ответ — одна волна band: 8-связная компонента seed
+в полосе опорная яркость ± diff_thresh, без пересчёта среднего.
+
+Это не band: маски с band/bfs в общем случае не совпадают, ключ кэша у
+движка свой.
+"""
+from typing import Callable, Dict, Iterable, Optional, Tuple, TypeVar
+
+import cv2
+import numpy as np
+
+from app.config import REGION_TREE_ALPHAS
+from app.segmentation.core import region_band
+
+T = TypeVar("T")
+# (среднее, СКО) яркости компоненты
+Stats = Tuple[float, float]
+
+# окно вокруг seed для опорной яркости: (2r+1) x (2r+1)
+SEED_WINDOW_RADIUS = 2
+# апертура медианы перед построением дерева
+SMOOTH_KSIZE = 5
+
+
+def alpha_labels(gray: np.ndarray, alpha: int, grid: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Метки α-компонент (4-связность), 1..n. grid — рабочий буфер
+    (2h-1, 2w-1) uint8 с единицами в узлах пикселей, чтобы не выделять заново.
+    """
+    h, w = gray.shape
+    if grid is None:
+        grid = np.zeros((2 * h - 1, 2 * w - 1), dtype=np.uint8)
+        grid[::2, ::2] = 1
+    # пиксели — в чётных узлах решётки, ребро между соседями — в узле между ними
+    grid[::2, 1::2] = cv2.absdiff(gray[:, 1:], gray[:, :-1]) <= alpha
+    grid[1::2, ::2] = cv2.absdiff(gray[1:], gray[:-1]) <= alpha
+    n, labels = cv2.connectedComponents(grid, connectivity=4, ltype=cv2.CV_32S)
+    if n <= np.iinfo(np.uint16).max + 1:
+        return labels[::2, ::2].astype(np.uint16)  # вдвое меньше места в кэше
+    return np.ascontiguousarray(labels[::2, ::2])
+
+
+def seed_reference(gray: np.ndarray, seed: Tuple[int, int]) -> float:
+    """Опорная яркость seed — среднее окна вокруг него (обрезанного краями)."""
+    sr, sc = seed
+    r = SEED_WINDOW_RADIUS
+    return float(gray[max(0, sr - r):sr + r + 1, max(0, sc - r):sc + r + 1].mean())
+
+
+def reference_band(gray: np.ndarray, seed: Tuple[int, int], diff_thresh: int) -> Tuple[int, int]:
+    """Полоса запасного ответа: опорная яркость seed ± diff_thresh."""
+    return region_band(seed_reference(gray, seed), diff_thresh)
+
+
+def component_stats(gray: np.ndarray, mask: np.ndarray) -> Stats:
+    mean, std = cv2.meanStdDev(gray, mask=mask)
+    return float(mean[0, 0]), float(std[0, 0])
+
+
+def seed_mask(shape: Tuple[int, int], seed: Tuple[int, int]) -> np.ndarray:
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[seed] = 255
+    return mask
+
+
+class AlphaTree:
+    """
+    Уровни α-дерева одного изображения. Разметки считаются при первом
+    обращении к уровню; build() — сразу все (для кэша по изображению).
+    """
+
+    def __init__(self, gray: np.ndarray, alphas: Iterable[int] = REGION_TREE_ALPHAS):
+        self.gray = gray
+        self.alphas = sorted(set(alphas))
+        self._levels: Dict[int, np.ndarray] = {}
+        self._smoothed: Optional[np.ndarray] = None
+        self._grid: Optional[np.ndarray] = None
+
+    def labels(self, alpha: int) -> np.ndarray:
+        labels = self._levels.get(alpha)
+        if labels is None:
+            if self._grid is None:
+                h, w = self.gray.shape
+                self._smoothed = cv2.medianBlur(self.gray, SMOOTH_KSIZE)
+                self._grid = np.zeros((2 * h - 1, 2 * w - 1), dtype=np.uint8)
+                self._grid[::2, ::2] = 1
+            labels = self._levels[alpha] = alpha_labels(self._smoothed, alpha, self._grid)
+        return labels
+
+    def build(self) -> "AlphaTree":
+        for alpha in self.alphas:
+            self.labels(alpha)
+        # сглаженное превью и решётка нужны только на время построения
+        self._smoothed = self._grid = None
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        # вместе с gray: пока дерево в кэше, превью живёт и после вытеснения из image_cache
+        return self.gray.nbytes + sum(labels.nbytes for labels in self._levels.values())
+
+    def component(self, alpha: int, node: int) -> Tuple[np.ndarray, Stats]:
+        """Маска компоненты node на уровне alpha и (среднее, СКО) её яркости."""
+        mask = cv2.compare(self.labels(alpha), node, cv2.CMP_EQ)
+        return mask, component_stats(self.gray, mask)
+
+    def region(
+        self,
+        seed: Tuple[int, int],
+        diff_thresh: int,
+        component: Optional[Callable[[int, int], Tuple[T, Stats]]] = None,
+    ) -> Optional[T]:
+        """
+        Однородная компонента seed на наибольшем уровне α <= diff_thresh
+        (см. модуль); None — такой нет. component(alpha, node) ->
+        (результат, (среднее, СКО)) — по умолчанию self.component (маска);
+        interactive подставляет свой, с кэшем.
+        """
+        component = component or self.component
+        reference = seed_reference(self.gray, seed)
+        for alpha in reversed(self.alphas):
+            if alpha > diff_thresh:
+                continue
+            result, (mean, std) = component(alpha, int(self.labels(alpha)[seed]))
+            if abs(mean - reference) <= diff_thresh and std <= diff_thresh:
+                return result
+        return None
+
+
+def region_growing_tree(gray: np.ndarray, seed: Tuple[int, int], diff_thresh: int) -> np.ndarray:
+    """Разовый запрос: строятся только нужные уровни, без кэша."""
+    mask = AlphaTree(gray).region(seed, diff_thresh)
+    if mask is not None:
+        return mask
+    lo, hi = reference_band(gray, seed, diff_thresh)
+    if lo > hi:
+        return seed_mask(gray.shape, seed)
+    _, labels = cv2.connectedComponents(cv2.inRange(gray, lo, hi), connectivity=8, ltype=cv2.CV_32S)
+    return cv2.compare(labels, int(labels[seed]), cv2.CMP_EQ)
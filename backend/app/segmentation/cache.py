@@ -0,0 +1,318 @@
+# app/segmentation/cache.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import (
+    IMAGE_CACHE_MEMORY_BYTES,
+    MASK_CACHE_MEMORY_BYTES,
+    MASK_CACHE_SUBDIR,
+    MASK_PNG_CACHE_BYTES,
+    MASK_STORAGE_FORMAT,
+    RESULTS_DIR,
+    RESULTS_SUBDIR,
+)
+from app.metrics import count_file_bytes, stage
+from app.segmentation.core import ImagePlanes, load_planes
+from app.segmentation.encoding import PROFILES
+from app.segmentation.maskcodec import unpack_mask, write_layers
+
+# меняем при изменении алгоритмов, чтобы старые маски не считались валидными
+MASK_CACHE_VERSION = 1
+
+_HASH_CHUNK = 1 << 20
+
+_hash_lock = threading.Lock()
+_hash_memo: Dict[str, tuple[int, int, str]] = {}
+
+
+def content_hash(path: Path) -> str:
+    """sha256 содержимого файла; пересчитывается только при смене mtime/размера."""
+    st = path.stat()
+    key = str(path)
+    with _hash_lock:
+        memo = _hash_memo.get(key)
+    if memo and memo[0] == st.st_mtime_ns and memo[1] == st.st_size:
+        return memo[2]
+
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _hash_lock:
+        _hash_memo[key] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def mask_cache_key(image_hash: str, method: str, params: Dict[str, Any]) -> str:
+    """Ключ маски: (хэш превью, метод, нормализованные параметры метода)."""
+    payload = json.dumps(
+        [MASK_CACHE_VERSION, image_hash, method, params],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MaskCache:
+    """
+    Двухуровневый кэш масок:
+    - память: LRU с бюджетом в байтах (сами массивы);
+    - диск: static/results/<subdir>/<key>.msk (бит на пиксель, PNG для фронта
+      собирается на лету в /api/masks) или <key>.png при fmt="png" —
+      переживает рестарт. PNG, записанные раньше, продолжают находиться.
+    """
+
+    def __init__(self, root: Path, rel_root: str, max_bytes: int, fmt: str = MASK_STORAGE_FORMAT):
+        if fmt not in ("msk", "png"):
+            raise ValueError(f"Неизвестный формат масок: {fmt}")
+        self.root = root
+        self.rel_root = rel_root
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self._mem: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def path(self, key: str, fmt: Optional[str] = None) -> Path:
+        return self.root / f"{key}.{fmt or self.fmt}"
+
+    def rel_path(self, key: str, fmt: Optional[str] = None) -> str:
+        return f"{self.rel_root}/{key}.{fmt or self.fmt}"
+
+    def _stored_format(self, key: str) -> Optional[str]:
+        """В каком формате маска лежит на диске (сначала текущий, потом второй)."""
+        for fmt in (self.fmt, "png" if self.fmt == "msk" else "msk"):
+            if self.path(key, fmt).exists():
+                return fmt
+        return None
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Относительный путь к закэшированной маске или None (без декодирования)."""
+        with self._lock:
+            mask = self._mem.get(key)
+            if mask is not None:
+                self._mem.move_to_end(key)
+                self.memory_hits += 1
+
+        if mask is not None:
+            fmt = self._stored_format(key)
+            if fmt is None:
+                # файл удалили руками — перезапишем из памяти, без пересчёта
+                self._write(key, mask)
+            return self.rel_path(key, fmt)
+
+        fmt = self._stored_format(key)
+        if fmt is not None:
+            with self._lock:
+                self.disk_hits += 1
+            return self.rel_path(key, fmt)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Сама маска: из памяти, иначе с диска (с подъёмом в память)."""
+        with self._lock:
+            mask = self._mem.get(key)
+            if mask is not None:
+                self._mem.move_to_end(key)
+                return mask
+        fmt = self._stored_format(key)
+        if fmt == "msk":
+            mask = unpack_mask(self.path(key, fmt).read_bytes())
+        elif fmt == "png":
+            mask = cv2.imread(str(self.path(key, fmt)), cv2.IMREAD_GRAYSCALE)
+        else:
+            mask = None
+        if mask is not None:
+            self._remember(key, mask)
+        return mask
+
+    def put(self, key: str, mask: np.ndarray, remember: bool = True) -> str:
+        """remember=False — только на диск (пакетная обработка: маска больше не понадобится)."""
+        self._write(key, mask)
+        if remember:
+            self._remember(key, mask)
+        return self.rel_path(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._mem),
+                "memory_bytes": self._mem_bytes,
+                "memory_budget_bytes": self.max_bytes,
+            }
+
+    def _write(self, key: str, mask: np.ndarray) -> None:
+        path = self.path(key)
+        if self.fmt == "msk":
+            write_layers(path, {"mask": mask})
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # пишем во временный файл и переименовываем, чтобы не отдать недописанный PNG
+        tmp = path.with_suffix(".tmp.png")
+        with stage("encode_mask"):
+            cv2.imwrite(str(tmp), mask, PROFILES["mask"].params)
+        count_file_bytes("mask", tmp)
+        tmp.replace(path)
+
+    def _remember(self, key: str, mask: np.ndarray) -> None:
+        if mask.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old.nbytes
+            self._mem[key] = mask
+            self._mem_bytes += mask.nbytes
+            while self._mem_bytes > self.max_bytes:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_bytes -= evicted.nbytes
+
+
+mask_cache = MaskCache(
+    RESULTS_DIR / MASK_CACHE_SUBDIR,
+    f"{RESULTS_SUBDIR}/{MASK_CACHE_SUBDIR}",
+    MASK_CACHE_MEMORY_BYTES,
+)
+
+
+def mask_url(rel_path: str, layer: Optional[str] = None) -> str:
+    """
+    URL маски для ответа API: PNG отдаёт /static как есть, .msk — /api/masks
+    (PNG собирается на лету). layer — слой многослойного файла (срезы объёма).
+    """
+    if not rel_path.endswith(".msk"):
+        return f"/static/{rel_path}"
+    parts = rel_path[: -len(".msk")].split("/")
+    if layer is None:
+        return f"/api/masks/{parts[-1]}.png"
+    # results/volumes/<key>/<index>.msk
+    return f"/api/masks/volumes/{parts[-2]}/{int(parts[-1])}/{layer}.png"
+
+
+class EncodedMaskCache:
+    """LRU уже закодированных ответов (PNG масок) с бюджетом в байтах."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._mem: "OrderedDict[Tuple[str, ...], bytes]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, ...]) -> Optional[bytes]:
+        with self._lock:
+            data = self._mem.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: Tuple[str, ...], data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= len(old)
+            self._mem[key] = data
+            self._mem_bytes += len(data)
+            while self._mem_bytes > self.max_bytes:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "items": len(self._mem),
+                "bytes": self._mem_bytes,
+                "budget_bytes": self.max_bytes,
+            }
+
+
+png_cache = EncodedMaskCache(MASK_PNG_CACHE_BYTES)
+
+
+class ImageCache:
+    """
+    LRU декодированных изображений (RGB/BGR/серый) с бюджетом в байтах.
+
+    Запись считается устаревшей, если у файла поменялись mtime или размер.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._mem: "OrderedDict[str, tuple[int, int, ImagePlanes]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: Path) -> ImagePlanes:
+        st = path.stat()
+        key = str(path)
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        planes = load_planes(path)
+        self._remember(key, st.st_mtime_ns, st.st_size, planes)
+        return planes
+
+    def invalidate(self, path: Path) -> None:
+        with self._lock:
+            entry = self._mem.pop(str(path), None)
+            if entry is not None:
+                self._mem_bytes -= entry[2].nbytes
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "items": len(self._mem),
+                "bytes": self._mem_bytes,
+                "budget_bytes": self.max_bytes,
+            }
+
+    def _remember(self, key: str, mtime_ns: int, size: int, planes: ImagePlanes) -> None:
+        if planes.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old[2].nbytes
+            self._mem[key] = (mtime_ns, size, planes)
+            self._mem_bytes += planes.nbytes
+            while self._mem_bytes > self.max_bytes:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_bytes -= evicted[2].nbytes
+
+
+image_cache = ImageCache(IMAGE_CACHE_MEMORY_BYTES)
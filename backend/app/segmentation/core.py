@@ -1,15 +1,23 @@
 # /home/korasad/Analis/webapp/backend/app/segmentation/core.py
+import math
+from dataclasses import dataclass
 from pathlib import Path
 from collections import deque
-from typing import Dict, Tuple
+from concurrent.futures import as_completed
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 
 import cv2
 import numpy as np
-import pydicom
+
+from app.metrics import count_file_bytes, timed
+from app.segmentation.dicom import read_dicom_frame
+from app.segmentation.encoding import PROFILES
+from app.segmentation.executor import submit
 
 
 # ---------- утилиты работы с изображениями ----------
 
+@timed("decode")
 def load_rgb_image(path: Path) -> np.ndarray:
     """Загрузка PNG/JPEG -> RGB."""
     img_bgr = cv2.imread(str(path))
@@ -19,43 +27,89 @@ def load_rgb_image(path: Path) -> np.ndarray:
     return img_rgb
 
 
-def dicom_to_rgb(path: Path) -> np.ndarray:
-    """Загрузка DICOM и преобразование в RGB (через нормализацию до 0–255)."""
-    ds = pydicom.dcmread(str(path))
-    arr = ds.pixel_array.astype(np.float32)
+@dataclass
+class ImagePlanes:
+    """Одно декодирование — все нужные представления изображения."""
 
-    # простая нормализация
-    arr = arr - np.min(arr)
-    max_val = np.max(arr)
-    if max_val > 0:
-        arr = arr / max_val
+    rgb: np.ndarray
+    bgr: np.ndarray
+    gray: np.ndarray
 
-    arr = (arr * 255.0).astype(np.uint8)
+    @property
+    def nbytes(self) -> int:
+        return self.rgb.nbytes + self.bgr.nbytes + self.gray.nbytes
 
-    # делаем 3-канальный RGB из градаций серого
-    img_rgb = cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB)
-    return img_rgb
+
+@timed("decode")
+def load_planes(path: Path) -> ImagePlanes:
+    """Загрузка PNG/JPEG: один imread и по одной конвертации в RGB и в серый."""
+    img_bgr = cv2.imread(str(path))
+    if img_bgr is None:
+        raise ValueError(f"Не удалось прочитать изображение: {path}")
+    return ImagePlanes(
+        rgb=cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB),
+        bgr=img_bgr,
+        gray=cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY),
+    )
+
+
+@timed("decode")
+def decode_image_bytes(data: bytes) -> np.ndarray:
+    """PNG/JPEG из памяти -> RGB (без повторного чтения с диска)."""
+    img_bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img_bgr is None:
+        raise ValueError("Не удалось декодировать изображение")
+    return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+
+
+@timed("decode_dicom")
+def dicom_to_rgb(path: Path) -> np.ndarray:
+    """Загрузка DICOM и преобразование в RGB (окно/Rescale из файла, иначе нормализация до 0–255)."""
+    return gray_to_rgb(read_dicom_frame(path))
+
+
+def gray_to_rgb(img: np.ndarray) -> np.ndarray:
+    """Делаем 3-канальный RGB из градаций серого (цветное отдаём как есть)."""
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    return img
 
 
 def save_rgb_image(img_rgb: np.ndarray, path: Path) -> None:
-    """Сохранение RGB-картинки на диск как PNG."""
+    """Сохранение RGB-картинки на диск как PNG (профиль "preview")."""
     path.parent.mkdir(parents=True, exist_ok=True)
     img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-    cv2.imwrite(str(path), img_bgr)
+    cv2.imwrite(str(path), img_bgr, PROFILES["preview"].params)
+    count_file_bytes("preview", path)
+
 
+@timed("encode_preview")
+def save_image(img: np.ndarray, path: Path) -> None:
+    """Одноканальное пишем как есть (без утроения в RGB), цветное — через save_rgb_image."""
+    if img.ndim == 2:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), img, PROFILES["preview"].params)
+        count_file_bytes("preview", path)
+    else:
+        save_rgb_image(img, path)
 
+
+@timed("encode_mask")
 def save_mask(mask: np.ndarray, path: Path) -> None:
-    """Сохранение бинарной маски (0/255) как PNG."""
+    """Сохранение бинарной маски (0/255) как PNG (профиль "mask")."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(path), mask)
+    cv2.imwrite(str(path), mask, PROFILES["mask"].params)
+    count_file_bytes("mask", path)
 
 
 # ---------- классические методы сегментации ----------
 
+@timed("grayscale")
 def rgb_to_gray(img_rgb: np.ndarray) -> np.ndarray:
     return cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
 
 
+@timed("threshold_manual")
 def threshold_manual_inv(gray: np.ndarray, thresh: int) -> np.ndarray:
     _, mask = cv2.threshold(
         gray, thresh, 255, cv2.THRESH_BINARY_INV
@@ -63,6 +117,7 @@ def threshold_manual_inv(gray: np.ndarray, thresh: int) -> np.ndarray:
     return mask
 
 
+@timed("threshold_otsu")
 def threshold_otsu_inv(gray: np.ndarray) -> Tuple[np.ndarray, float]:
     t, mask = cv2.threshold(
         gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
@@ -70,6 +125,7 @@ def threshold_otsu_inv(gray: np.ndarray) -> Tuple[np.ndarray, float]:
     return mask, t
 
 
+@timed("adaptive_mean")
 def adaptive_mean(gray: np.ndarray, block_size: int, C: int) -> np.ndarray:
     return cv2.adaptiveThreshold(
         gray,
@@ -81,6 +137,7 @@ def adaptive_mean(gray: np.ndarray, block_size: int, C: int) -> np.ndarray:
     )
 
 
+@timed("adaptive_gaussian")
 def adaptive_gaussian(gray: np.ndarray, block_size: int, C: int) -> np.ndarray:
     return cv2.adaptiveThreshold(
         gray,
@@ -92,12 +149,48 @@ def adaptive_gaussian(gray: np.ndarray, block_size: int, C: int) -> np.ndarray:
     )
 
 
-def region_growing(gray: np.ndarray, seed: Tuple[int, int], diff_thresh: int = 12) -> np.ndarray:
-    """Простой Region Growing (8-связность). seed = (row, col)."""
+REGION_GROWING_ENGINES = ("bfs", "band", "tree")
+
+# защита от бесконечного цикла в band-режиме (на практике хватает нескольких итераций)
+REGION_GROWING_MAX_WAVES = 256
+
+
+@timed("region_growing")
+def region_growing(
+    gray: np.ndarray,
+    seed: Tuple[int, int],
+    diff_thresh: int = 12,
+    engine: str = "bfs",
+    first_wave: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Region Growing (8-связность). seed = (row, col).
+
+    engine:
+    - "bfs"  — эталонный попиксельный обход с бегущим средним;
+    - "band" — векторизованный вариант, см. _region_growing_band
+      (first_wave — готовая первая волна, только для него);
+    - "tree" — по α-дереву, другая семантика, см. app.segmentation.alphatree.
+    """
     h, w = gray.shape
     sr, sc = seed
     assert 0 <= sr < h and 0 <= sc < w, "Seed вне изображения"
 
+    if engine == "bfs":
+        return _region_growing_bfs(gray, seed, diff_thresh)
+    if engine == "band":
+        return _region_growing_band(gray, seed, diff_thresh, first_wave)
+    if engine == "tree":
+        from app.segmentation.alphatree import region_growing_tree  # alphatree импортирует core
+
+        return region_growing_tree(gray, seed, diff_thresh)
+    raise ValueError(f"Неизвестный engine для region growing: {engine}")
+
+
+def _region_growing_bfs(gray: np.ndarray, seed: Tuple[int, int], diff_thresh: int) -> np.ndarray:
+    """Простой Region Growing через очередь, среднее обновляется после каждого пикселя."""
+    h, w = gray.shape
+    sr, sc = seed
+
     mask = np.zeros((h, w), dtype=bool)
     mean_val = float(gray[sr, sc])
     region_size = 1
@@ -126,26 +219,145 @@ def region_growing(gray: np.ndarray, seed: Tuple[int, int], diff_thresh: int = 1
     return (mask.astype(np.uint8) * 255)
 
 
-def watershed_segmentation(img_rgb: np.ndarray, fg_fraction: float = 0.5) -> np.ndarray:
+def region_band(mean_val: float, diff_thresh: float) -> Tuple[int, int]:
+    """Целочисленные границы полосы волны (inRange округляет скаляры, а нам нужен <=)."""
+    return max(0, math.ceil(mean_val - diff_thresh)), min(255, math.floor(mean_val + diff_thresh))
+
+
+def _region_growing_band(
+    gray: np.ndarray,
+    seed: Tuple[int, int],
+    diff_thresh: int,
+    first_wave: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Region Growing волнами по интенсивностной полосе ("frozen mean per wave").
+
+    На каждой волне среднее заморожено: берём полосу |gray - mean| <= diff_thresh
+    (плюс уже набранную область) и одним cv2.floodFill забираем всю связную
+    (8-связность) компоненту, содержащую seed. Затем среднее пересчитывается
+    точно по всей области, и так до неподвижной точки. Область только растёт,
+    поэтому если полоса совпала с прошлой волной, новая волна ничего не даст —
+    на этом останавливаемся, не заливая ещё раз.
+
+    Отличие от "bfs": там среднее меняется после каждого добавленного пикселя,
+    поэтому результат зависит от порядка обхода. Для однородных объектов с
+    контрастной границей (перепад больше diff_thresh) маски совпадают.
+
+    first_wave — уже известный результат первой волны (компонента полосы
+    region_band(gray[seed], diff_thresh), содержащая seed), см. interactive.
+    """
+    h, w = gray.shape
+    sr, sc = seed
+
+    band = np.empty((h, w), dtype=np.uint8)
+    ff_mask = np.empty((h + 2, w + 2), dtype=np.uint8)
+    flags = 8 | cv2.FLOODFILL_MASK_ONLY | cv2.FLOODFILL_FIXED_RANGE | (255 << 8)
+
+    def region_mean(region: np.ndarray, size: int) -> float:
+        # точная сумма (целые в double) / площадь — в разы быстрее cv2.mean с маской
+        cv2.bitwise_and(gray, region, dst=band)
+        return cv2.sumElems(band)[0] / size
+
+    waves = REGION_GROWING_MAX_WAVES
+    if first_wave is None:
+        region = np.zeros((h, w), dtype=np.uint8)
+        mean_val = float(gray[sr, sc])
+        region_size = 0
+        prev_band = None
+    else:
+        region = first_wave
+        region_size = cv2.countNonZero(region)
+        mean_val = region_mean(region, region_size)
+        prev_band = region_band(float(gray[sr, sc]), diff_thresh)
+        waves -= 1
+
+    for _ in range(waves):
+        lo, hi = region_band(mean_val, diff_thresh)
+        if (lo, hi) == prev_band:
+            break
+        prev_band = lo, hi
+        if lo <= hi:
+            cv2.inRange(gray, lo, hi, dst=band)
+        else:
+            band.fill(0)
+        cv2.bitwise_or(band, region, dst=band)
+        band[sr, sc] = 255
+
+        ff_mask.fill(0)
+        cv2.floodFill(band, ff_mask, (sc, sr), 0, 0, 0, flags)
+        region = ff_mask[1:-1, 1:-1].copy()
+
+        new_size = cv2.countNonZero(region)
+        if new_size == region_size:
+            break
+        region_size = new_size
+        mean_val = region_mean(region, region_size)
+
+    return region
+
+
+def clamp_fg_fraction(fg_fraction: float) -> float:
+    # чуть подстрахуемся, чтобы не уйти в 0 или 1:
+    return float(max(0.1, min(fg_fraction, 0.9)))
+
+
+@timed("watershed")
+def watershed_segmentation(
+    img_rgb: np.ndarray,
+    fg_fraction: float = 0.5,
+    *,
+    img_bgr: Optional[np.ndarray] = None,
+    gray: Optional[np.ndarray] = None,
+) -> np.ndarray:
     """Watershed по аналогии с тем, что ты делал в ноутбуке: возвращаем маску объекта.
 
     fg_fraction — доля от максимума distance transform, по которой режем foreground.
+    img_bgr/gray — уже готовые представления (см. ImagePlanes), чтобы не конвертировать заново.
     """
-    img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-    gray = rgb_to_gray(img_rgb)
+    if img_bgr is None:
+        img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+    if gray is None:
+        gray = rgb_to_gray(img_rgb)
 
     _, thresh_inv = cv2.threshold(
         gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
     )
+    opening, sure_bg = watershed_morphology(thresh_inv)
+    return watershed_from_morphology(img_bgr, opening, sure_bg, fg_fraction)
 
-    kernel = np.ones((3, 3), np.uint8)
-    opening = cv2.morphologyEx(thresh_inv, cv2.MORPH_OPEN, kernel, iterations=2)
-    sure_bg = cv2.dilate(opening, kernel, iterations=3)
 
-    dist = cv2.distanceTransform(opening, cv2.DIST_L2, 5)
+# морфология перед watershed: opening (2 итерации 3x3) и sure_bg (ещё 3 дилатации)
+WATERSHED_KERNEL = np.ones((3, 3), np.uint8)
+WATERSHED_OPEN_ITERATIONS = 2
+WATERSHED_BG_DILATE_ITERATIONS = 3
+# на сколько пикселей от точки «дотягивается» морфология выше (для перекрытия тайлов)
+WATERSHED_MORPH_REACH = 2 * WATERSHED_OPEN_ITERATIONS + WATERSHED_BG_DILATE_ITERATIONS
 
-    # чуть подстрахуемся, чтобы не уйти в 0 или 1:
-    fg_fraction = float(max(0.1, min(fg_fraction, 0.9)))
+
+def watershed_morphology(thresh_inv: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(opening, sure_bg) из бинарной маски Otsu (локальная операция, годится для тайлов)."""
+    opening = cv2.morphologyEx(
+        thresh_inv, cv2.MORPH_OPEN, WATERSHED_KERNEL, iterations=WATERSHED_OPEN_ITERATIONS
+    )
+    sure_bg = cv2.dilate(opening, WATERSHED_KERNEL, iterations=WATERSHED_BG_DILATE_ITERATIONS)
+    return opening, sure_bg
+
+
+def watershed_from_morphology(
+    img_bgr: np.ndarray,
+    opening: np.ndarray,
+    sure_bg: np.ndarray,
+    fg_fraction: float,
+    dist: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Глобальная часть watershed: distance transform, маркеры, затопление, выбор объекта.
+
+    dist — уже посчитанный distanceTransform(opening) (перебор долей, см. sweep).
+    """
+    if dist is None:
+        dist = cv2.distanceTransform(opening, cv2.DIST_L2, 5)
+
+    fg_fraction = clamp_fg_fraction(fg_fraction)
 
     _, sure_fg = cv2.threshold(dist, fg_fraction * dist.max(), 255, 0)
     sure_fg = np.uint8(sure_fg)
@@ -153,12 +365,12 @@ def watershed_segmentation(img_rgb: np.ndarray, fg_fraction: float = 0.5) -> np.
     unknown = cv2.subtract(sure_bg, sure_fg)
 
     num_labels, markers = cv2.connectedComponents(sure_fg)
-    markers = markers + 1
+    markers += 1  # на месте: на больших изображениях это сотни МБ int32
     markers[unknown == 255] = 0
 
     markers_ws = cv2.watershed(img_bgr, markers)
 
-    lesion_mask = np.zeros_like(gray, dtype=np.uint8)
+    lesion_mask = np.zeros(opening.shape, dtype=np.uint8)
     valid = markers_ws > 1
     if np.any(valid):
         uniq, counts = np.unique(markers_ws[valid], return_counts=True)
@@ -168,8 +380,21 @@ def watershed_segmentation(img_rgb: np.ndarray, fg_fraction: float = 0.5) -> np.
     return lesion_mask
 
 
-def segment_all_methods(
-    img_rgb: np.ndarray,
+SEGMENTATION_METHODS = (
+    "manual_inv",
+    "otsu_inv",
+    "adapt_mean",
+    "adapt_gauss",
+    "region_growing",
+    "watershed",
+)
+
+
+def _otsu_mask(gray: np.ndarray) -> np.ndarray:
+    return threshold_otsu_inv(gray)[0]
+
+
+def method_params(
     *,
     manual_thresh: int,
     adaptive_block_size: int,
@@ -177,22 +402,116 @@ def segment_all_methods(
     region_seed: Tuple[int, int],
     region_diff_thresh: int,
     watershed_fg_fraction: float,
-) -> Dict[str, np.ndarray]:
-    """Запуск всех методов сразу, возвращаем словарь масок."""
-    gray = rgb_to_gray(img_rgb)
+    region_engine: str = "bfs",
+) -> Dict[str, Dict[str, Any]]:
+    """Параметры, от которых реально зависит каждая маска (для ключей кэша)."""
+    adaptive = {"block_size": int(adaptive_block_size), "C": int(adaptive_C)}
+    return {
+        "manual_inv": {"thresh": int(manual_thresh)},
+        "otsu_inv": {},
+        "adapt_mean": adaptive,
+        "adapt_gauss": adaptive,
+        "region_growing": {
+            "seed": [int(region_seed[0]), int(region_seed[1])],
+            "diff_thresh": int(region_diff_thresh),
+            "engine": region_engine,
+        },
+        "watershed": {"fg_fraction": round(clamp_fg_fraction(watershed_fg_fraction), 6)},
+    }
 
-    manual_inv = threshold_manual_inv(gray, manual_thresh)
-    otsu_inv, _ = threshold_otsu_inv(gray)
-    adapt_mean = adaptive_mean(gray, adaptive_block_size, adaptive_C)
-    adapt_gauss = adaptive_gaussian(gray, adaptive_block_size, adaptive_C)
-    rg_mask = region_growing(gray, region_seed, diff_thresh=region_diff_thresh)
-    ws_mask = watershed_segmentation(img_rgb, fg_fraction=watershed_fg_fraction)
 
-    return {
-        "manual_inv": manual_inv,
-        "otsu_inv": otsu_inv,
-        "adapt_mean": adapt_mean,
-        "adapt_gauss": adapt_gauss,
-        "region_growing": rg_mask,
-        "watershed": ws_mask,
+def iter_segment_methods(
+    img_rgb: np.ndarray,
+    *,
+    manual_thresh: int,
+    adaptive_block_size: int,
+    adaptive_C: int,
+    region_seed: Tuple[int, int],
+    region_diff_thresh: int,
+    watershed_fg_fraction: float,
+    region_engine: str = "bfs",
+    methods: Optional[Iterable[str]] = None,
+    img_bgr: Optional[np.ndarray] = None,
+    gray: Optional[np.ndarray] = None,
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """Запуск методов параллельно (см. executor), отдаём (метод, маска) по мере готовности.
+
+    methods — подмножество SEGMENTATION_METHODS (None -> все).
+    img_bgr/gray — готовые представления из ImagePlanes (иначе считаем из img_rgb).
+    """
+    wanted = set(SEGMENTATION_METHODS if methods is None else methods)
+    unknown = wanted.difference(SEGMENTATION_METHODS)
+    if unknown:
+        raise ValueError(f"Неизвестные методы сегментации: {sorted(unknown)}")
+    if not wanted:
+        return
+
+    if gray is None:
+        gray = rgb_to_gray(img_rgb)
+
+    # метод -> (функция, аргументы, kwargs, держит ли GIL)
+    adaptive_args = (gray, adaptive_block_size, adaptive_C)
+    tasks = {
+        "manual_inv": (threshold_manual_inv, (gray, manual_thresh), {}, False),
+        "otsu_inv": (_otsu_mask, (gray,), {}, False),
+        "adapt_mean": (adaptive_mean, adaptive_args, {}, False),
+        "adapt_gauss": (adaptive_gaussian, adaptive_args, {}, False),
+        # bfs — чистый Python, уходит в пул процессов; band — OpenCV
+        "region_growing": (
+            region_growing,
+            (gray, region_seed, region_diff_thresh, region_engine),
+            {},
+            region_engine == "bfs",
+        ),
+        "watershed": (
+            watershed_segmentation,
+            (img_rgb, watershed_fg_fraction),
+            {"img_bgr": img_bgr, "gray": gray},
+            False,
+        ),
     }
+
+    futures = {}
+    for name in SEGMENTATION_METHODS:
+        if name in wanted:
+            fn, args, kwargs, cpu_bound = tasks[name]
+            # маска того же размера, что gray, — из процесса возвращается через общую память
+            result_like = gray if cpu_bound else None
+            futures[submit(fn, *args, cpu_bound=cpu_bound, result_like=result_like, **kwargs)] = name
+
+    for fut in as_completed(futures):
+        yield futures[fut], fut.result()
+
+
+def segment_all_methods(
+    img_rgb: np.ndarray,
+    *,
+    manual_thresh: int,
+    adaptive_block_size: int,
+    adaptive_C: int,
+    region_seed: Tuple[int, int],
+    region_diff_thresh: int,
+    watershed_fg_fraction: float,
+    region_engine: str = "bfs",
+    methods: Optional[Iterable[str]] = None,
+    img_bgr: Optional[np.ndarray] = None,
+    gray: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """Запуск всех (или только указанных) методов, возвращаем словарь масок."""
+    masks = dict(
+        iter_segment_methods(
+            img_rgb,
+            manual_thresh=manual_thresh,
+            adaptive_block_size=adaptive_block_size,
+            adaptive_C=adaptive_C,
+            region_seed=region_seed,
+            region_diff_thresh=region_diff_thresh,
+            watershed_fg_fraction=watershed_fg_fraction,
+            region_engine=region_engine,
+            methods=methods,
+            img_bgr=img_bgr,
+            gray=gray,
+        )
+    )
+    # порядок как раньше, независимо от того, кто досчитал первым
+    return {name: masks[name] for name in SEGMENTATION_METHODS if name in masks}
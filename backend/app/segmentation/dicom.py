@@ -0,0 +1,199 @@
+# app/segmentation/dicom.py
+"""
+Чтение DICOM без полной загрузки в память.
+
+Несжатые пиксели не читаются целиком: для файла на диске — np.memmap, для
+буфера в памяти — np.frombuffer, оба по смещению PixelData из заголовка
+(сама PixelData при разборе заголовка отложена, defer_size). Сжатые
+читаются покадрово (pydicom.pixels.pixel_array / iter_pixels берут из
+файла только нужный кадр). В uint8 кадр переводится одним проходом через
+заранее посчитанную таблицу (LUT) по всем возможным значениям пикселя:
+RescaleSlope/Intercept -> окно WindowCenter/WindowWidth -> 0..255.
+Если окна в файле нет — линейная нормализация min..max кадра, как раньше.
+
+Результат одноканальный (для монохромных снимков); RGB делает тот, кому он нужен.
+"""
+import math
+from io import BytesIO
+from os import PathLike
+from typing import BinaryIO, Iterator, Optional, Union
+
+import numpy as np
+import pydicom
+from pydicom.pixels import iter_pixels, pixel_array
+
+DicomSource = Union[str, PathLike, bytes, BinaryIO]
+
+PIXEL_DATA_TAG = 0x7FE00010
+
+
+def _open(src: DicomSource) -> Union[str, PathLike, BinaryIO]:
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return BytesIO(src)  # для bytes буфер не копируется
+    if hasattr(src, "seek"):
+        src.seek(0)
+    return src
+
+
+def read_dicom_header(src: DicomSource) -> pydicom.Dataset:
+    """Заголовок; PixelData не читается (отложенный элемент, известно только смещение)."""
+    return pydicom.dcmread(_open(src), defer_size=1024)
+
+
+def dicom_frame_count(ds: pydicom.Dataset) -> int:
+    return int(getattr(ds, "NumberOfFrames", 1) or 1)
+
+
+def native_pixels(src: DicomSource, ds: pydicom.Dataset) -> Optional[np.ndarray]:
+    """
+    Несжатые монохромные 8/16-битные пиксели без копирования:
+    (frames, rows, cols) или (rows, cols). None — нужен декодер pydicom.
+    """
+    meta = getattr(ds, "file_meta", None)
+    ts = getattr(meta, "TransferSyntaxUID", None)
+    if ts is None or ts.is_compressed or ts.is_deflated or not ts.is_little_endian:
+        return None
+    bits = int(getattr(ds, "BitsAllocated", 0))
+    signed = int(getattr(ds, "PixelRepresentation", 0)) == 1
+    if int(getattr(ds, "SamplesPerPixel", 1)) != 1 or bits not in (8, 16):
+        return None
+    if signed and int(getattr(ds, "BitsStored", bits)) != bits:
+        return None  # знаковые с неполными битами pydicom расширяет по знаку — пусть делает сам
+
+    elem = ds.get_item(PIXEL_DATA_TAG, keep_deferred=True)
+    offset = getattr(elem, "value_tell", None)
+    if offset is None:
+        return None
+
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{bits // 8}")
+    frames = dicom_frame_count(ds)
+    shape = (frames, int(ds.Rows), int(ds.Columns)) if frames > 1 else (int(ds.Rows), int(ds.Columns))
+    count = math.prod(shape)
+    if elem.length < count * dtype.itemsize:
+        return None
+
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return np.frombuffer(src, dtype=dtype, count=count, offset=offset).reshape(shape)
+    if isinstance(src, (str, PathLike)):
+        return np.memmap(src, dtype=dtype, mode="r", offset=offset, shape=shape)
+    return None
+
+
+def _first(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (list, tuple, pydicom.multival.MultiValue)):
+        value = value[0] if len(value) else None
+    return None if value is None else float(value)
+
+
+def _stored_values(ds: pydicom.Dataset) -> Optional[np.ndarray]:
+    """Все возможные значения пикселя в порядке индексации LUT (или None, если LUT не подходит)."""
+    bits = int(getattr(ds, "BitsAllocated", 16))
+    signed = int(getattr(ds, "PixelRepresentation", 0)) == 1
+    if bits == 8:
+        return np.arange(256, dtype=np.uint8).view(np.int8 if signed else np.uint8)
+    if bits == 16:
+        return np.arange(65536, dtype=np.uint16).view(np.int16 if signed else np.uint16)
+    return None
+
+
+def _lut_index(frame: np.ndarray) -> np.ndarray:
+    """Индекс в LUT — тот же буфер, просмотренный как беззнаковый."""
+    if frame.dtype == np.int16:
+        return frame.view(np.uint16)
+    if frame.dtype == np.int8:
+        return frame.view(np.uint8)
+    return frame
+
+
+def window_lut(ds: pydicom.Dataset) -> Optional[np.ndarray]:
+    """
+    LUT uint8 по Rescale + Window (линейная функция VOI из стандарта DICOM, C.11.2.1.2).
+    None — окна в файле нет или пиксели не 8/16-битные целые.
+    """
+    center = _first(getattr(ds, "WindowCenter", None))
+    width = _first(getattr(ds, "WindowWidth", None))
+    stored = _stored_values(ds)
+    if center is None or width is None or width < 1 or stored is None:
+        return None
+
+    slope = _first(getattr(ds, "RescaleSlope", None)) or 1.0
+    intercept = _first(getattr(ds, "RescaleIntercept", None)) or 0.0
+    x = stored.astype(np.float64) * slope + intercept
+
+    lo = center - 0.5 - (width - 1) / 2
+    y = ((x - (center - 0.5)) / max(width - 1, 1) + 0.5) * 255.0
+    y[x <= lo] = 0.0
+    y[x > lo + (width - 1)] = 255.0
+    lut = np.clip(y, 0, 255).astype(np.uint8)
+
+    if getattr(ds, "PhotometricInterpretation", "") == "MONOCHROME1":
+        lut = 255 - lut  # MONOCHROME1: больше значение — темнее
+    return lut
+
+
+def _minmax_to_uint8(frame: np.ndarray) -> np.ndarray:
+    """Нормализация min..max кадра; для 8/16-битных целых — тоже через LUT."""
+    lo, hi = frame.min(), frame.max()
+    if frame.dtype.kind in "iu" and frame.dtype.itemsize <= 2:
+        values = np.arange(int(lo), int(hi) + 1, dtype=np.float32)
+        values -= np.float32(lo)
+        if hi > lo:
+            values /= np.float32(hi) - np.float32(lo)
+        values *= 255.0
+        lut = values.astype(np.uint8)
+        if lo < 0:
+            frame = frame.astype(np.int32)  # чтобы frame - lo не переполнился
+        return lut[frame - int(lo)] if lo else lut[frame]
+
+    # редкие случаи (float / 32-битные пиксели) — как раньше, через float32
+    arr = frame.astype(np.float32)
+    arr -= np.min(arr)
+    max_val = np.max(arr)
+    if max_val > 0:
+        arr /= max_val
+    arr *= 255.0
+    return arr.astype(np.uint8)
+
+
+def frame_to_uint8(frame: np.ndarray, ds: pydicom.Dataset, lut: Optional[np.ndarray] = None) -> np.ndarray:
+    """Один кадр (или RGB-кадр) -> uint8."""
+    if frame.ndim == 3 and frame.dtype == np.uint8:
+        return frame  # цветной 8-битный — уже готов
+    if lut is not None and frame.ndim == 2:
+        return lut[_lut_index(frame)]
+    return _minmax_to_uint8(frame)
+
+
+def read_dicom_frame(src: DicomSource, index: Optional[int] = None) -> np.ndarray:
+    """
+    Один кадр как uint8 (одноканальный для монохромных снимков).
+    index=None — для многокадровых файлов берётся средний кадр.
+    """
+    ds = read_dicom_header(src)
+    frames = dicom_frame_count(ds)
+    if index is None:
+        index = frames // 2
+
+    pixels = native_pixels(src, ds)
+    if pixels is not None:
+        frame = pixels[index] if frames > 1 else pixels
+    else:
+        frame = pixel_array(_open(src), index=index if frames > 1 else None)
+    return frame_to_uint8(frame, ds, window_lut(ds))
+
+
+def iter_dicom_frames(src: DicomSource) -> Iterator[np.ndarray]:
+    """Кадры по одному как uint8; в памяти одновременно только текущий кадр."""
+    ds = read_dicom_header(src)
+    lut = window_lut(ds)
+    pixels = native_pixels(src, ds)
+    if pixels is None:
+        frames: Iterator[np.ndarray] = iter_pixels(_open(src))
+    elif dicom_frame_count(ds) > 1:
+        frames = iter(pixels)
+    else:
+        frames = iter((pixels,))
+    for frame in frames:
+        yield frame_to_uint8(frame, ds, lut)
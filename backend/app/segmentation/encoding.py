@@ -0,0 +1,109 @@
+# app/segmentation/encoding.py
+"""
+Профили кодирования картинок (превью, маски, оверлеи PR2) и многоуровневые
+превью для просмотрщика. Настройки — ENCODE_PROFILES / PREVIEW_TIERS в config.
+
+Всё здесь работает с массивами в порядке каналов OpenCV (BGR или серый).
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from app.config import ENCODE_PROFILES, PREVIEW_TIERS
+from app.metrics import count_bytes, stage
+
+_EXT = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+_MEDIA_TYPE = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+# профили, которые обязаны быть без потерь
+_LOSSLESS_ONLY = {"preview", "mask"}
+
+
+@dataclass(frozen=True)
+class EncodeProfile:
+    codec: str = "png"
+    level: int = 1  # PNG
+    quality: int = 90  # WebP / JPEG
+    max_side: Optional[int] = None  # уменьшение по длинной стороне (None — как есть)
+
+    def __post_init__(self) -> None:
+        if self.codec not in _EXT:
+            raise ValueError(f"Неизвестный кодек: {self.codec}")
+
+    @property
+    def ext(self) -> str:
+        return _EXT[self.codec]
+
+    @property
+    def media_type(self) -> str:
+        return _MEDIA_TYPE[self.codec]
+
+    @property
+    def params(self) -> List[int]:
+        if self.codec == "png":
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.level]
+        if self.codec == "webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+
+
+def _profile(name: str, spec: Dict[str, Any]) -> EncodeProfile:
+    profile = EncodeProfile(**spec)
+    if name in _LOSSLESS_ONLY and profile.codec != "png":
+        raise ValueError(f"Профиль {name!r} должен быть PNG")
+    return profile
+
+
+PROFILES: Dict[str, EncodeProfile] = {name: _profile(name, spec) for name, spec in ENCODE_PROFILES.items()}
+TIERS: Dict[str, EncodeProfile] = {name: EncodeProfile(**spec) for name, spec in PREVIEW_TIERS.items()}
+
+
+def encode(img: np.ndarray, profile: EncodeProfile) -> bytes:
+    ok, buf = cv2.imencode(profile.ext, downscale(img, profile.max_side), profile.params)
+    if not ok:
+        raise ValueError(f"Не удалось закодировать {profile.codec}")
+    return buf.tobytes()
+
+
+def write_image(img: np.ndarray, path: Path, profile: EncodeProfile, kind: str = "image") -> None:
+    """
+    Запись через временный файл (расширение path задаёт вызывающий, обычно profile.ext).
+    kind — метка для метрик: стадия encode_<kind> и bytes_written_total{kind}.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with stage(f"encode_{kind}"):
+        data = encode(img, profile)
+    tmp.write_bytes(data)
+    tmp.replace(path)
+    count_bytes(kind, len(data))
+
+
+def downscale(img: np.ndarray, max_side: Optional[int]) -> np.ndarray:
+    """Уменьшение по длинной стороне (INTER_AREA); меньшие картинки не трогаем."""
+    h, w = img.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return img
+    scale = max_side / max(h, w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def write_preview_tiers(img: np.ndarray, out_dir: Path, stem: str) -> Dict[str, str]:
+    """
+    Уменьшенные превью из PREVIEW_TIERS: {уровень: имя файла в out_dir}.
+    Уровни, которые не меньше самой картинки, не пишутся — для них годится полное превью.
+    Каждый следующий (меньший) уровень считается из предыдущего, а не из оригинала.
+    """
+    names: Dict[str, str] = {}
+    src = img
+    for tier, profile in sorted(TIERS.items(), key=lambda kv: -(kv[1].max_side or 0)):
+        if not profile.max_side or max(src.shape[:2]) <= profile.max_side:
+            continue
+        src = downscale(src, profile.max_side)
+        name = f"{stem}_{tier}{profile.ext}"
+        write_image(src, out_dir / name, EncodeProfile(profile.codec, profile.level, profile.quality), "preview_tier")
+        names[tier] = name
+    return names
@@ -0,0 +1,176 @@
+# app/segmentation/executor.py
+import contextlib
+import contextvars
+import multiprocessing
+import threading
+import time
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Iterator, Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.concurrency import AdmissionGate, drop_broken_pool
+from app.metrics import record_stage
+from app.shm import submit_shared
+from app.config import (
+    SEGMENTATION_MAX_CONCURRENT,
+    SEGMENTATION_MAX_QUEUE,
+    SEGMENTATION_PROCESS_WORKERS,
+    SEGMENTATION_RETRY_AFTER_S,
+    SEGMENTATION_THREAD_WORKERS,
+    SHARED_MEMORY_ENABLED,
+    VOLUME_PROCESS_WORKERS,
+)
+
+# True внутри процесса из get_process_pool: там задачи выполняются inline,
+# без вложенных пулов
+_in_worker = False
+_local = threading.local()
+
+
+def _mark_worker() -> None:
+    global _in_worker
+    _in_worker = True
+
+
+@contextlib.contextmanager
+def inline_tasks() -> Iterator[None]:
+    """
+    submit() в этом потоке выполняет задачи сразу. Для задач, которые сами
+    запущены через submit и раздают подзадачи, — иначе при занятом пуле
+    потоков они ждали бы друг друга.
+    """
+    prev = getattr(_local, "inline", False)
+    _local.inline = True
+    try:
+        yield
+    finally:
+        _local.inline = prev
+
+
+# ограничение на уровне HTTP-запросов к /segment/*
+segmentation_gate = AdmissionGate(
+    SEGMENTATION_MAX_CONCURRENT,
+    SEGMENTATION_MAX_QUEUE,
+    retry_after=SEGMENTATION_RETRY_AFTER_S,
+)
+
+
+@lru_cache()
+def get_thread_pool() -> Optional[ThreadPoolExecutor]:
+    """Пул потоков для OpenCV-методов (они отпускают GIL). None -> всё inline."""
+    if SEGMENTATION_THREAD_WORKERS <= 0:
+        return None
+    return ThreadPoolExecutor(
+        max_workers=SEGMENTATION_THREAD_WORKERS,
+        thread_name_prefix="segmentation",
+    )
+
+
+def _new_process_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    if workers <= 0:
+        return None
+    # spawn: безопасно для процесса с потоками (uvicorn, пул выше)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_mark_worker,
+    )
+
+
+@lru_cache()
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул процессов для Python-тяжёлых задач (bfs region growing). None -> потоки."""
+    return _new_process_pool(SEGMENTATION_PROCESS_WORKERS)
+
+
+@lru_cache()
+def get_volume_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул процессов для срезов объёма (app/segmentation/volume.py). None -> потоки."""
+    return _new_process_pool(VOLUME_PROCESS_WORKERS)
+
+
+def _submit_process(
+    pool: ProcessPoolExecutor, fn: Callable[..., Any], args: Any, kwargs: Any, result_like: Optional[np.ndarray]
+) -> Future:
+    if SHARED_MEMORY_ENABLED:
+        return submit_shared(pool, fn, *args, result_like=result_like, **kwargs)
+    return pool.submit(fn, *args, **kwargs)
+
+
+def _drop_if_broken(getter: Callable[[], Any], pool: ProcessPoolExecutor, fut: Future) -> None:
+    if not fut.cancelled() and isinstance(fut.exception(), BrokenExecutor):
+        drop_broken_pool(getter, pool)
+
+
+def submit(
+    fn: Callable[..., Any],
+    *args: Any,
+    cpu_bound: bool = False,
+    result_like: Optional[np.ndarray] = None,
+    process_pool: Callable[[], Optional[ProcessPoolExecutor]] = get_process_pool,
+    **kwargs: Any,
+) -> Future:
+    """
+    Отправить задачу в подходящий пул.
+
+    cpu_bound=True — задача держит GIL (чистый Python), уходит в пул процессов;
+    функция и аргументы должны пиклиться, большие массивы передаются через
+    общую память (app/shm.py). result_like — массив той же формы и dtype, что
+    результат: тогда и результат возвращается через общую память. process_pool —
+    геттер пула процессов (по умолчанию общий get_process_pool). Если пулы
+    выключены в config (или мы сами в процессе пула), задача выполняется сразу
+    в вызывающем потоке.
+
+    Если исполнитель пула процессов умер (OOM, падение в нативном коде), задача
+    получает BrokenProcessPool, а пул пересоздаётся для следующих задач.
+    """
+    pool = None
+    if not (_in_worker or getattr(_local, "inline", False)):
+        pool = process_pool() if cpu_bound else None
+        if pool is None:
+            pool = get_thread_pool()
+    if isinstance(pool, ThreadPoolExecutor):
+        # контекст запроса (стадии для Server-Timing) — в поток пула
+        return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    if pool is not None:
+        try:
+            fut = _submit_process(pool, fn, args, kwargs, result_like)
+        except BrokenExecutor:
+            # пул сломала задача раньше, эта ещё не запускалась — в новый пул
+            drop_broken_pool(process_pool, pool)
+            pool = process_pool()
+            fut = _submit_process(pool, fn, args, kwargs, result_like)
+        fut.add_done_callback(partial(_drop_if_broken, process_pool, pool))
+        return fut
+
+    fut: Future = Future()
+    try:
+        fut.set_result(fn(*args, **kwargs))
+    except BaseException as exc:  # noqa: BLE001 — отдаём как есть через Future
+        fut.set_exception(exc)
+    return fut
+
+
+async def run_segmentation(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Выполнить синхронный конвейер сегментации вне event loop.
+
+    Кидает app.concurrency.Overloaded, если превышены лимиты из config.
+    """
+    t0 = time.perf_counter()
+    async with segmentation_gate.slot():
+        record_stage("segmentation_queue", time.perf_counter() - t0)
+        return await run_in_threadpool(fn, *args, **kwargs)
+
+
+def shutdown_executors() -> None:
+    for getter in (get_thread_pool, get_process_pool, get_volume_pool):
+        if getter.cache_info().currsize == 0:
+            continue  # пул так и не создавали
+        pool = getter()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        getter.cache_clear()
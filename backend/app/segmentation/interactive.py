@@ -0,0 +1,219 @@
+# app/segmentation/interactive.py
+"""
+Интерактивный region growing (клик за кликом по одному изображению).
+
+Движок по умолчанию — "tree" (app/segmentation/alphatree.py): α-дерево
+изображения строится один раз (все уровни REGION_TREE_ALPHAS) и кэшируется
+по изображению; клик с любым seed и diff_thresh — это выбор узла дерева
+и одна маска по готовой разметке, без заливок. Готовая маска кэшируется
+по (изображение, α, узел): клики в ту же компоненту отвечаются из кэша.
+Если однородного узла нет, ответ — одна волна band по разметке полосы
+(тот же кэш разметок, что у band ниже), тоже без заливок.
+
+Движок "band" — для масок, побитово совпадающих с /segment/all. Его результат
+зависит не от самого seed, а только от первой
+волны C1 — связной компоненты полосы region_band(gray[seed], diff_thresh),
+в которой лежит seed: дальше каждая волна считается от C1 и её среднего.
+Поэтому:
+- разметка компонент полосы (connectedComponents, 8-связность) не зависит
+  от seed и кэшируется по (изображение, lo, hi);
+- готовая маска кэшируется по (изображение, lo, hi, номер компоненты,
+  diff_thresh) — любой клик в ту же компоненту с тем же порогом отвечается
+  без пересчёта, а при промахе первая волна берётся из разметки.
+
+Маски обоих движков совпадают с region_growing(..., engine=...) побитово
+(проверка и задержки — benchmarks/bench_region_interactive.py). У band
+быстро отвечаются только повторы: новая яркость seed или новый diff_thresh —
+это разметка полосы плюс волны, почти как сам band.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import REGION_INTERACTIVE_CACHE_BYTES
+from app.metrics import stage
+from app.segmentation.alphatree import AlphaTree, Stats, reference_band, seed_mask
+from app.segmentation.core import region_band, region_growing
+from app.segmentation.maskcodec import mask_to_rle
+from app.segmentation.sweep import mask_stats
+
+
+class RegionResult:
+    """Маска с площадью и bbox (и (среднее, СКО) яркости для узлов α-дерева)."""
+
+    def __init__(self, mask: np.ndarray, stats: Optional[Stats] = None):
+        self.mask = mask
+        self.stats = stats
+        self.area, self.bbox = mask_stats(mask)
+
+    @property
+    def nbytes(self) -> int:
+        return self.mask.nbytes
+
+    def rle(self) -> Dict[str, object]:
+        # не запоминаем: у шумных масок это сотни тысяч серий (десятки МБ списком)
+        return mask_to_rle(self.mask)
+
+
+class RegionCache:
+    """
+    LRU разметок (полос band, α-деревьев) и готовых масок с общим бюджетом
+    в байтах. Ключ — (image_key, вид, ...), вид — "labels", "tree" или "result".
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._mem: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {"labels": 0, "tree": 0, "result": 0}
+        self.misses: Dict[str, int] = {"labels": 0, "tree": 0, "result": 0}
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[Any]:
+        with self._lock:
+            value = self._mem.get(key)
+            if value is None:
+                self.misses[key[1]] += 1
+                return None
+            self._mem.move_to_end(key)
+            self.hits[key[1]] += 1
+            return value
+
+    def put(self, key: Tuple[Hashable, ...], value: Any) -> None:
+        if value.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old.nbytes
+            self._mem[key] = value
+            self._mem_bytes += value.nbytes
+            while self._mem_bytes > self.max_bytes:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "label_hits": self.hits["labels"],
+                "label_misses": self.misses["labels"],
+                "tree_hits": self.hits["tree"],
+                "tree_misses": self.misses["tree"],
+                "result_hits": self.hits["result"],
+                "result_misses": self.misses["result"],
+                "items": len(self._mem),
+                "bytes": self._mem_bytes,
+                "budget_bytes": self.max_bytes,
+            }
+
+
+region_cache = RegionCache(REGION_INTERACTIVE_CACHE_BYTES)
+
+
+def band_labels(gray: np.ndarray, image_key: str, lo: int, hi: int, cache: RegionCache = region_cache) -> np.ndarray:
+    """Метки 8-связных компонент полосы lo <= gray <= hi (0 — вне полосы)."""
+    key = (image_key, "labels", lo, hi)
+    labels = cache.get(key)
+    if labels is not None:
+        return labels
+    with stage("region_labels"):
+        n, labels = cv2.connectedComponents(cv2.inRange(gray, lo, hi), connectivity=8, ltype=cv2.CV_32S)
+        if n <= np.iinfo(np.uint16).max + 1:
+            labels = labels.astype(np.uint16)  # вдвое меньше места в кэше
+    cache.put(key, labels)
+    return labels
+
+
+def alpha_tree(gray: np.ndarray, image_key: str, cache: RegionCache = region_cache) -> AlphaTree:
+    """α-дерево изображения со всеми уровнями (строится один раз на изображение)."""
+    key = (image_key, "tree")
+    tree = cache.get(key)
+    if tree is not None:
+        return tree
+    with stage("region_tree"):
+        tree = AlphaTree(gray).build()
+    cache.put(key, tree)
+    return tree
+
+
+def region_growing_interactive(
+    gray: np.ndarray,
+    image_key: str,
+    seed: Tuple[int, int],
+    diff_thresh: int,
+    cache: RegionCache = region_cache,
+    engine: str = "tree",
+) -> Tuple[RegionResult, bool]:
+    """
+    region_growing(gray, seed, diff_thresh, engine=engine) через кэш,
+    engine — "tree" или "band". image_key — идентификатор содержимого
+    (хэш превью). Отдаёт (результат, был ли он в кэше). ValueError — seed
+    вне изображения (до обращения к кэшу, в отличие от assert в region_growing).
+    """
+    h, w = gray.shape
+    sr, sc = seed
+    if not (0 <= sr < h and 0 <= sc < w):
+        raise ValueError("Seed is outside the image")
+    if engine == "tree":
+        return _tree_interactive(gray, image_key, seed, diff_thresh, cache)
+    if engine != "band":
+        raise ValueError(f"Unknown interactive engine: {engine}")
+
+    lo, hi = region_band(float(gray[sr, sc]), diff_thresh)
+    if lo > hi:
+        # отрицательный порог: полоса пустая, область — один seed
+        return RegionResult(region_growing(gray, seed, diff_thresh, engine="band")), False
+
+    labels = band_labels(gray, image_key, lo, hi, cache)
+    component = int(labels[sr, sc])
+    key = (image_key, "result", lo, hi, component, diff_thresh)
+    result = cache.get(key)
+    if result is not None:
+        return result, True
+
+    first_wave = cv2.compare(labels, component, cv2.CMP_EQ)
+    result = RegionResult(region_growing(gray, seed, diff_thresh, engine="band", first_wave=first_wave))
+    cache.put(key, result)
+    return result, False
+
+
+def _tree_interactive(
+    gray: np.ndarray,
+    image_key: str,
+    seed: Tuple[int, int],
+    diff_thresh: int,
+    cache: RegionCache,
+) -> Tuple[RegionResult, bool]:
+    tree = alpha_tree(gray, image_key, cache)
+    hit = False
+
+    def component(alpha: int, node: int) -> Tuple[RegionResult, Stats]:
+        nonlocal hit
+        key = (image_key, "result", "tree", alpha, node)
+        result = cache.get(key)
+        hit = result is not None
+        if result is None:
+            result = RegionResult(*tree.component(alpha, node))
+            cache.put(key, result)
+        return result, result.stats
+
+    result = tree.region(seed, diff_thresh, component)
+    if result is not None:
+        return result, hit
+
+    # однородной компоненты нет — одна волна band вокруг опорной яркости
+    lo, hi = reference_band(gray, seed, diff_thresh)
+    if lo > hi:
+        return RegionResult(seed_mask(gray.shape, seed)), False
+    labels = band_labels(gray, image_key, lo, hi, cache)
+    component_id = int(labels[seed])
+    key = (image_key, "result", "tree-band", lo, hi, component_id)
+    result = cache.get(key)
+    if result is not None:
+        return result, True
+    result = RegionResult(cv2.compare(labels, component_id, cv2.CMP_EQ))
+    cache.put(key, result)
+    return result, False
@@ -0,0 +1,133 @@
+# app/segmentation/renders.py
+"""
+Дисковый кэш отрисовок: PNG масок для /api/masks и оверлеи PR2 рисуются
+при первом GET из компактных данных (.msk, детекции в JSON) и кладутся
+сюда, а не пишутся заранее на каждую сегментацию.
+
+Кэш ограничен RENDER_CACHE_MAX_BYTES: сверх бюджета удаляются давно не
+запрошенные файлы (LRU). Порядок держится в памяти; попадание обновляет
+mtime файла, поэтому после рестарта порядок восстанавливается по mtime.
+Имя файла — ключ отрисовки: содержимое по имени не меняется, удалённое
+просто рисуется заново.
+"""
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from app.config import RENDER_CACHE_MAX_BYTES, RENDER_CACHE_SUBDIR, RESULTS_DIR
+from app.metrics import count_bytes, stage
+
+
+class RenderCache:
+    """Файлы отрисовок по имени с бюджетом на диске и вытеснением LRU."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index: Optional["OrderedDict[str, int]"] = None  # имя -> размер, от давних к недавним
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._rendering: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load_index(self) -> None:
+        """Под self._lock: уже лежащие файлы, от давно тронутых к недавним."""
+        if self._index is not None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.root.iterdir():
+            if path.name.endswith(".tmp"):
+                path.unlink(missing_ok=True)  # недописанное с прошлого запуска
+                continue
+            st = path.stat()
+            entries.append((st.st_mtime_ns, path.name, st.st_size))
+        entries.sort()
+        self._index = OrderedDict((name, size) for _, name, size in entries)
+        self._bytes = sum(size for _, _, size in entries)
+
+    def _read(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            self._load_index()
+            if name not in self._index:
+                return None
+            self._index.move_to_end(name)
+        path = self.root / name
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            # вытеснили между проверкой и чтением или удалили руками
+            with self._lock:
+                size = self._index.pop(name, None)
+                if size is not None:
+                    self._bytes -= size
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def _store(self, name: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self.root / name
+        tmp = path.with_name(f".{name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        count_bytes("render", len(data))
+
+        evicted = []
+        with self._lock:
+            old = self._index.pop(name, None)
+            if old is not None:
+                self._bytes -= old
+            self._index[name] = len(data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                old_name, size = self._index.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+                evicted.append(old_name)
+        for old_name in evicted:
+            (self.root / old_name).unlink(missing_ok=True)
+
+    def get_or_render(self, name: str, render: Callable[[], bytes]) -> bytes:
+        """Байты отрисовки: с диска, иначе render() (один раз на имя при одновременных запросах)."""
+        data = self._read(name)
+        if data is not None:
+            return data
+        with self._lock:
+            lock = self._rendering.setdefault(name, threading.Lock())
+        try:
+            with lock:
+                data = self._read(name)  # пока ждали, мог нарисовать другой запрос
+                if data is not None:
+                    return data
+                with self._lock:
+                    self.misses += 1
+                with stage("render"):
+                    data = render()
+                self._store(name, data)
+                return data
+        finally:
+            with self._lock:
+                self._rendering.pop(name, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "files": len(self._index),
+                "bytes": self._bytes,
+                "budget_bytes": self.max_bytes,
+            }
+
+
+render_cache = RenderCache(RESULTS_DIR / RENDER_CACHE_SUBDIR, RENDER_CACHE_MAX_BYTES)
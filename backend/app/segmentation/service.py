@@ -0,0 +1,211 @@
+# app/segmentation/service.py
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import (
+    REGION_GROWING_ENGINE,
+    SEGMENTATION_TILED_MIN_PIXELS,
+    SWEEP_MAX_VALUES,
+    UPLOAD_DIR,
+    UPLOAD_SUBDIR,
+)
+from app.db import schemas
+from app.segmentation.cache import (
+    content_hash,
+    image_cache,
+    mask_cache,
+    mask_cache_key,
+)
+from app.segmentation.core import (
+    SEGMENTATION_METHODS,
+    iter_segment_methods,
+    method_params,
+    save_image,
+)
+from app.segmentation.encoding import write_preview_tiers
+from app.segmentation.interactive import region_growing_interactive
+from app.segmentation.sweep import (
+    SWEEP_METHODS,
+    adaptive_diff,
+    adaptive_sweep_masks,
+    adaptive_sweep_stats,
+    mask_stats,
+    sweep_values,
+    threshold_sweep_masks,
+    threshold_sweep_stats,
+    watershed_sweep_masks,
+)
+from app.segmentation.tiling import iter_segment_methods_tiled
+from app.segmentation.volume import iter_volume_masks
+
+
+def save_previews(img: np.ndarray, content_hash: str) -> Dict[str, str]:
+    """Полное превью (PNG, по нему считается сегментация) + уменьшенные уровни для просмотрщика."""
+    save_image(img, UPLOAD_DIR / f"{content_hash}.png")
+    img_bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR) if img.ndim == 3 else img
+    names = write_preview_tiers(img_bgr, UPLOAD_DIR, content_hash)
+    return {tier: f"{UPLOAD_SUBDIR}/{name}" for tier, name in names.items()}
+
+
+def segment_kwargs(params: schemas.SegmentAllRequest) -> Dict[str, Any]:
+    """Параметры запроса -> kwargs для iter_segment_methods/method_params."""
+    # seed_y/seed_x -> (row, col)
+    seed = (params.region_growing.seed_y, params.region_growing.seed_x)
+    return dict(
+        manual_thresh=params.manual_thresh,
+        adaptive_block_size=params.adaptive_block_size,
+        adaptive_C=params.adaptive_C,
+        region_seed=seed,
+        region_diff_thresh=params.region_growing.diff_thresh,
+        watershed_fg_fraction=params.watershed_fg_fraction,
+        region_engine=params.region_growing.engine or REGION_GROWING_ENGINE,
+    )
+
+
+def iter_cached_masks(
+    img_path: Path,
+    params: schemas.SegmentAllRequest,
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    Маски для всех методов: сначала то, что уже есть в кэше, затем
+    недостающие — по мере готовности. Отдаёт (метод, ключ кэша, rel_path).
+    """
+    seg_kwargs = segment_kwargs(params)
+
+    image_hash = content_hash(img_path)
+    keys = {
+        method: mask_cache_key(image_hash, method, method_kwargs)
+        for method, method_kwargs in method_params(**seg_kwargs).items()
+    }
+
+    missing = []
+    for method in SEGMENTATION_METHODS:
+        rel_path = mask_cache.lookup(keys[method])
+        if rel_path is None:
+            missing.append(method)
+        else:
+            yield method, keys[method], rel_path
+
+    if missing:
+        planes = image_cache.get(img_path)
+        # очень большие изображения — по тайлам (маски те же, см. app.segmentation.tiling)
+        segment = iter_segment_methods
+        if planes.gray.size >= SEGMENTATION_TILED_MIN_PIXELS:
+            segment = iter_segment_methods_tiled
+        for method, mask in segment(
+            planes.rgb,
+            methods=missing,
+            img_bgr=planes.bgr,
+            gray=planes.gray,
+            **seg_kwargs,
+        ):
+            yield method, keys[method], mask_cache.put(keys[method], mask)
+
+
+def segment_cached(
+    img_path: Path,
+    params: schemas.SegmentAllRequest,
+) -> list[Tuple[str, str, str]]:
+    """То же, что iter_cached_masks, но списком в порядке SEGMENTATION_METHODS."""
+    done = {method: (method, key, rel) for method, key, rel in iter_cached_masks(img_path, params)}
+    return [done[method] for method in SEGMENTATION_METHODS]
+
+
+def segment_volume(
+    volume_path: Path,
+    params: schemas.SegmentAllRequest,
+) -> list[Tuple[int, Dict[str, str]]]:
+    """Маски всех срезов объёма: [(индекс, {метод: rel_path})] в порядке срезов."""
+    return list(iter_volume_masks(volume_path, segment_kwargs(params)))
+
+
+def _method_cache_key(image_hash: str, method: str, **overrides: Any) -> str:
+    """Тот же ключ кэша, что у /segment/all для одного метода (остальные параметры на него не влияют)."""
+    kwargs: Dict[str, Any] = dict(
+        manual_thresh=0,
+        adaptive_block_size=0,
+        adaptive_C=0,
+        region_seed=(0, 0),
+        region_diff_thresh=0,
+        watershed_fg_fraction=0.5,
+    )
+    kwargs.update(overrides)
+    return mask_cache_key(image_hash, method, method_params(**kwargs)[method])
+
+
+def segment_sweep(
+    img_path: Path,
+    params: schemas.SegmentSweepRequest,
+) -> list[Dict[str, Any]]:
+    """
+    Перебор одного параметра (см. app.segmentation.sweep): по каждому
+    значению и зависящему от него методу — площадь и bbox, для
+    output="masks" ещё rel_path маски в кэше масок.
+    ValueError — некорректный список/диапазон значений.
+    """
+    value_range = None
+    if params.range is not None:
+        value_range = (params.range.start, params.range.stop, params.range.step)
+    values = sweep_values(params.parameter, params.values, value_range, SWEEP_MAX_VALUES)
+    with_masks = params.output == "masks"
+
+    planes = image_cache.get(img_path)
+    gray = planes.gray
+    image_hash = content_hash(img_path) if with_masks else None
+
+    results = []
+    for method in SWEEP_METHODS[params.parameter]:
+        if params.parameter == "manual_thresh":
+            stats = threshold_sweep_stats(gray, values)
+            masks = threshold_sweep_masks(gray, values) if with_masks else None
+        elif params.parameter == "adaptive_C":
+            diff = adaptive_diff(gray, params.adaptive_block_size, method)
+            stats = adaptive_sweep_stats(diff, values)
+            masks = adaptive_sweep_masks(diff, values) if with_masks else None
+        else:
+            # статистику для watershed по гистограмме не получить — нужны сами маски
+            ws_masks = watershed_sweep_masks(planes.bgr, gray, values)
+            stats = [mask_stats(m) for m in ws_masks]
+            masks = iter(ws_masks) if with_masks else None
+
+        for value, (area, bbox) in zip(values, stats):
+            item: Dict[str, Any] = {"value": value, "method": method, "area": area, "bbox": bbox}
+            if masks is not None:
+                mask = next(masks)
+                key = _method_cache_key(
+                    image_hash, method, adaptive_block_size=params.adaptive_block_size, **{params.parameter: value}
+                )
+                item["rel_path"] = mask_cache.lookup(key) or mask_cache.put(key, mask)
+            results.append(item)
+    return results
+
+
+def region_growing_cached(
+    img_path: Path,
+    params: schemas.RegionGrowingRequest,
+) -> Dict[str, Any]:
+    """
+    Только region growing (движок tree или band) для интерактивных кликов, см.
+    app.segmentation.interactive. Площадь, bbox, был ли результат в кэше и
+    rle либо rel_path маски (тот же ключ, что у /segment/all с тем же engine).
+    """
+    planes = image_cache.get(img_path)
+    image_hash = content_hash(img_path)
+    seed = (params.seed_y, params.seed_x)
+    result, cached = region_growing_interactive(
+        planes.gray, image_hash, seed, params.diff_thresh, engine=params.engine
+    )
+
+    item: Dict[str, Any] = {"area": result.area, "bbox": result.bbox, "cached": cached}
+    if params.output == "rle":
+        item["rle"] = result.rle()
+    else:
+        key = _method_cache_key(
+            image_hash, "region_growing",
+            region_seed=seed, region_diff_thresh=params.diff_thresh, region_engine=params.engine,
+        )
+        item["rel_path"] = mask_cache.lookup(key) or mask_cache.put(key, result.mask)
+    return item
@@ -0,0 +1,169 @@
+# app/segmentation/sweep.py
+"""
+Перебор значений одного параметра за один проход по изображению.
+
+- manual_thresh: маска gray <= t, поэтому площадь для всех t — из одной
+  гистограммы (накопленная сумма), bbox — из минимумов по строкам и столбцам;
+- adaptive_C: среднее (boxFilter / GaussianBlur — как внутри
+  cv2.adaptiveThreshold) считается один раз, маска = gray - mean > -C;
+  площадь — из гистограммы разности, bbox — из максимумов по строкам/столбцам;
+- watershed_fg_fraction: Otsu, морфология и distance transform один раз;
+  доли, дающие одинаковый sure_fg, затапливаются один раз.
+
+Маски совпадают с соответствующими функциями core побитово
+(проверка — benchmarks/bench_sweep.py).
+"""
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from app.segmentation.core import (
+    clamp_fg_fraction,
+    threshold_manual_inv,
+    watershed_from_morphology,
+    watershed_morphology,
+)
+
+SWEEP_PARAMETERS = ("manual_thresh", "adaptive_C", "watershed_fg_fraction")
+
+# параметр -> методы, маски которых от него зависят
+SWEEP_METHODS = {
+    "manual_thresh": ("manual_inv",),
+    "adaptive_C": ("adapt_mean", "adapt_gauss"),
+    "watershed_fg_fraction": ("watershed",),
+}
+
+# как в cv2.adaptiveThreshold
+_ADAPTIVE_BORDER = cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED
+
+# (площадь, [x_min, y_min, x_max, y_max] включительно или None)
+Stats = Tuple[int, Optional[List[int]]]
+
+
+def sweep_values(
+    parameter: str,
+    values: Optional[Sequence[float]],
+    value_range: Optional[Tuple[float, float, float]],
+    max_values: int,
+) -> List[float]:
+    """Список значений из values или (start, stop, step) включительно; ValueError — если что-то не так."""
+    if parameter not in SWEEP_PARAMETERS:
+        raise ValueError(f"Unknown sweep parameter: {parameter}")
+    if (values is None) == (value_range is None):
+        raise ValueError("Specify either values or range")
+    if value_range is not None:
+        start, stop, step = value_range
+        if step <= 0 or stop < start:
+            raise ValueError("range needs step > 0 and stop >= start")
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        if count > max_values:
+            raise ValueError(f"Too many values: {count} > {max_values}")
+        values = [round(start + i * step, 9) for i in range(count)]
+    values = list(dict.fromkeys(values))  # без повторов, порядок сохраняем
+    if not values:
+        raise ValueError("No values to sweep")
+    if len(values) > max_values:
+        raise ValueError(f"Too many values: {len(values)} > {max_values}")
+    if parameter != "watershed_fg_fraction":
+        if any(v != int(v) for v in values):
+            raise ValueError(f"{parameter} values must be integers")
+        values = [int(v) for v in values]
+    return values
+
+
+def _bbox_from_extrema(
+    row_ok: np.ndarray, col_ok: np.ndarray
+) -> List[Optional[List[int]]]:
+    """row_ok/col_ok: (n_values, h) / (n_values, w) — есть ли в строке/столбце пиксели маски."""
+    h, w = row_ok.shape[1], col_ok.shape[1]
+    any_row = row_ok.any(axis=1)
+    y0 = row_ok.argmax(axis=1)
+    y1 = h - 1 - row_ok[:, ::-1].argmax(axis=1)
+    x0 = col_ok.argmax(axis=1)
+    x1 = w - 1 - col_ok[:, ::-1].argmax(axis=1)
+    return [
+        [int(x0[i]), int(y0[i]), int(x1[i]), int(y1[i])] if any_row[i] else None
+        for i in range(len(any_row))
+    ]
+
+
+def threshold_sweep_stats(gray: np.ndarray, thresholds: Sequence[int]) -> List[Stats]:
+    """Площадь и bbox маски threshold_manual_inv(gray, t) для всех t сразу."""
+    t = np.clip(np.asarray(thresholds, dtype=np.int64), -1, 255)
+    cum = np.concatenate(([0], np.cumsum(np.bincount(gray.ravel(), minlength=256))))
+    areas = cum[t + 1]  # число пикселей <= t
+    row_min = gray.min(axis=1).astype(np.int64)
+    col_min = gray.min(axis=0).astype(np.int64)
+    boxes = _bbox_from_extrema(row_min[None, :] <= t[:, None], col_min[None, :] <= t[:, None])
+    return list(zip(map(int, areas), boxes))
+
+
+def threshold_sweep_masks(gray: np.ndarray, thresholds: Sequence[int]) -> Iterator[np.ndarray]:
+    for t in thresholds:
+        yield threshold_manual_inv(gray, t)
+
+
+def adaptive_diff(gray: np.ndarray, block_size: int, method: str) -> np.ndarray:
+    """gray - локальное среднее (int16), как его считает cv2.adaptiveThreshold."""
+    if method == "adapt_mean":
+        mean = cv2.boxFilter(gray, -1, (block_size, block_size), normalize=True, borderType=_ADAPTIVE_BORDER)
+    elif method == "adapt_gauss":
+        blurred = cv2.GaussianBlur(
+            gray.astype(np.float32), (block_size, block_size), 0, 0, borderType=_ADAPTIVE_BORDER
+        )
+        mean = np.clip(np.rint(blurred), 0, 255).astype(np.uint8)
+    else:
+        raise ValueError(f"Unknown adaptive method: {method}")
+    return cv2.subtract(gray, mean, dtype=cv2.CV_16S)
+
+
+def adaptive_sweep_stats(diff: np.ndarray, Cs: Sequence[int]) -> List[Stats]:
+    """Площадь и bbox маски diff > -C (= adaptive_mean/gaussian с этим C) для всех C."""
+    # k = -C; число пикселей с diff > k
+    k = np.clip(-np.asarray(Cs, dtype=np.int64), -256, 255)
+    hist = np.bincount((diff.ravel().astype(np.int32) + 255), minlength=511)
+    above = np.concatenate((np.cumsum(hist[::-1])[::-1], [0]))  # above[j] = count(diff + 255 >= j)
+    areas = above[k + 256]
+    row_max = diff.max(axis=1).astype(np.int64)
+    col_max = diff.max(axis=0).astype(np.int64)
+    boxes = _bbox_from_extrema(row_max[None, :] > k[:, None], col_max[None, :] > k[:, None])
+    return list(zip(map(int, areas), boxes))
+
+
+def adaptive_sweep_masks(diff: np.ndarray, Cs: Sequence[int]) -> Iterator[np.ndarray]:
+    for C in Cs:
+        yield cv2.compare(diff, float(-C), cv2.CMP_GT)
+
+
+def watershed_sweep_masks(
+    img_bgr: np.ndarray, gray: np.ndarray, fractions: Sequence[float]
+) -> List[np.ndarray]:
+    """
+    watershed_segmentation для каждой доли. Otsu, морфология и distance
+    transform — один раз; затопление — по одному на каждый различный sure_fg
+    (sure_fg монотонно уменьшается с ростом доли, так что равная площадь —
+    это та же маска).
+    """
+    _, thresh_inv = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    opening, sure_bg = watershed_morphology(thresh_inv)
+    dist = cv2.distanceTransform(opening, cv2.DIST_L2, 5)
+    dist_max = dist.max()
+
+    by_fg: Dict[int, np.ndarray] = {}
+    masks = []
+    for fraction in fractions:
+        _, sure_fg = cv2.threshold(dist, clamp_fg_fraction(fraction) * dist_max, 255, 0)
+        fg_area = cv2.countNonZero(sure_fg)
+        if fg_area not in by_fg:
+            by_fg[fg_area] = watershed_from_morphology(img_bgr, opening, sure_bg, fraction, dist=dist)
+        masks.append(by_fg[fg_area])
+    return masks
+
+
+def mask_stats(mask: np.ndarray) -> Stats:
+    area = cv2.countNonZero(mask)
+    if area == 0:
+        return 0, None
+    x, y, w, h = cv2.boundingRect(mask)
+    return area, [x, y, x + w - 1, y + h - 1]
@@ -0,0 +1,244 @@
+# app/segmentation/tiling.py
+"""
+Тайловый режим для очень больших изображений (whole-slide, 10k x 10k и больше).
+
+Серое изображение режется на тайлы с перекрытием («полями»), тайлы
+обрабатываются параллельно в пуле потоков (OpenCV отпускает GIL), из каждого
+в результат копируется только центральная часть без полей. Поля равны радиусу
+окна метода, поэтому центральная часть считается по тем же пикселям, что и
+без тайлов, и результат совпадает бит в бит:
+
+- manual_inv — поэлементный порог, полей не нужно;
+- otsu_inv — порог Otsu один на всё изображение, по гистограмме, собранной
+  по тайлам (otsu_threshold повторяет алгоритм OpenCV), затем обычный порог;
+- adapt_mean / adapt_gauss — поля block_size // 2;
+- watershed — порог Otsu и морфология по тайлам (поля WATERSHED_MORPH_REACH),
+  distance transform, маркеры и затопление глобальные по своей природе и
+  считаются один раз на всём изображении;
+- region_growing — связность глобальная, считается целиком (band-движок
+  работает на uint8-масках, памяти ему хватает).
+"""
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import SEGMENTATION_THREAD_WORKERS, SEGMENTATION_TILE_SIZE
+from app.segmentation.core import (
+    SEGMENTATION_METHODS,
+    WATERSHED_MORPH_REACH,
+    adaptive_gaussian,
+    adaptive_mean,
+    region_growing,
+    rgb_to_gray,
+    threshold_manual_inv,
+    watershed_from_morphology,
+    watershed_morphology,
+)
+from app.segmentation.executor import submit
+
+# та же граница, что у OpenCV в getThreshVal_Otsu
+_FLT_EPSILON = float(np.finfo(np.float32).eps)
+
+# сколько тайлов одновременно в работе: в памяти кроме результата только они
+_TILES_IN_FLIGHT = 2 * max(1, SEGMENTATION_THREAD_WORKERS)
+
+
+@dataclass(frozen=True)
+class Tile:
+    """Центральная часть тайла (куда пишем) и она же с полями (что читаем)."""
+
+    y0: int
+    y1: int
+    x0: int
+    x1: int
+    hy0: int
+    hy1: int
+    hx0: int
+    hx1: int
+
+    @property
+    def outer(self) -> Tuple[slice, slice]:
+        return slice(self.hy0, self.hy1), slice(self.hx0, self.hx1)
+
+    @property
+    def inner(self) -> Tuple[slice, slice]:
+        return slice(self.y0, self.y1), slice(self.x0, self.x1)
+
+    @property
+    def crop(self) -> Tuple[slice, slice]:
+        """Центральная часть внутри тайла с полями."""
+        return (
+            slice(self.y0 - self.hy0, self.y1 - self.hy0),
+            slice(self.x0 - self.hx0, self.x1 - self.hx0),
+        )
+
+
+def tile_grid(h: int, w: int, tile_size: int, halo: int) -> List[Tile]:
+    """Сетка тайлов tile_size x tile_size с полями halo (поля обрезаются по краю изображения)."""
+    tiles = []
+    for y0 in range(0, h, tile_size):
+        y1 = min(h, y0 + tile_size)
+        for x0 in range(0, w, tile_size):
+            x1 = min(w, x0 + tile_size)
+            tiles.append(
+                Tile(
+                    y0, y1, x0, x1,
+                    max(0, y0 - halo), min(h, y1 + halo),
+                    max(0, x0 - halo), min(w, x1 + halo),
+                )
+            )
+    return tiles
+
+
+def _map_tiles(
+    fn: Callable[..., Any],
+    gray: np.ndarray,
+    tiles: Iterable[Tile],
+    *args: Any,
+) -> Iterator[Tuple[Tile, Any]]:
+    in_flight: Deque[Tuple[Tile, Any]] = deque()
+    for tile in tiles:
+        in_flight.append((tile, submit(fn, gray[tile.outer], *args)))
+        if len(in_flight) >= _TILES_IN_FLIGHT:
+            done, fut = in_flight.popleft()
+            yield done, fut.result()
+    while in_flight:
+        done, fut = in_flight.popleft()
+        yield done, fut.result()
+
+
+def run_tiled(
+    fn: Callable[..., np.ndarray],
+    gray: np.ndarray,
+    halo: int,
+    *args: Any,
+    tile_size: int = SEGMENTATION_TILE_SIZE,
+) -> np.ndarray:
+    """Локальная операция fn(тайл, *args) -> маска того же размера, склеенная по тайлам."""
+    out = np.empty(gray.shape, dtype=np.uint8)
+    for tile, mask in _map_tiles(fn, gray, tile_grid(*gray.shape, tile_size, halo), *args):
+        out[tile.inner] = mask[tile.crop]
+    return out
+
+
+def _tile_hist(tile: np.ndarray) -> np.ndarray:
+    return cv2.calcHist([tile], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+
+
+def streamed_histogram(gray: np.ndarray, tile_size: int = SEGMENTATION_TILE_SIZE) -> np.ndarray:
+    """Гистограмма uint8-изображения, собранная по тайлам (int64, 256 корзин)."""
+    hist = np.zeros(256, dtype=np.int64)
+    for _, tile_hist in _map_tiles(_tile_hist, gray, tile_grid(*gray.shape, tile_size, 0)):
+        hist += tile_hist
+    return hist
+
+
+def otsu_threshold(hist: np.ndarray) -> float:
+    """Порог Otsu по гистограмме — тот же расчёт (и тот же порядок операций), что в OpenCV."""
+    counts = [int(v) for v in hist]
+    scale = 1.0 / sum(counts)
+    mu = 0.0
+    for i, n in enumerate(counts):
+        mu += i * float(n)
+    mu *= scale
+
+    mu1 = q1 = 0.0
+    max_sigma = 0.0
+    max_val = 0
+    for i, n in enumerate(counts):
+        p_i = n * scale
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < _FLT_EPSILON or max(q1, q2) > 1.0 - _FLT_EPSILON:
+            continue
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+        if sigma > max_sigma:
+            max_sigma = sigma
+            max_val = i
+    return float(max_val)
+
+
+def _watershed_tile(tile: np.ndarray, otsu_t: float) -> np.ndarray:
+    """Порог + морфология одного тайла; opening и sure_bg упакованы в один массив (2, h, w)."""
+    thresh_inv = threshold_manual_inv(tile, otsu_t)
+    return np.stack(watershed_morphology(thresh_inv))
+
+
+def iter_segment_methods_tiled(
+    img_rgb: Optional[np.ndarray],
+    *,
+    manual_thresh: int,
+    adaptive_block_size: int,
+    adaptive_C: int,
+    region_seed: Tuple[int, int],
+    region_diff_thresh: int,
+    watershed_fg_fraction: float,
+    region_engine: str = "bfs",
+    methods: Optional[Iterable[str]] = None,
+    img_bgr: Optional[np.ndarray] = None,
+    gray: Optional[np.ndarray] = None,
+    tile_size: int = SEGMENTATION_TILE_SIZE,
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    Тот же контракт, что у core.iter_segment_methods, но по тайлам:
+    методы идут по очереди, тайлы каждого метода — параллельно.
+    """
+    wanted = set(SEGMENTATION_METHODS if methods is None else methods)
+    unknown = wanted.difference(SEGMENTATION_METHODS)
+    if unknown:
+        raise ValueError(f"Неизвестные методы сегментации: {sorted(unknown)}")
+    if not wanted:
+        return
+
+    if gray is None:
+        gray = rgb_to_gray(img_rgb)
+
+    otsu_t = None
+    if wanted & {"otsu_inv", "watershed"}:
+        otsu_t = otsu_threshold(streamed_histogram(gray, tile_size))
+
+    adaptive_halo = adaptive_block_size // 2
+
+    for name in SEGMENTATION_METHODS:
+        if name not in wanted:
+            continue
+        if name == "manual_inv":
+            mask = run_tiled(threshold_manual_inv, gray, 0, manual_thresh, tile_size=tile_size)
+        elif name == "otsu_inv":
+            mask = run_tiled(threshold_manual_inv, gray, 0, otsu_t, tile_size=tile_size)
+        elif name == "adapt_mean":
+            mask = run_tiled(
+                adaptive_mean, gray, adaptive_halo, adaptive_block_size, adaptive_C, tile_size=tile_size
+            )
+        elif name == "adapt_gauss":
+            mask = run_tiled(
+                adaptive_gaussian, gray, adaptive_halo, adaptive_block_size, adaptive_C, tile_size=tile_size
+            )
+        elif name == "region_growing":
+            mask = submit(
+                region_growing,
+                gray,
+                region_seed,
+                region_diff_thresh,
+                region_engine,
+                cpu_bound=region_engine == "bfs",
+                result_like=gray,
+            ).result()
+        else:  # watershed
+            if img_bgr is None:
+                img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+            opening = np.empty(gray.shape, dtype=np.uint8)
+            sure_bg = np.empty(gray.shape, dtype=np.uint8)
+            tiles = tile_grid(*gray.shape, tile_size, WATERSHED_MORPH_REACH)
+            for tile, packed in _map_tiles(_watershed_tile, gray, tiles, otsu_t):
+                opening[tile.inner] = packed[0][tile.crop]
+                sure_bg[tile.inner] = packed[1][tile.crop]
+            mask = watershed_from_morphology(img_bgr, opening, sure_bg, watershed_fg_fraction)
+            del opening, sure_bg
+        yield name, mask
@@ -0,0 +1,191 @@
+# app/segmentation/volume.py
+"""
+Многокадровые DICOM (КТ/МРТ серии).
+
+Объём хранится как .npy (depth, h, w) uint8 в порядке C: каждый срез —
+непрерывный кусок файла. Пишется последовательно, срез за срезом, читается
+через np.load(mmap_mode="r") без загрузки остального объёма. Сегментация идёт по срезам
+в своём пуле процессов (VOLUME_PROCESS_WORKERS, по числу ядер):
+воркер сам открывает memmap, считает все методы и сразу пишет маски — один
+многослойный .msk на срез (все методы) или PNG на метод при формате "png".
+В полёте не больше VOLUME_MAX_IN_FLIGHT срезов, поэтому память не зависит
+от глубины объёма.
+"""
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, Tuple
+
+import cv2
+import numpy as np
+from numpy.lib import format as npy_format
+from pydicom.errors import InvalidDicomError
+
+from app.config import (
+    MASK_STORAGE_FORMAT,
+    RESULTS_DIR,
+    RESULTS_SUBDIR,
+    VOLUME_MAX_IN_FLIGHT,
+    VOLUME_SUBDIR,
+)
+from app.metrics import timed
+from app.segmentation.cache import content_hash, mask_cache_key
+from app.segmentation.core import SEGMENTATION_METHODS, method_params, segment_all_methods
+from app.segmentation.dicom import (
+    DicomSource,
+    dicom_frame_count,
+    iter_dicom_frames,
+    read_dicom_frame,
+    read_dicom_header,
+)
+from app.segmentation.encoding import PROFILES
+from app.segmentation.executor import get_volume_pool, inline_tasks, submit
+from app.segmentation.maskcodec import write_layers
+
+
+def write_volume(src: Any, path: Path) -> Tuple[np.ndarray, int]:
+    """
+    Многокадровый DICOM -> .npy покадрово (кадры уже переведены в uint8 окном/LUT).
+    Возвращает (копия среднего среза для превью, глубина).
+    """
+    ds = read_dicom_header(src)
+    depth = dicom_frame_count(ds)
+    shape = (depth, int(ds.Rows), int(ds.Columns))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp.npy")
+    preview = None
+    written = 0
+    try:
+        with tmp.open("wb") as f:
+            npy_format.write_array_header_1_0(
+                f,
+                {
+                    "descr": npy_format.dtype_to_descr(np.dtype(np.uint8)),
+                    "fortran_order": False,
+                    "shape": shape,
+                },
+            )
+            for i, frame in enumerate(iter_dicom_frames(src)):
+                if frame.shape != shape[1:]:
+                    raise ValueError("Цветные многокадровые DICOM не поддерживаются")
+                f.write(np.ascontiguousarray(frame).data)
+                if i == depth // 2:
+                    preview = frame.copy()
+                written += 1
+        if written != depth:
+            raise ValueError(f"В DICOM {written} кадров вместо {depth}")
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    tmp.replace(path)
+    return preview, depth
+
+
+@timed("decode_dicom")
+def decode_dicom_upload(src: DicomSource, volume_path: Path) -> Tuple[np.ndarray, int]:
+    """
+    DICOM (путь к файлу или байты) -> (превью uint8, глубина). Многокадровый
+    файл дополнительно раскладывается по срезам в volume_path.
+    ValueError — файл не читается как DICOM или объём не поддерживается
+    (недописанный .npy при этом не остаётся).
+    """
+    try:
+        if dicom_frame_count(read_dicom_header(src)) > 1:
+            return write_volume(src, volume_path)
+        return read_dicom_frame(src), 1
+    except (InvalidDicomError, AttributeError, KeyError, NotImplementedError, RuntimeError) as exc:
+        # pydicom: не DICOM, нет обязательных тегов (Rows/Columns), нет декодера для сжатия
+        raise ValueError(f"Cannot decode DICOM: {exc}") from exc
+
+
+def open_volume(path: Path) -> np.ndarray:
+    return np.load(path, mmap_mode="r")
+
+
+def volume_result_key(volume_path: Path, seg_kwargs: Dict[str, Any]) -> str:
+    """Каталог масок объёма: хэш срезов + параметры всех методов."""
+    return mask_cache_key(content_hash(volume_path), "volume", method_params(**seg_kwargs))
+
+
+def volume_result_dir(key: str) -> Tuple[Path, str]:
+    return RESULTS_DIR / VOLUME_SUBDIR / key, f"{RESULTS_SUBDIR}/{VOLUME_SUBDIR}/{key}"
+
+
+def slice_mask_name(index: int, method: str) -> str:
+    """Файл с маской метода для среза; при формате "msk" он общий для всех методов."""
+    if MASK_STORAGE_FORMAT == "msk":
+        return f"{index:05d}.msk"
+    return f"{index:05d}_{method}.png"
+
+
+def segment_volume_slice(
+    volume_path: Path,
+    index: int,
+    seg_kwargs: Dict[str, Any],
+    out_dir: Path,
+) -> int:
+    """Один срез: все методы + запись масок. Выполняется в воркере пула."""
+    gray = np.array(open_volume(volume_path)[index])
+    img_rgb = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+    # параллелим по срезам, методы внутри среза — последовательно
+    with inline_tasks():
+        masks = segment_all_methods(
+            img_rgb,
+            img_bgr=img_rgb,  # серое: BGR и RGB совпадают
+            gray=gray,
+            **seg_kwargs,
+        )
+    if MASK_STORAGE_FORMAT == "msk":
+        write_layers(out_dir / slice_mask_name(index, ""), masks)
+        return index
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for method, mask in masks.items():
+        path = out_dir / slice_mask_name(index, method)
+        tmp = path.with_suffix(".tmp.png")
+        cv2.imwrite(str(tmp), mask, PROFILES["mask"].params)
+        tmp.replace(path)
+    return index
+
+
+def iter_volume_masks(
+    volume_path: Path,
+    seg_kwargs: Dict[str, Any],
+    max_in_flight: int = VOLUME_MAX_IN_FLIGHT,
+) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """
+    Маски объёма по срезам, в порядке срезов: (индекс, {метод: rel_path}).
+
+    Срезы, для которых маски уже лежат на диске (те же данные и параметры),
+    не пересчитываются.
+    """
+    depth = open_volume(volume_path).shape[0]
+    out_dir, rel_dir = volume_result_dir(volume_result_key(volume_path, seg_kwargs))
+
+    def rel_paths(index: int) -> Dict[str, str]:
+        return {m: f"{rel_dir}/{slice_mask_name(index, m)}" for m in SEGMENTATION_METHODS}
+
+    def done(index: int) -> bool:
+        return all((out_dir / slice_mask_name(index, m)).exists() for m in SEGMENTATION_METHODS)
+
+    in_flight: Deque[Tuple[int, Any]] = deque()
+    next_index = 0
+    while next_index < depth or in_flight:
+        while next_index < depth and len(in_flight) < max(1, max_in_flight):
+            fut = None
+            if not done(next_index):
+                fut = submit(
+                    segment_volume_slice,
+                    volume_path,
+                    next_index,
+                    seg_kwargs,
+                    out_dir,
+                    cpu_bound=True,
+                    process_pool=get_volume_pool,
+                )
+            in_flight.append((next_index, fut))
+            next_index += 1
+
+        index, fut = in_flight.popleft()
+        if fut is not None:
+            fut.result()
+        yield index, rel_paths(index)
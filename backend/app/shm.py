@@ -0,0 +1,347 @@
+# app/shm.py
+"""
+Передача массивов (картинки, маски) процессам-исполнителям через общую
+память (multiprocessing.shared_memory) вместо pickle.
+
+Через pickle массив в десятки МБ сериализуется, идёт по pipe кусками и
+разбирается обратно — несколько копий и тысячи системных вызовов, что на
+больших картинках дороже самой задачи. Здесь в процесс уходит только
+SharedArray (имя сегмента, форма, dtype), исполнитель отображает тот же
+сегмент к себе.
+
+Сегменты создаёт и удаляет только процесс-владелец (API, python -m app.batch),
+исполнители их лишь открывают:
+- SharedArrayPool.share()/empty() — аренда сегмента (Lease) со счётчиком
+  ссылок; при нуле сегмент возвращается в пул и переиспользуется (без нового
+  shm_open/mmap и page faults на первом касании), свободные сверх
+  SHARED_MEMORY_IDLE_BYTES удаляются;
+- submit_shared() держит аренды аргументов и результата, пока задача не
+  завершится, и отпускает их в done-callback — в том числе если процесс
+  упал (BrokenProcessPool) или задачу отменили;
+- close() (остановка приложения, atexit) удаляет все сегменты; если владелец
+  убит, их удалит resource tracker multiprocessing.
+
+Исполнитель видит массивы только на время вызова (call_shared): после него
+отображения закрываются. Результат-массив с формой и dtype result_like
+пишется в заранее выделенный сегмент, владелец копирует его к себе.
+"""
+import atexit
+import gc
+import os
+import threading
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import SHARED_MEMORY_IDLE_BYTES, SHARED_MEMORY_MIN_BYTES
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """Ссылка на массив в общей памяти — всё, что пиклится вместо самого массива."""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * np.dtype(self.dtype).itemsize
+
+
+class Lease:
+    """
+    Аренда сегмента пула. array — массив в сегменте (в процессе-владельце),
+    handle — ссылка для исполнителей. Сегмент живёт, пока счётчик ссылок
+    больше нуля; после последнего release() array больше не трогать.
+    """
+
+    def __init__(self, pool: "SharedArrayPool", shm: SharedMemory, shape: Tuple[int, ...], dtype: np.dtype):
+        self._pool = pool
+        self._shm = shm
+        self._refs = 1
+        self.array: Optional[np.ndarray] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self.handle = SharedArray(shm.name, tuple(shape), dtype.str)
+
+    def retain(self) -> "Lease":
+        with self._pool._lock:
+            if self._refs <= 0:
+                raise RuntimeError("Shared array lease is already released")
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        with self._pool._lock:
+            if self._refs <= 0:
+                raise RuntimeError("Shared array lease is already released")
+            self._refs -= 1
+            if self._refs:
+                return
+        self.array = None  # наш view держит буфер сегмента
+        self._pool._recycle(self._shm)
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+
+def _destroy(shm: SharedMemory) -> None:
+    try:
+        shm.close()
+    except BufferError:
+        pass  # где-то ещё жив view — отображение уйдёт вместе с ним
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedArrayPool:
+    """Сегменты общей памяти процесса-владельца: выдача в аренду и переиспользование."""
+
+    def __init__(self, max_idle_bytes: int):
+        self.max_idle_bytes = max_idle_bytes
+        self._lock = threading.Lock()
+        self._leased: Dict[str, SharedMemory] = {}
+        self._idle: List[SharedMemory] = []  # от давно освобождённых к недавним
+        self._idle_bytes = 0
+        self._owner_pid = os.getpid()
+        self.created = 0
+        self.reused = 0
+
+    def _take_idle(self, nbytes: int) -> Optional[SharedMemory]:
+        """Самый маленький свободный сегмент, куда влезает nbytes (но не больше чем вдвое)."""
+        best = None
+        for i, shm in enumerate(self._idle):
+            if nbytes <= shm.size <= 2 * nbytes and (best is None or shm.size < self._idle[best].size):
+                best = i
+        if best is None:
+            return None
+        shm = self._idle.pop(best)
+        self._idle_bytes -= shm.size
+        return shm
+
+    def empty(self, shape: Tuple[int, ...], dtype: Any) -> Lease:
+        """Аренда неинициализированного массива."""
+        dtype = np.dtype(dtype)
+        nbytes = max(1, int(np.prod(shape, dtype=np.int64)) * dtype.itemsize)
+        with self._lock:
+            shm = self._take_idle(nbytes)
+            if shm is not None:
+                self.reused += 1
+        if shm is None:
+            shm = SharedMemory(create=True, size=nbytes)
+            with self._lock:
+                self.created += 1
+        with self._lock:
+            self._leased[shm.name] = shm
+        return Lease(self, shm, tuple(shape), dtype)
+
+    def share(self, arr: np.ndarray) -> Lease:
+        """Аренда с копией arr (одна memcpy вместо pickle)."""
+        lease = self.empty(arr.shape, arr.dtype)
+        np.copyto(lease.array, arr)
+        return lease
+
+    def _recycle(self, shm: SharedMemory) -> None:
+        evicted = []
+        with self._lock:
+            if self._leased.pop(shm.name, None) is None:
+                evicted.append(shm)  # пул уже закрыт: сегмент удалён, осталось отображение
+            else:
+                self._idle.append(shm)
+                self._idle_bytes += shm.size
+                while self._idle_bytes > self.max_idle_bytes:
+                    old = self._idle.pop(0)
+                    self._idle_bytes -= old.size
+                    evicted.append(old)
+        for old in evicted:
+            _destroy(old)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "leased": len(self._leased),
+                "leased_bytes": sum(shm.size for shm in self._leased.values()),
+                "idle": len(self._idle),
+                "idle_bytes": self._idle_bytes,
+                "created": self.created,
+                "reused": self.reused,
+            }
+
+    def close(self) -> None:
+        """Удалить все сегменты. Арендованные дочитываются до release(), новых имён не видно."""
+        if os.getpid() != self._owner_pid:
+            return  # копия пула в дочернем процессе: сегменты не наши
+        with self._lock:
+            segments = self._idle + list(self._leased.values())
+            self._idle, self._idle_bytes = [], 0
+            self._leased.clear()
+        for shm in segments:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        # отображения свободных закрываем сразу, арендованных — в release()
+        for shm in segments:
+            try:
+                shm.close()
+            except BufferError:
+                pass
+
+
+array_pool = SharedArrayPool(SHARED_MEMORY_IDLE_BYTES)
+atexit.register(array_pool.close)
+
+
+# ---------- сторона исполнителя ----------
+
+# отображения, которые не удалось закрыть (на массив ещё кто-то ссылался)
+_unclosed: List[SharedMemory] = []
+
+
+def _close_mappings(opened: List[SharedMemory]) -> None:
+    pending = _unclosed + opened
+    _unclosed.clear()
+    for shm in pending:
+        try:
+            shm.close()
+        except BufferError:
+            _unclosed.append(shm)
+    if _unclosed:
+        # обычно это циклы с массивом внутри (объекты результатов модели)
+        gc.collect()
+        pending = _unclosed[:]
+        _unclosed.clear()
+        for shm in pending:
+            try:
+                shm.close()
+            except BufferError:
+                _unclosed.append(shm)  # попробуем на следующем вызове
+
+
+def _attach(obj: Any, opened: List[SharedMemory], arrays: List[np.ndarray]) -> Any:
+    """SharedArray внутри кортежей/списков/dict -> массивы в отображённых сегментах."""
+    if isinstance(obj, SharedArray):
+        shm = SharedMemory(name=obj.name)
+        opened.append(shm)
+        arr = np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)
+        arrays.append(arr)
+        return arr
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(_attach(item, opened, arrays) for item in obj)
+    if isinstance(obj, dict):
+        return {key: _attach(value, opened, arrays) for key, value in obj.items()}
+    return obj
+
+
+def call_shared(
+    fn: Callable[..., Any],
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any],
+    out: Optional[SharedArray] = None,
+) -> Any:
+    """
+    Вызов fn в исполнителе: SharedArray в аргументах заменяются массивами.
+    Если out задан и результат — массив той же формы и dtype, он пишется в
+    out, а возвращается сам out. Работает и без общей памяти (обычные аргументы).
+    """
+    opened: List[SharedMemory] = []
+    arrays: List[np.ndarray] = []
+    try:
+        args, kwargs = _attach((args, kwargs), opened, arrays)
+        result = fn(*args, **kwargs)
+        del args, kwargs
+        if isinstance(result, np.ndarray):
+            if out is not None and result.shape == out.shape and result.dtype == np.dtype(out.dtype):
+                dst = _attach(out, opened, arrays)
+                np.copyto(dst, result)
+                del dst
+                result = out
+            elif any(np.may_share_memory(result, arr) for arr in arrays):
+                result = result.copy()  # view на входной сегмент не переживёт закрытия
+        return result
+    finally:
+        args = kwargs = None
+        arrays.clear()
+        _close_mappings(opened)
+
+
+def _share_args(
+    obj: Any, pool: SharedArrayPool, min_bytes: int, leases: List[Lease], memo: Dict[int, SharedArray]
+) -> Any:
+    """Массивы от min_bytes и Lease внутри кортежей/списков/dict -> SharedArray."""
+    if isinstance(obj, Lease):
+        leases.append(obj.retain())
+        return obj.handle
+    if isinstance(obj, np.ndarray) and obj.nbytes >= min_bytes:
+        handle = memo.get(id(obj))
+        if handle is None:
+            lease = pool.share(obj)
+            leases.append(lease)
+            handle = memo[id(obj)] = lease.handle
+        return handle
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(_share_args(item, pool, min_bytes, leases, memo) for item in obj)
+    if isinstance(obj, dict):
+        return {key: _share_args(value, pool, min_bytes, leases, memo) for key, value in obj.items()}
+    return obj
+
+
+def submit_shared(
+    executor: Executor,
+    fn: Callable[..., Any],
+    *args: Any,
+    result_like: Optional[np.ndarray] = None,
+    pool: SharedArrayPool = array_pool,
+    min_bytes: int = SHARED_MEMORY_MIN_BYTES,
+    **kwargs: Any,
+) -> Future:
+    """
+    executor.submit(fn, *args, **kwargs) для пула процессов, где массивы
+    (от min_bytes) и Lease в аргументах уходят ссылками на общую память.
+
+    result_like — массив той же формы и dtype, что результат (маска того же
+    размера, что картинка): под результат заранее берётся сегмент, и он
+    возвращается без pickle. Future отдаёт обычные массивы, все аренды
+    отпускаются, когда задача завершилась любым образом.
+    """
+    leases: List[Lease] = []
+    out: Optional[Lease] = None
+    try:
+        shared_args, shared_kwargs = _share_args((args, kwargs), pool, min_bytes, leases, {})
+        if result_like is not None and result_like.nbytes >= min_bytes:
+            out = pool.empty(result_like.shape, result_like.dtype)
+            leases.append(out)
+        inner = executor.submit(call_shared, fn, shared_args, shared_kwargs, out.handle if out else None)
+    except BaseException:
+        for lease in leases:
+            lease.release()
+        raise
+
+    outer: Future = Future()
+
+    def _done(fut: Future) -> None:
+        try:
+            if fut.cancelled():
+                outer.cancel()
+                return
+            exc = fut.exception()
+            if exc is not None:
+                outer.set_exception(exc)
+                return
+            result = fut.result()
+            if out is not None and isinstance(result, SharedArray):
+                result = out.array.copy()
+            outer.set_result(result)
+        finally:
+            for lease in leases:
+                lease.release()
+
+    inner.add_done_callback(_done)
+    return outer
@@ -0,0 +1,210 @@
+# app/yolo/batching.py
+import asyncio
+import time
+from collections import Counter, deque
+from concurrent.futures import BrokenExecutor, Executor
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.concurrency import Overloaded
+
+
+class BatchStats:
+    """Задержки запросов и размеры пачек за последние `window` запросов."""
+
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.batch_sizes: Counter = Counter()
+        self._latencies_ms: Deque[float] = deque(maxlen=window)
+        self._waits_ms: Deque[float] = deque(maxlen=window)
+
+    def record_batch(self, size: int) -> None:
+        self.batches += 1
+        self.batch_sizes[size] += 1
+
+    def record_request(self, wait_ms: float, latency_ms: float) -> None:
+        self.requests += 1
+        self._waits_ms.append(wait_ms)
+        self._latencies_ms.append(latency_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        total = sum(size * n for size, n in self.batch_sizes.items())
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "avg_batch_size": round(total / self.batches, 3) if self.batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "queue_wait_ms": _percentiles(self._waits_ms),
+            "latency_ms": _percentiles(self._latencies_ms),
+        }
+
+
+def _percentiles(values: Deque[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": round(ordered[-1], 3)}
+
+
+class MicroBatcher:
+    """
+    Склеивает одновременные запросы в одну пачку для batch-функции.
+
+    Пачка уходит, когда набралось max_batch_size элементов или с момента
+    прихода первого элемента прошло max_wait_ms. Пока пачка считается,
+    новые запросы копятся в очереди и образуют следующую.
+
+    fn(items) -> results: синхронная функция, результаты в том же порядке.
+    get_executor() -> Executor | None: где выполнять fn (None -> пул потоков
+    Starlette); одновременно считается не больше max_in_flight пачек.
+    reset_executor(executor) — вызывается, если исполнитель сломан
+    (BrokenExecutor): ошибку получает только эта пачка, следующая уйдёт в
+    пересозданный пул.
+    max_pending — сколько запросов может ждать/считаться, остальные получают Overloaded.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], List[Any]],
+        *,
+        max_batch_size: int,
+        max_wait_ms: float,
+        get_executor: Optional[Callable[[], Optional[Executor]]] = None,
+        reset_executor: Optional[Callable[[Executor], Any]] = None,
+        max_in_flight: int = 1,
+        max_pending: Optional[int] = None,
+        retry_after: int = 1,
+    ):
+        self._fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.stats = BatchStats()
+        self._get_executor = get_executor
+        self._reset_executor = reset_executor
+        self._pending = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def submit(self, item: Any) -> Any:
+        if self.max_pending is not None and self._pending >= self.max_pending:
+            raise Overloaded(self.retry_after)
+        self._ensure_worker()
+        fut = self._loop.create_future()
+        self._pending += 1
+        try:
+            await self._queue.put((item, fut, time.perf_counter()))
+            return await fut
+        finally:
+            self._pending -= 1
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self._worker = None
+        self._queue = None
+        self._loop = None
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # новый event loop (рестарт приложения / TestClient) — начинаем с чистой очереди
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future, float]]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _execute(self, items: List[Any]) -> List[Any]:
+        executor = self._get_executor() if self._get_executor is not None else None
+        if executor is None:
+            return await run_in_threadpool(self._fn, items)
+        try:
+            return await self._loop.run_in_executor(executor, self._fn, items)
+        except BrokenExecutor:
+            if self._reset_executor is not None:
+                self._reset_executor(executor)
+            raise
+
+    async def _run(self) -> None:
+        while True:
+            # не набираем новую пачку, пока все исполнители заняты —
+            # запросы тем временем копятся в очереди и образуют пачку побольше
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = self._loop.create_task(self._run_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run_batch(self, batch: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        try:
+            started = time.perf_counter()
+            self.stats.record_batch(len(batch))
+
+            try:
+                results = await self._execute([item for item, _, _ in batch])
+            except Exception as exc:  # noqa: BLE001 — ошибку получают все запросы пачки
+                self.stats.errors += len(batch)
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                return
+
+            finished = time.perf_counter()
+            for (_, fut, enqueued), result in zip(batch, results):
+                self.stats.record_request(
+                    wait_ms=(started - enqueued) * 1000.0,
+                    latency_ms=(finished - enqueued) * 1000.0,
+                )
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self._slots.release()
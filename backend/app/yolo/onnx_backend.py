@@ -0,0 +1,356 @@
+# app/yolo/onnx_backend.py
+"""
+PR2 на onnxruntime (CPU): в рантайме не нужны ни torch, ни ultralytics.
+
+Модель — YOLOv8-seg, экспортированная Ultralytics в ONNX (export_onnx, один
+раз; для экспорта ultralytics нужен). Вход "images" (B, 3, H, W) — RGB / 255
+после letterbox; выходы:
+- output0 (B, 4 + nc + 32, N) — бокс cx, cy, w, h в пикселях входа,
+  вероятности классов, коэффициенты масок;
+- output1 (B, 32, H/4, W/4) — прототипы масок.
+
+Пред- и постобработка повторяют Ultralytics (LetterBox, non_max_suppression,
+process_mask, scale_boxes, masks2segments), но на numpy/OpenCV.
+int8 — динамическая квантизация весов той же модели (quantize_int8).
+
+Экспорт/квантизация из командной строки, из каталога backend:
+    python -m app.yolo.onnx_backend
+    python -m app.yolo.onnx_backend --int8
+"""
+import argparse
+import ast
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import (
+    PR2_IMGSZ,
+    PR2_ONNX_INT8,
+    PR2_ONNX_INT8_PATH,
+    PR2_ONNX_PATH,
+    PR2_TORCH_THREADS,
+)
+from app.metrics import observe_model_load
+from app.yolo.pr2_yolo import PR2_MODEL_PATH, Prediction, scale_mask, weights_fingerprint
+
+# как в ultralytics.utils.ops.non_max_suppression
+_MAX_WH = 7680  # сдвиг боксов по классу, чтобы NMS не гасил боксы разных классов
+_MAX_NMS = 30000  # кандидатов в NMS не больше
+_MAX_DET = 300
+_PAD_VALUE = 114
+
+
+def letterbox(
+    img: np.ndarray,
+    new_shape: Tuple[int, int],
+    auto: bool,
+    stride: int = 32,
+) -> np.ndarray:
+    """
+    Масштаб с сохранением пропорций + серые поля до new_shape (h, w), как
+    ultralytics LetterBox. auto — поля только до кратности stride.
+    """
+    h, w = img.shape[:2]
+    r = min(new_shape[0] / h, new_shape[1] / w)
+    new_unpad = int(round(w * r)), int(round(h * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:
+        dw, dh = np.mod(dw, stride), np.mod(dh, stride)
+    dw /= 2
+    dh /= 2
+    if (w, h) != new_unpad:
+        img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(
+        img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(_PAD_VALUE,) * 3
+    )
+    return img
+
+
+def to_blob(images: List[np.ndarray]) -> np.ndarray:
+    """BGR HWC uint8 -> RGB NCHW float32 / 255 одной операцией на пачку."""
+    batch = np.stack(images)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) * np.float32(1 / 255)
+
+
+def xywh2xyxy(xywh: np.ndarray) -> np.ndarray:
+    xyxy = np.empty_like(xywh)
+    half = xywh[:, 2:4] / 2
+    xyxy[:, :2] = xywh[:, :2] - half
+    xyxy[:, 2:4] = xywh[:, :2] + half
+    return xyxy
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_thresh: float) -> np.ndarray:
+    """Жадный NMS (как torchvision.ops.nms): индексы оставленных боксов по убыванию score."""
+    order = np.argsort(-scores, kind="stable")
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[iou <= iou_thresh]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def non_max_suppression(
+    pred: np.ndarray,
+    nc: int,
+    conf: float,
+    iou: float,
+    max_det: int = _MAX_DET,
+) -> np.ndarray:
+    """
+    pred (N, 4 + nc + nm) одного изображения -> (n, 6 + nm):
+    x1, y1, x2, y2, conf, cls, коэффициенты масок.
+    """
+    scores = pred[:, 4:4 + nc]
+    cls = scores.argmax(1)
+    best = scores[np.arange(len(pred)), cls]
+    mask = best > conf
+    pred, cls, best = pred[mask], cls[mask], best[mask]
+    if not len(pred):
+        return np.zeros((0, pred.shape[1] + 2 - nc), dtype=np.float32)
+    if len(pred) > _MAX_NMS:
+        top = np.argsort(-best, kind="stable")[:_MAX_NMS]
+        pred, cls, best = pred[top], cls[top], best[top]
+
+    boxes = xywh2xyxy(pred[:, :4])
+    keep = nms(boxes + cls[:, None] * _MAX_WH, best, iou)[:max_det]
+    return np.concatenate(
+        [
+            boxes[keep],
+            best[keep, None],
+            cls[keep, None].astype(np.float32),
+            pred[keep, 4 + nc:],
+        ],
+        axis=1,
+    )
+
+
+def decode_masks(
+    protos: np.ndarray,
+    coeffs: np.ndarray,
+    boxes: np.ndarray,
+    shape: Tuple[int, int],
+) -> np.ndarray:
+    """
+    Маски экземпляров (n, h, w) bool в пикселях входа: коэффициенты x
+    прототипы одной матричной операцией, обрезка по боксу на сетке
+    прототипов, билинейное увеличение, порог 0 (process_mask Ultralytics).
+    """
+    nm, mh, mw = protos.shape
+    n = len(coeffs)
+    if not n:
+        return np.zeros((0, *shape), dtype=bool)
+    logits = (coeffs @ protos.reshape(nm, -1)).reshape(n, mh, mw)
+
+    scaled = boxes * np.array([mw / shape[1], mh / shape[0]] * 2, dtype=np.float32)
+    x1, y1, x2, y2 = (scaled[:, i, None, None] for i in range(4))
+    cols = np.arange(mw, dtype=np.float32)[None, None, :]
+    rows = np.arange(mh, dtype=np.float32)[None, :, None]
+    logits *= (cols >= x1) & (cols < x2) & (rows >= y1) & (rows < y2)
+
+    masks = np.empty((n, *shape), dtype=bool)
+    for i in range(n):
+        np.greater(
+            cv2.resize(logits[i], (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR),
+            0.0,
+            out=masks[i],
+        )
+    return masks
+
+
+def scale_coords(
+    xy: np.ndarray,
+    input_shape: Tuple[int, int],
+    orig_shape: Tuple[int, int],
+    round_pad: bool = False,
+) -> np.ndarray:
+    """
+    Точки (n, 2) или боксы (n, 4) из пикселей входа в пиксели исходника, in-place.
+    Масштаб и поля восстанавливаются по размерам, как в Ultralytics
+    (scale_boxes округляет поля — round_pad, scale_coords нет).
+    """
+    gain = min(input_shape[0] / orig_shape[0], input_shape[1] / orig_shape[1])
+    pad_x = (input_shape[1] - orig_shape[1] * gain) / 2
+    pad_y = (input_shape[0] - orig_shape[0] * gain) / 2
+    if round_pad:
+        pad_x, pad_y = round(pad_x - 0.1), round(pad_y - 0.1)
+    xy[:, 0::2] -= pad_x
+    xy[:, 1::2] -= pad_y
+    xy /= gain
+    xy[:, 0::2] = xy[:, 0::2].clip(0, orig_shape[1])
+    xy[:, 1::2] = xy[:, 1::2].clip(0, orig_shape[0])
+    return xy
+
+
+def mask_polygon(
+    mask: np.ndarray,
+    input_shape: Tuple[int, int],
+    orig_shape: Tuple[int, int],
+) -> List[List[float]]:
+    """Самый длинный внешний контур маски в координатах исходника ([] — пустая маска)."""
+    contours, _ = cv2.findContours(mask.view(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
+    xy = scale_coords(max(contours, key=len).reshape(-1, 2).astype(np.float32), input_shape, orig_shape)
+    return [[round(float(x), 2), round(float(y), 2)] for x, y in xy]
+
+
+class OnnxPr2Model:
+    """Сессия onnxruntime + метаданные экспорта Ultralytics (имена классов, stride)."""
+
+    def __init__(self, path: Path, threads: int = PR2_TORCH_THREADS):
+        import onnxruntime as ort  # pip install -r requirements-onnx.txt
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        # при экспорте без dynamic=True размер входа (и пачки) зашит в модель
+        self.static_shape: Optional[Tuple[int, int]] = (
+            tuple(inp.shape[2:]) if all(isinstance(d, int) for d in inp.shape[2:]) else None
+        )
+        self.static_batch: Optional[int] = inp.shape[0] if isinstance(inp.shape[0], int) else None
+
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = {
+            int(k): str(v) for k, v in ast.literal_eval(meta.get("names", "{}")).items()
+        }
+        self.stride = int(meta.get("stride", 32))
+
+    def _input_shape(self, images: List[np.ndarray], imgsz: int) -> Tuple[Tuple[int, int], bool]:
+        if self.static_shape is not None:
+            return self.static_shape, False
+        side = int(np.ceil(imgsz / self.stride) * self.stride)
+        # как в Ultralytics: одинаковые по размеру картинки — прямоугольный вход
+        # (поля только до кратности stride), разные — квадрат imgsz
+        same = len({img.shape for img in images}) == 1
+        return (side, side), same
+
+    def predict(self, images: List[np.ndarray], imgsz: int, conf: float, iou: float) -> List[Prediction]:
+        shape, auto = self._input_shape(images, imgsz)
+        boxed = [letterbox(img, shape, auto, self.stride) for img in images]
+        input_shape = boxed[0].shape[:2]
+
+        step = self.static_batch or len(images)
+        out0, protos = [], []
+        for start in range(0, len(images), step):
+            blob = to_blob(boxed[start:start + step])
+            o0, o1 = self.session.run(None, {self.input_name: blob})[:2]
+            out0.append(o0)
+            protos.append(o1)
+        out0 = np.concatenate(out0)
+        protos = np.concatenate(protos)
+        nc = out0.shape[1] - 4 - protos.shape[1]
+
+        results = []
+        for i, img in enumerate(images):
+            orig_shape = img.shape[:2]
+            dets = non_max_suppression(out0[i].T, nc, conf, iou)
+            masks = decode_masks(protos[i], dets[:, 6:], dets[:, :4], input_shape)
+            results.append(
+                Prediction(
+                    names=self.names,
+                    xyxy=scale_coords(dets[:, :4].copy(), input_shape, orig_shape, round_pad=True),
+                    conf=dets[:, 4],
+                    cls=dets[:, 5].astype(int),
+                    orig_shape=orig_shape,
+                    polygons_fn=lambda m=masks, s=orig_shape: [
+                        mask_polygon(x, input_shape, s) for x in m
+                    ],
+                    masks_fn=lambda m=masks, s=orig_shape: (scale_mask(x, s) for x in m),
+                )
+            )
+        return results
+
+
+def export_onnx(imgsz: int = PR2_IMGSZ) -> Path:
+    """Экспорт .pt -> ONNX (один раз, нужен ultralytics); вход с динамическими размерами."""
+    from ultralytics import YOLO  # pip install ultralytics
+
+    if not PR2_MODEL_PATH.exists():
+        raise RuntimeError(f"PR2 YOLO model weights not found: {PR2_MODEL_PATH}")
+    exported = Path(YOLO(str(PR2_MODEL_PATH)).export(format="onnx", imgsz=imgsz, dynamic=True))
+    if exported.resolve() != PR2_ONNX_PATH.resolve():
+        PR2_ONNX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        exported.replace(PR2_ONNX_PATH)
+    return PR2_ONNX_PATH
+
+
+def quantize_int8() -> Path:
+    """
+    int8-вариант: динамическая квантизация весов (активации квантуются на лету,
+    калибровочные данные не нужны). Веса uint8 — ConvInteger в onnxruntime
+    на CPU реализован только для них.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    if not PR2_ONNX_PATH.exists():
+        export_onnx()
+    quantize_dynamic(str(PR2_ONNX_PATH), str(PR2_ONNX_INT8_PATH), weight_type=QuantType.QUInt8)
+    return PR2_ONNX_INT8_PATH
+
+
+def _outdated(path: Path, source: Path) -> bool:
+    """Производного файла нет или исходник (если он есть) новее."""
+    if not path.exists():
+        return True
+    return source.exists() and source.stat().st_mtime_ns > path.stat().st_mtime_ns
+
+
+def onnx_model_path(int8: bool = PR2_ONNX_INT8) -> Path:
+    """
+    Путь к ONNX-модели; если её нет или .pt новее — экспорт из .pt
+    (и квантизация для int8). Для int8 без .pt достаточно готового .int8.onnx.
+    """
+    if _outdated(PR2_ONNX_PATH, PR2_MODEL_PATH) and (not int8 or PR2_MODEL_PATH.exists()):
+        export_onnx()
+    if int8 and _outdated(PR2_ONNX_INT8_PATH, PR2_ONNX_PATH):
+        quantize_int8()
+    return PR2_ONNX_INT8_PATH if int8 else PR2_ONNX_PATH
+
+
+def get_onnx_model(int8: bool = PR2_ONNX_INT8) -> OnnxPr2Model:
+    """Сессия для текущих весов: при замене файла на диске создаётся заново."""
+    return _load_onnx_model(int8, weights_fingerprint())
+
+
+@lru_cache(maxsize=2)
+def _load_onnx_model(int8: bool, fingerprint: str) -> OnnxPr2Model:
+    path = onnx_model_path(int8)
+    t0 = time.perf_counter()
+    model = OnnxPr2Model(path)
+    observe_model_load("onnx-int8" if int8 else "onnx", time.perf_counter() - t0)
+    return model
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--imgsz", type=int, default=PR2_IMGSZ)
+    parser.add_argument("--int8", action="store_true", help="дополнительно int8-вариант")
+    args = parser.parse_args()
+
+    print(export_onnx(args.imgsz))
+    if args.int8:
+        print(quantize_int8())
+
+
+if __name__ == "__main__":
+    main()
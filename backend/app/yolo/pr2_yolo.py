@@ -1,12 +1,32 @@
 # app/yolo/pr2_yolo.py
+import hashlib
+import json
+import time
+from dataclasses import dataclass
 from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Callable, Dict, Iterator, List, Tuple
 
 import cv2
-from ultralytics import YOLO  # pip install ultralytics
+import numpy as np
 
-from app.config import BASE_DIR, RESULTS_DIR, RESULTS_SUBDIR
+from app.config import (
+    BASE_DIR,
+    PR2_BACKEND,
+    PR2_CONF,
+    PR2_IMGSZ,
+    PR2_IOU,
+    PR2_ONNX_INT8,
+    PR2_ONNX_INT8_PATH,
+    PR2_ONNX_PATH,
+    RESULTS_DIR,
+    RESULTS_SUBDIR,
+)
+from app.metrics import observe_model_load, stage, timed
+from app.segmentation.encoding import PROFILES, encode
+from app.segmentation.maskcodec import mask_to_rle
+from app.segmentation.renders import render_cache
+from app.shm import call_shared
 
 # Путь к обученной модели ПР2 (ИЗМЕНИ под свой best.pt)
 # Например: sm2/runs/segment/train/weights/best.pt
@@ -15,64 +35,372 @@ PR2_MODEL_PATH = BASE_DIR / "weights" / "pr2_yolo_isic_best.pt"
 
 PR2_SUBDIR = "pr2"  # подпапка в static/results для ПР2
 
+# overlay — только детекции; polygons / rle — ещё и маски экземпляров в ответе.
+# Оверлей во всех режимах рисуется при первом GET (overlay_bytes) и живёт в кэше отрисовок
+PR2_MODES = ("overlay", "polygons", "rle")
 
-@lru_cache()
-def get_pr2_model() -> YOLO:
+# версия формата detections в pr2_results: 2 — rle из масок модели, а не из контура
+_RESULT_FORMAT = 2
+
+
+@dataclass(frozen=True)
+class PredictOptions:
+    mode: str = "overlay"
+    imgsz: int = PR2_IMGSZ
+    conf: float = PR2_CONF
+    iou: float = PR2_IOU
+
+    @property
+    def predict_key(self) -> Tuple[int, float, float]:
+        return self.imgsz, self.conf, self.iou
+
+    def _digest(self, *extra) -> str:
+        key = (backend_name(), weights_fingerprint(), *self.predict_key, *extra)
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    @property
+    def tag(self) -> str:
+        """Короткая метка бэкенда, весов и параметров predict для имён файлов результата."""
+        return self._digest()[:12]
+
+    @property
+    def cache_key(self) -> str:
+        """Ключ записи в pr2_results: то же, что tag, плюс режим ответа и версия формата."""
+        return self._digest(self.mode, _RESULT_FORMAT)
+
+
+@dataclass
+class Prediction:
+    """Результат на одно изображение, одинаковый для всех бэкендов."""
+
+    names: Dict[int, str]
+    xyxy: np.ndarray  # (n, 4), пиксели исходника
+    conf: np.ndarray  # (n,)
+    cls: np.ndarray  # (n,) int
+    orig_shape: Tuple[int, int]
+    # контуры масок экземпляров [[x, y], ...] — считаются, только если нужны
+    polygons_fn: Callable[[], List[List[List[float]]]]
+    # маски экземпляров (h, w) bool в пикселях исходника, по одной — тоже лениво
+    masks_fn: Callable[[], Iterator[np.ndarray]]
+
+    def polygons(self) -> List[List[List[float]]]:
+        return self.polygons_fn()
+
+    def masks(self) -> Iterator[np.ndarray]:
+        return self.masks_fn()
+
+
+def backend_name() -> str:
+    if PR2_BACKEND == "onnx":
+        return "onnx-int8" if PR2_ONNX_INT8 else "onnx"
+    return "torch"
+
+
+def _weights_path() -> Path:
+    """Файл весов, от которого зависят результаты: .pt, а для onnx без .pt — сама ONNX-модель."""
+    if PR2_BACKEND == "onnx" and not PR2_MODEL_PATH.exists():
+        return PR2_ONNX_INT8_PATH if PR2_ONNX_INT8 else PR2_ONNX_PATH
+    return PR2_MODEL_PATH
+
+
+# path -> ((размер, mtime), sha256): файл перечитывается, только если он изменился
+_fingerprints: Dict[Path, Tuple[Tuple[int, int], str]] = {}
+
+
+def weights_fingerprint() -> str:
+    """
+    sha256 файла весов. На каждый вызов — только stat; при замене файла на
+    диске меняется отпечаток, а с ним ключи кэша результатов и загруженная модель.
+    """
+    path = _weights_path()
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        raise RuntimeError(f"PR2 YOLO model weights not found: {path}")
+    stamp = (st.st_size, st.st_mtime_ns)
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    _fingerprints[path] = (stamp, h.hexdigest())
+    return h.hexdigest()
+
+
+def get_pr2_model():
     """
-    Лениво загружаем YOLO-модель один раз.
+    Лениво загружаем YOLO-модель; заново — только если веса на диске поменялись.
     Если файл не найден — кидаем понятную ошибку.
     """
-    if not PR2_MODEL_PATH.exists():
-        raise RuntimeError(f"PR2 YOLO model weights not found: {PR2_MODEL_PATH}")
-    return YOLO(str(PR2_MODEL_PATH))
+    return _load_pr2_model(weights_fingerprint())
+
 
+@lru_cache(maxsize=1)
+def _load_pr2_model(fingerprint: str):
+    from ultralytics import YOLO  # pip install ultralytics; для PR2_BACKEND="onnx" не нужен
 
-def run_pr2_inference(image_path: Path) -> tuple[str, list[dict]]:
+    t0 = time.perf_counter()
+    model = YOLO(str(PR2_MODEL_PATH))
+    observe_model_load("torch", time.perf_counter() - t0)
+    return model
+
+
+def scale_mask(mask: np.ndarray, orig_shape: Tuple[int, int]) -> np.ndarray:
     """
-    Запуск детекции/сегментации YOLO на исходном изображении.
+    Маска экземпляра в пикселях входа модели (после letterbox) -> bool в
+    пикселях исходника: обрезка полей и билинейное масштабирование, как
+    scale_image в Ultralytics.
+    """
+    h1, w1 = mask.shape
+    h0, w0 = orig_shape
+    gain = min(h1 / h0, w1 / w0)
+    pad_x, pad_y = (w1 - w0 * gain) / 2, (h1 - h0 * gain) / 2
+    top, left = int(pad_y), int(pad_x)
+    bottom, right = int(h1 - pad_y), int(w1 - pad_x)
+    crop = mask[top:bottom, left:right].astype(np.float32)
+    if crop.shape != (h0, w0):
+        crop = cv2.resize(crop, (w0, h0), interpolation=cv2.INTER_LINEAR)
+    return crop > 0.5
 
-    Возвращает:
-    - относительный путь к PNG с оверлеем (результат+bbox+mask),
-      относительно STATIC: "results/pr2/....png"
-    - список детекций (class_id, class_name, confidence, bbox_xyxy)
-    """
-    model = get_pr2_model()
-
-    # один прогон, без сохранения папок Ultralytics
-    pred = model.predict(
-        source=str(image_path),
-        imgsz=640,
-        conf=0.25,
-        iou=0.5,
-        verbose=False,
-    )[0]
-
-    # Оверлей с bbox+масками от Ultralytics (BGR)
-    overlay_bgr = pred.plot()
-
-    # Куда сохраняем
-    rel_dir = Path(RESULTS_SUBDIR) / PR2_SUBDIR
-    rel_path = rel_dir / f"{image_path.stem}_pr2_overlay.png"
-    out_path = RESULTS_DIR / PR2_SUBDIR / f"{image_path.stem}_pr2_overlay.png"
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(out_path), overlay_bgr)
-
-    # Парсим боксы
-    detections: list[dict] = []
+
+def _from_ultralytics(pred) -> Prediction:
     boxes = pred.boxes
-    if boxes is not None:
+    if boxes is None:
+        xyxy, conf, cls = np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, int)
+    else:
         xyxy = boxes.xyxy.cpu().numpy()
-        confs = boxes.conf.cpu().numpy()
-        clses = boxes.cls.cpu().numpy().astype(int)
-
-        for box, conf, cls in zip(xyxy, confs, clses):
-            detections.append(
-                {
-                    "class_id": int(cls),
-                    "class_name": str(pred.names.get(int(cls), str(cls))),
-                    "confidence": float(conf),
-                    "bbox_xyxy": [float(v) for v in box],
-                }
-            )
-
-    return str(rel_path).replace("\\", "/"), detections
+        conf = boxes.conf.cpu().numpy()
+        cls = boxes.cls.cpu().numpy().astype(int)
+
+    def polygons() -> List[List[List[float]]]:
+        masks = getattr(pred, "masks", None)
+        if masks is None:
+            return [[] for _ in range(len(xyxy))]
+        return [[[round(float(x), 2), round(float(y), 2)] for x, y in xy] for xy in masks.xy]
+
+    def instance_masks() -> Iterator[np.ndarray]:
+        masks = getattr(pred, "masks", None)
+        shape = tuple(pred.orig_shape[:2])
+        if masks is None:
+            for _ in range(len(xyxy)):
+                yield np.zeros(shape, dtype=bool)
+            return
+        # masks.data — (n, h, w) во входе модели (с полями letterbox)
+        for mask in masks.data.cpu().numpy():
+            yield scale_mask(mask, shape)
+
+    return Prediction(
+        names=pred.names,
+        xyxy=xyxy,
+        conf=conf,
+        cls=cls,
+        orig_shape=tuple(pred.orig_shape[:2]),
+        polygons_fn=polygons,
+        masks_fn=instance_masks,
+    )
+
+
+def predict_images(images: List[np.ndarray], imgsz: int, conf: float, iou: float) -> List[Prediction]:
+    """Один прогон выбранного бэкенда (PR2_BACKEND) на пачке BGR-картинок."""
+    if PR2_BACKEND == "onnx":
+        from app.yolo.onnx_backend import get_onnx_model
+
+        return get_onnx_model().predict(images, imgsz, conf, iou)
+
+    # один прогон на всю пачку, без сохранения папок Ultralytics
+    preds = get_pr2_model().predict(source=images, imgsz=imgsz, conf=conf, iou=iou, verbose=False)
+    return [_from_ultralytics(pred) for pred in preds]
+
+
+def warm_up_pr2_model(imgsz: int = PR2_IMGSZ) -> None:
+    """Загрузка весов + холостой прогон, чтобы первый реальный запрос не был «холодным»."""
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    predict_images([dummy], imgsz, PR2_CONF, PR2_IOU)
+
+
+@timed("pr2_decode")
+def load_pr2_image(image_path: Path) -> np.ndarray:
+    """Чтение исходника для YOLO (BGR, как ждёт Ultralytics для numpy-входа)."""
+    img_bgr = cv2.imread(str(image_path))
+    if img_bgr is None:
+        raise ValueError(f"Не удалось прочитать изображение: {image_path}")
+    return img_bgr
+
+
+@timed("pr2_inference")
+def run_pr2_inference(
+    image_path: Path,
+    options: PredictOptions = PredictOptions(),
+) -> tuple[str, list[dict]]:
+    """
+    Запуск детекции/сегментации YOLO на исходном изображении.
+
+    Возвращает:
+    - относительный путь к оверлею (результат+bbox+mask) относительно
+      STATIC: "results/pr2/....png"; файла нет, оверлей рисуется при
+      первом запросе (overlay_bytes)
+    - список детекций (class_id, class_name, confidence, bbox_xyxy
+      и polygon / rle в соответствующих режимах)
+    """
+    img_bgr = load_pr2_image(image_path)
+    return run_pr2_inference_batch([(img_bgr, image_path.stem, options)])[0]
+
+
+def run_pr2_inference_batch(
+    items: List[Tuple[np.ndarray, str, PredictOptions]],
+) -> list[tuple[str, list[dict]]]:
+    """
+    Прогон YOLO на пачке изображений: один predict на каждую группу
+    с одинаковыми imgsz/conf/iou (обычно группа одна).
+
+    items — [(изображение BGR, stem для имени оверлея, параметры)], результат
+    в том же порядке, что и у run_pr2_inference.
+    """
+    if not items:
+        return []
+
+    groups: Dict[Tuple[int, float, float], List[int]] = {}
+    for i, (_, _, options) in enumerate(items):
+        groups.setdefault(options.predict_key, []).append(i)
+
+    results: list = [None] * len(items)
+    for (imgsz, conf, iou), indices in groups.items():
+        with stage("pr2_predict"):
+            preds = predict_images([items[i][0] for i in indices], imgsz, conf, iou)
+        with stage("pr2_postprocess"):
+            for i, pred in zip(indices, preds):
+                img_bgr, stem, options = items[i]
+                results[i] = _handle_prediction(pred, stem, options)
+    return results
+
+
+def run_pr2_inference_shared(items: list) -> list[tuple[str, list[dict]]]:
+    """run_pr2_inference_batch, где изображения могут быть SharedArray (app/shm.py) — для пула процессов."""
+    return call_shared(run_pr2_inference_batch, (items,), {})
+
+
+def overlay_name(stem: str, options: PredictOptions) -> str:
+    """Имя файла оверлея: исходник + параметры predict (режим на картинку не влияет)."""
+    return f"{stem}_pr2_{options.tag}_overlay{PROFILES['overlay'].ext}"
+
+
+def pr2_overlay_url(image_id: int, rel_path: str) -> str:
+    """Оверлей отдаётся через /api/pr2/overlay: рисуется при первом запросе, дальше — из кэша."""
+    return f"/api/pr2/overlay/{image_id}/{Path(rel_path).name}"
+
+
+def _sidecar_path(name: str) -> Path:
+    return RESULTS_DIR / PR2_SUBDIR / f"{Path(name).stem}.json"
+
+
+def result_files_exist(rel_path: str) -> bool:
+    """Есть ли на диске, из чего отдать оверлей: детекции для отрисовки или оверлей, записанный раньше сразу."""
+    name = Path(rel_path).name
+    return _sidecar_path(name).exists() or (RESULTS_DIR / PR2_SUBDIR / name).exists()
+
+
+def detections_of(pred: Prediction) -> list[dict]:
+    return [
+        {
+            "class_id": int(cls),
+            "class_name": str(pred.names.get(int(cls), str(cls))),
+            "confidence": float(conf),
+            "bbox_xyxy": [float(v) for v in box],
+        }
+        for box, conf, cls in zip(pred.xyxy, pred.conf, pred.cls)
+    ]
+
+
+def _handle_prediction(pred: Prediction, stem: str, options: PredictOptions) -> tuple[str, list[dict]]:
+    """
+    Детекции одного изображения. Оверлей не рисуем: рядом кладём детекции
+    с контурами (JSON, общий для всех режимов), картинку соберёт первый GET.
+    В режиме rle — сами маски экземпляров модели (с дырами и всеми частями).
+    """
+    name = overlay_name(stem, options)
+    rel_path = f"{RESULTS_SUBDIR}/{PR2_SUBDIR}/{name}"
+
+    detections = detections_of(pred)
+    polygons = pred.polygons()
+    h, w = pred.orig_shape[:2]
+    if options.mode == "polygons":
+        for det, poly in zip(detections, polygons):
+            det["polygon"] = poly
+    elif options.mode == "rle":
+        for det, mask in zip(detections, pred.masks()):
+            det["rle"] = mask_to_rle(mask)
+
+    sidecar = _sidecar_path(name)
+    sidecar.parent.mkdir(parents=True, exist_ok=True)
+    tmp = sidecar.with_suffix(".tmp")
+    tmp.write_text(
+        json.dumps(
+            {
+                "stem": stem,
+                "size": [h, w],
+                "detections": [
+                    {k: v for k, v in det.items() if k != "rle"} | {"polygon": poly}
+                    for det, poly in zip(detections, polygons)
+                ],
+            }
+        )
+    )
+    tmp.replace(sidecar)
+    return rel_path, detections
+
+
+# цвета экземпляров (BGR), по class_id
+_PALETTE = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207), (10, 249, 72)]
+
+
+def render_overlay(name: str, source_path: Path) -> bytes:
+    """
+    Оверлей по сохранённым детекциям: маски (полупрозрачные) и рамки с
+    подписями поверх исходника, закодированный по профилю "overlay".
+    FileNotFoundError — детекций (или исходника) нет.
+    """
+    meta = json.loads(_sidecar_path(name).read_text())
+    img = draw_overlay(load_pr2_image(source_path), meta["detections"])
+    with stage("encode_overlay"):
+        return encode(img, PROFILES["overlay"])
+
+
+def overlay_bytes(name: str, source_path: Path) -> bytes:
+    """
+    Оверлей для ответа: записанный раньше сразу при predict (results/pr2),
+    иначе из кэша отрисовок, иначе render_overlay (и в кэш).
+    """
+    legacy = RESULTS_DIR / PR2_SUBDIR / name
+    if legacy.exists():
+        return legacy.read_bytes()
+    return render_cache.get_or_render(f"pr2-{name}", lambda: render_overlay(name, source_path))
+
+
+def draw_overlay(img: np.ndarray, detections: List[dict]) -> np.ndarray:
+    """Полупрозрачные маски (polygon) и рамки с подписями поверх img (BGR, меняется на месте)."""
+    fill = img.copy()
+    for det in detections:
+        color = _PALETTE[det["class_id"] % len(_PALETTE)]
+        if len(det["polygon"]) >= 3:
+            pts = np.round(np.asarray(det["polygon"], dtype=np.float32)).astype(np.int32)
+            cv2.fillPoly(fill, [pts], color)
+    cv2.addWeighted(fill, 0.5, img, 0.5, 0, dst=img)
+
+    thickness = max(1, round(sum(img.shape[:2]) / 1000))
+    for det in detections:
+        color = _PALETTE[det["class_id"] % len(_PALETTE)]
+        x0, y0, x1, y1 = (int(round(v)) for v in det["bbox_xyxy"])
+        cv2.rectangle(img, (x0, y0), (x1, y1), color, thickness)
+        cv2.putText(
+            img,
+            f"{det['class_name']} {det['confidence']:.2f}",
+            (x0, max(0, y0 - 4)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5 * thickness,
+            color,
+            thickness,
+        )
+    return img
@@ -0,0 +1,209 @@
+# app/yolo/workers.py
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import lru_cache, partial
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import (
+    MEDIA_ROOT,
+    PR2_BACKEND,
+    PR2_INFERENCE_WORKERS,
+    PR2_MAX_BATCH_SIZE,
+    PR2_MAX_PENDING,
+    PR2_MAX_WAIT_MS,
+    PR2_RETRY_AFTER_S,
+    PR2_TORCH_THREADS,
+    SHARED_MEMORY_ENABLED,
+    SHARED_MEMORY_MIN_BYTES,
+)
+from app.concurrency import drop_broken_pool
+from app.metrics import observe_model_load, stage
+from app.yolo.batching import MicroBatcher
+from app.db import crud, models
+from app.db.base import SessionLocal
+from app.shm import Lease, array_pool
+from app.yolo.pr2_yolo import (
+    PredictOptions,
+    backend_name,
+    load_pr2_image,
+    result_files_exist,
+    run_pr2_inference_shared,
+    warm_up_pr2_model,
+    weights_fingerprint,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(num_threads: int) -> None:
+    """Инициализация процесса-исполнителя: потоки torch + модель в памяти."""
+    if PR2_BACKEND == "torch":
+        import torch
+
+        torch.set_num_threads(num_threads)
+    try:
+        warm_up_pr2_model()
+    except RuntimeError as exc:
+        # нет весов — запросы получат ту же ошибку из get_pr2_model
+        logger.warning("PR2 warm-up skipped: %s", exc)
+
+
+def _ping() -> bool:
+    return True
+
+
+@lru_cache()
+def get_inference_pool() -> Optional[ProcessPoolExecutor]:
+    """Фиксированный пул процессов для инференса PR2 (None -> пул потоков Starlette)."""
+    if PR2_INFERENCE_WORKERS <= 0:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=PR2_INFERENCE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(PR2_TORCH_THREADS,),
+    )
+
+
+def warm_up_inference() -> None:
+    """
+    Поднять всех исполнителей заранее (каждый грузит веса и делает холостой прогон
+    в _init_worker). Без пула — прогреваем модель в текущем процессе.
+    """
+    pool = get_inference_pool()
+    if pool is None:
+        try:
+            warm_up_pr2_model()
+        except RuntimeError as exc:
+            logger.warning("PR2 warm-up skipped: %s", exc)
+        return
+    # время старта исполнителей (импорт, веса, холостой прогон) — как время загрузки модели
+    t0 = time.perf_counter()
+    wait([pool.submit(_ping) for _ in range(PR2_INFERENCE_WORKERS)])
+    observe_model_load(backend_name(), time.perf_counter() - t0)
+
+
+def shutdown_inference_pool() -> None:
+    if get_inference_pool.cache_info().currsize == 0:
+        return
+    pool = get_inference_pool()
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    get_inference_pool.cache_clear()
+
+
+# одновременные запросы /api/pr2/predict/* склеиваются в один model.predict
+# в пул процессов изображения уходят через общую память (см. predict_stored_image)
+pr2_batcher = MicroBatcher(
+    run_pr2_inference_shared,
+    max_batch_size=PR2_MAX_BATCH_SIZE,
+    max_wait_ms=PR2_MAX_WAIT_MS,
+    get_executor=get_inference_pool,
+    reset_executor=partial(drop_broken_pool, get_inference_pool),
+    max_in_flight=max(1, PR2_INFERENCE_WORKERS),
+    max_pending=PR2_MAX_PENDING,
+    retry_after=PR2_RETRY_AFTER_S,
+)
+
+
+# попадания/промахи кэша результатов PR2 (таблица pr2_results)
+result_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _lookup_result(
+    image_id: int, options: PredictOptions
+) -> Tuple[Optional[Tuple[str, str]], Optional[tuple[str, list[dict]]]]:
+    """
+    ((cache_key, weights_hash), сохранённый результат или None).
+    Нет весов — ключа нет, ту же ошибку вернёт сам инференс.
+    """
+    try:
+        key = (options.cache_key, weights_fingerprint())
+    except RuntimeError:
+        return None, None
+    with SessionLocal() as db:
+        row = crud.get_pr2_result(db, image_id, key[0])
+        # файлы могли удалить вручную — тогда считаем заново
+        if row is None or not result_files_exist(row.result_path):
+            return key, None
+        return key, (row.result_path, row.detections)
+
+
+def _store_result(
+    image_id: int, options: PredictOptions, key: Tuple[str, str], result: tuple[str, list[dict]]
+) -> None:
+    with SessionLocal() as db:
+        crud.save_pr2_result(
+            db,
+            image_id=image_id,
+            cache_key=key[0],
+            weights_hash=key[1],
+            result_path=result[0],
+            detections=result[1],
+            params={
+                "backend": backend_name(),
+                "mode": options.mode,
+                "imgsz": options.imgsz,
+                "conf": options.conf,
+                "iou": options.iou,
+            },
+        )
+
+
+def _release_after_batch(lease: Lease, task: "asyncio.Future") -> None:
+    lease.release()
+    if not task.cancelled():
+        task.exception()  # запрос могли отменить — ошибку пачки никто больше не заберёт
+
+
+async def predict_stored_image(
+    image: models.Image,
+    options: PredictOptions = PredictOptions(),
+) -> tuple[str, list[dict]]:
+    """
+    PR2 на исходнике картинки (stored_path → uploads/uid.ext) через pr2_batcher.
+
+    Результат запоминается в pr2_results по (картинка, sha256 весов, бэкенд,
+    параметры, режим): повтор отдаётся из БД без чтения картинки и инференса,
+    замена файла весов на диске меняет ключ.
+
+    FileNotFoundError — файла нет на диске, ValueError — не декодируется,
+    app.concurrency.Overloaded — пул инференса переполнен.
+    """
+    img_path = MEDIA_ROOT / image.stored_path
+    if not img_path.exists():
+        raise FileNotFoundError("Stored image file not found on disk")
+
+    with stage("pr2_cache"):
+        key, cached = await run_in_threadpool(_lookup_result, image.id, options)
+    if cached is not None:
+        result_cache_stats["hits"] += 1
+        return cached
+    result_cache_stats["misses"] += 1
+
+    try:
+        img_bgr = await run_in_threadpool(load_pr2_image, img_path)
+    except ValueError:
+        raise ValueError("Stored image could not be decoded")
+
+    # в процесс-исполнитель — ссылка на общую память, а не pickle картинки
+    lease = None
+    if SHARED_MEMORY_ENABLED and img_bgr.nbytes >= SHARED_MEMORY_MIN_BYTES and get_inference_pool() is not None:
+        lease = array_pool.share(img_bgr)
+        img_bgr = lease.handle
+    # одновременные запросы склеиваются в одну пачку
+    submitted = asyncio.ensure_future(pr2_batcher.submit((img_bgr, img_path.stem, options)))
+    if lease is not None:
+        submitted.add_done_callback(partial(_release_after_batch, lease))
+    with stage("pr2_batch"):
+        # сегмент отпускается, когда пачка досчитана, даже если запрос отменили раньше
+        result = await asyncio.shield(submitted)
+    if key is not None:
+        with stage("db"):
+            await run_in_threadpool(_store_result, image.id, options, key, result)
+    return result
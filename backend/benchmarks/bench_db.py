@@ -0,0 +1,128 @@
+# benchmarks/bench_db.py
+"""
+Запись результатов segment_all в SQLite под N одновременными клиентами.
+
+Сравниваются два режима на временной БД:
+- per-row: прежний путь — create_segmentation на каждую маску (commit + refresh),
+  движок без настроек;
+- bulk: get_or_create_segmentations_bulk (одна транзакция) на движке
+  из create_db_engine (WAL, synchronous=NORMAL, busy_timeout, пул).
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_db
+    python -m benchmarks.bench_db --clients 1 4 16 --requests 50
+"""
+import argparse
+import tempfile
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db import crud, models
+from app.db.base import Base, create_db_engine
+from app.segmentation.core import SEGMENTATION_METHODS
+
+
+def _items():
+    return [(m, f"results/masks/{uuid4().hex}.png", uuid4().hex) for m in SEGMENTATION_METHODS]
+
+
+def _per_row(db, image_id: int) -> None:
+    for method, rel_path, cache_key in _items():
+        crud.create_segmentation(
+            db, image_id=image_id, method=method, result_path=rel_path, params={}, cache_key=cache_key
+        )
+
+
+def _bulk(db, image_id: int) -> None:
+    crud.get_or_create_segmentations_bulk(db, image_id=image_id, items=_items(), params={})
+
+
+def run(mode: str, clients: int, requests: int, workdir: Path) -> dict:
+    url = f"sqlite:///{workdir / f'{mode}_{clients}.db'}"
+    if mode == "per-row":
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        write = _per_row
+    else:
+        engine = create_db_engine(url)
+        write = _bulk
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    with Session() as db:
+        image_id = crud.create_image(
+            db, original_filename="bench.png", stored_path="uploads/bench.png",
+            preview_path="uploads/bench.png", is_dicom=False, width=1, height=1,
+        ).id
+
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def client() -> None:
+        nonlocal errors
+        start.wait()
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            try:
+                with Session() as db:
+                    write(db, image_id)
+            except Exception:  # noqa: BLE001 — "database is locked" и т.п. считаем ошибкой
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    with Session() as db:
+        rows = db.query(models.Segmentation).count()
+    engine.dispose()
+
+    latencies.sort()
+
+    def pct(q: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+    return {
+        "rows_per_s": rows / elapsed,
+        "p50_ms": pct(0.5),
+        "p99_ms": pct(0.99),
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=30, help="запросов segment_all на клиента")
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'clients':>7} {'rows/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for clients in args.clients:
+            for mode in ("per-row", "bulk"):
+                r = run(mode, clients, args.requests, Path(tmp))
+                print(
+                    f"{mode:>8} {clients:>7} {r['rows_per_s']:>9.0f} {r['p50_ms']:>8.1f} "
+                    f"{r['p99_ms']:>8.1f} {r['errors']:>6}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_dicom.py
+"""
+Время и пик памяти чтения DICOM: прежний путь (pixel_array целиком -> float32
+-> нормализация -> GRAY2RGB) против app.segmentation.dicom (покадровое чтение
+и перевод в uint8 через LUT).
+
+Пик памяти — по tracemalloc (numpy и pydicom отчитываются в него),
+т.е. прирост на время вызова без учёта уже загруженных модулей. Страницы
+np.memmap — это кэш файла, а не аллокации, в пик они не входят.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_dicom
+    python -m benchmarks.bench_dicom --size-mb 50 --frames 100 --repeat 3
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pydicom
+
+from app.segmentation.dicom import iter_dicom_frames, read_dicom_frame
+from benchmarks.synthetic import dicom_side_for_mb, make_dicom
+
+
+def legacy_dicom_to_rgb(path: Path) -> np.ndarray:
+    """Прежний dicom_to_rgb (для многокадровых — нормализация всего объёма)."""
+    ds = pydicom.dcmread(str(path))
+    arr = ds.pixel_array.astype(np.float32)
+    arr = arr - np.min(arr)
+    max_val = np.max(arr)
+    if max_val > 0:
+        arr = arr / max_val
+    arr = (arr * 255.0).astype(np.uint8)
+    if arr.ndim == 2:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB)
+    return arr
+
+
+def all_frames(path: Path) -> int:
+    n = 0
+    for _ in iter_dicom_frames(path):
+        n += 1
+    return n
+
+
+def measure(fn, repeat: int) -> tuple[float, float]:
+    best = float("inf")
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak / 1024 / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=50.0, help="размер однокадрового файла")
+    parser.add_argument("--frames", type=int, default=100, help="кадров 512x512 в многокадровом файле")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        side = dicom_side_for_mb(args.size_mb)
+        single = make_dicom(Path(tmp) / "single.dcm", side, side)
+        multi = make_dicom(Path(tmp) / "multi.dcm", 512, 512, frames=args.frames)
+
+        cases = [
+            (f"single {side}x{side}", "legacy", lambda: legacy_dicom_to_rgb(single)),
+            (f"single {side}x{side}", "lut", lambda: read_dicom_frame(single)),
+            (f"multi {args.frames}x512x512", "legacy", lambda: legacy_dicom_to_rgb(multi)),
+            (f"multi {args.frames}x512x512", "lut preview", lambda: read_dicom_frame(multi)),
+            (f"multi {args.frames}x512x512", "lut all", lambda: all_frames(multi)),
+        ]
+
+        print(f"{'file':>22} {'reader':>12} {'time s':>8} {'peak MB':>8}")
+        for name, reader, fn in cases:
+            elapsed, peak_mb = measure(fn, args.repeat)
+            print(f"{name:>22} {reader:>12} {elapsed:>8.3f} {peak_mb:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
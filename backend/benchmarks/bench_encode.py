@@ -0,0 +1,91 @@
+# benchmarks/bench_encode.py
+"""
+Время кодирования и размер по профилям (app.segmentation.encoding):
+PNG с разной степенью сжатия (3 — дефолт OpenCV, как было раньше), WebP и
+JPEG — на превью (RGB), маске и для уровней thumb/screen из PREVIEW_TIERS.
+Для PNG дополнительно проверяется, что декодированный результат совпадает
+с исходником.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_encode
+    python -m benchmarks.bench_encode --size 4096 --repeat 5
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.segmentation.encoding import TIERS, EncodeProfile, encode, write_preview_tiers
+from benchmarks.synthetic import make_lesion_image
+
+CANDIDATES = {
+    "png-0": EncodeProfile("png", level=0),
+    "png-1": EncodeProfile("png", level=1),
+    "png-3 (default)": EncodeProfile("png", level=3),
+    "png-6": EncodeProfile("png", level=6),
+    "png-9": EncodeProfile("png", level=9),
+    "webp-85": EncodeProfile("webp", quality=85),
+    "webp-lossless": EncodeProfile("webp", quality=101),
+    "jpeg-85": EncodeProfile("jpeg", quality=85),
+}
+
+
+def make_photo(size: int) -> np.ndarray:
+    """«Дерматоскопия»: пятно + текстура кожи + лёгкий цветовой оттенок, BGR."""
+    gray = make_lesion_image(size, noise=4.0).astype(np.float32)
+    rng = np.random.default_rng(1)
+    texture = cv2.GaussianBlur(rng.normal(0, 20, (size, size)).astype(np.float32), (0, 0), 2)
+    base = gray + texture
+    bgr = np.stack([base * 0.8, base * 0.9, base * 1.05], axis=-1)
+    return np.clip(bgr, 0, 255).astype(np.uint8)
+
+
+def best_of(repeat: int, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def report(title: str, img: np.ndarray, repeat: int) -> None:
+    print(f"\n{title} {img.shape[1]}x{img.shape[0]}, raw {img.nbytes / 1024:.0f} KB")
+    print(f"{'profile':>16} {'KB':>9} {'encode ms':>10} {'decode ms':>10}")
+    for name, profile in CANDIDATES.items():
+        data, enc = best_of(repeat, lambda: encode(img, profile))
+        buf = np.frombuffer(data, np.uint8)
+        back, dec = best_of(repeat, lambda: cv2.imdecode(buf, cv2.IMREAD_UNCHANGED))
+        if profile.codec == "png" and not np.array_equal(back, img):
+            raise AssertionError(f"{name}: PNG round-trip differs")
+        print(f"{name:>16} {len(data) / 1024:>9.1f} {enc * 1e3:>10.2f} {dec * 1e3:>10.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    photo = make_photo(args.size)
+    gray = cv2.cvtColor(photo, cv2.COLOR_BGR2GRAY)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    report("preview", photo, args.repeat)
+    report("mask", mask, args.repeat)
+    for tier, profile in TIERS.items():
+        small = cv2.resize(photo, None, fx=profile.max_side / args.size, fy=profile.max_side / args.size,
+                           interpolation=cv2.INTER_AREA)
+        report(f"tier {tier}", small, args.repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        names, t = best_of(args.repeat, lambda: write_preview_tiers(photo, Path(tmp), "x"))
+        sizes = {tier: (Path(tmp) / name).stat().st_size / 1024 for tier, name in names.items()}
+    print(f"\nwrite_preview_tiers: {t * 1e3:.1f} ms, " + ", ".join(f"{k} {v:.1f} KB" for k, v in sizes.items()))
+
+
+if __name__ == "__main__":
+    main()
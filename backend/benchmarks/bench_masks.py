@@ -0,0 +1,105 @@
+# benchmarks/bench_masks.py
+"""
+Хранение масок: 8-битный PNG (как раньше) против .msk (packbits + zlib)
+и RLE. Размер на диске, время записи и чтения на реальных масках всех
+методов для синтетического снимка; многослойный .msk — все методы в одном
+файле (так пишутся срезы объёмов). Декодирование проверяется на точное
+совпадение, при расхождении скрипт падает.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_masks
+    python -m benchmarks.bench_masks --size 4096 --repeat 5
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.segmentation.core import SEGMENTATION_METHODS, segment_all_methods
+from app.segmentation.maskcodec import (
+    mask_to_rle,
+    pack_mask,
+    read_layers,
+    rle_to_mask,
+    unpack_mask,
+    write_layers,
+)
+from benchmarks.synthetic import make_lesion_image
+
+
+def best_of(repeat: int, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    gray = make_lesion_image(args.size)
+    img = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+    c = args.size // 2
+    masks = segment_all_methods(
+        img,
+        manual_thresh=120,
+        adaptive_block_size=35,
+        adaptive_C=5,
+        region_seed=(c, c),
+        region_diff_thresh=12,
+        watershed_fg_fraction=0.5,
+        region_engine="band",
+    )
+
+    totals = {"png": [0, 0.0, 0.0], "msk": [0, 0.0, 0.0], "rle": [0, 0.0, 0.0]}
+    print(f"{args.size}x{args.size}")
+    print(f"{'method':>15} {'png KB':>8} {'msk KB':>8} {'rle KB':>8} {'png w ms':>9} {'msk w ms':>9} {'png r ms':>9} {'msk r ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for m in SEGMENTATION_METHODS:
+            mask = masks[m]
+            png_path, msk_path = Path(tmp) / f"{m}.png", Path(tmp) / f"{m}.msk"
+
+            _, png_w = best_of(args.repeat, lambda: cv2.imwrite(str(png_path), mask))
+            _, msk_w = best_of(args.repeat, lambda: msk_path.write_bytes(pack_mask(mask)))
+            png_back, png_r = best_of(args.repeat, lambda: cv2.imread(str(png_path), cv2.IMREAD_GRAYSCALE))
+            msk_back, msk_r = best_of(args.repeat, lambda: unpack_mask(msk_path.read_bytes()))
+            rle, rle_w = best_of(args.repeat, lambda: json.dumps(mask_to_rle(mask)).encode())
+            _, rle_r = best_of(args.repeat, lambda: rle_to_mask(json.loads(rle)))
+
+            for name, back in (("png", png_back), ("msk", msk_back), ("rle", rle_to_mask(json.loads(rle)))):
+                if not np.array_equal(back, mask):
+                    raise AssertionError(f"{m}: {name} round-trip differs")
+
+            sizes = (png_path.stat().st_size, msk_path.stat().st_size, len(rle))
+            for name, size, w, r in zip(("png", "msk", "rle"), sizes, (png_w, msk_w, rle_w), (png_r, msk_r, rle_r)):
+                totals[name][0] += size
+                totals[name][1] += w
+                totals[name][2] += r
+            print(
+                f"{m:>15} {sizes[0] / 1024:>8.1f} {sizes[1] / 1024:>8.1f} {sizes[2] / 1024:>8.1f} "
+                f"{png_w * 1e3:>9.2f} {msk_w * 1e3:>9.2f} {png_r * 1e3:>9.2f} {msk_r * 1e3:>9.2f}"
+            )
+
+        run_path = Path(tmp) / "run.msk"
+        _, run_w = best_of(args.repeat, lambda: write_layers(run_path, masks))
+        layers, run_r = best_of(args.repeat, lambda: read_layers(run_path))
+        if any(not np.array_equal(layers[m], masks[m]) for m in SEGMENTATION_METHODS):
+            raise AssertionError("multi-layer round-trip differs")
+        run_size = run_path.stat().st_size
+
+    for name, (size, w, r) in totals.items():
+        print(f"total {name}: {size / 1024:.1f} KB, write {w * 1e3:.1f} ms, read {r * 1e3:.1f} ms")
+    print(f"multi-layer .msk ({len(masks)} layers): {run_size / 1024:.1f} KB, write {run_w * 1e3:.1f} ms, read {run_r * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# benchmarks/bench_pr2_backends.py
+"""
+PR2: torch (ultralytics.YOLO) против onnxruntime (fp32 и int8) —
+совпадение детекций и задержка/память.
+
+Каждый бэкенд — в отдельном процессе: загрузка модели, прогрев, затем
+--runs прогонов по каждой картинке (пачка 1) и пачкой из всех картинок.
+Пик памяти — VmHWM процесса (Linux). Детекции сравниваются с torch:
+пары по наибольшему IoU боксов, тот же класс, разница confidence и IoU
+боксов/масок (масок — по самим маскам экземпляров) в пределах допусков.
+При расхождении скрипт падает (для int8 допуски мягче и только печатаются).
+
+Нужны веса weights/pr2_yolo_isic_best.pt, ultralytics (torch и экспорт
+в ONNX) и onnxruntime (requirements-onnx.txt); без них скрипт печатает,
+чего не хватает, и пропускает проверку. Запуск из каталога backend:
+    python -m benchmarks.bench_pr2_backends
+    python -m benchmarks.bench_pr2_backends --images static/uploads --runs 20 --imgsz 640
+"""
+import argparse
+import importlib.util
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# fp32: те же веса, отличаются только реализации операций
+FP32_TOLERANCE = {"conf": 1e-3, "box_iou": 0.99, "mask_iou": 0.95}
+INT8_TOLERANCE = {"conf": 0.05, "box_iou": 0.9, "mask_iou": 0.85}
+
+
+def missing_requirements(backends: List[str]) -> List[str]:
+    """Чего не хватает для прогона: веса и пакеты; пусто — можно запускать."""
+    from app.yolo.pr2_yolo import PR2_MODEL_PATH
+
+    missing = [] if PR2_MODEL_PATH.exists() else [str(PR2_MODEL_PATH)]
+    modules = ["torch", "ultralytics"]
+    if any(b != "torch" for b in backends):
+        modules.append("onnxruntime")
+    return missing + [m for m in modules if importlib.util.find_spec(m) is None]
+
+
+def load_images(source: str, limit: int) -> List[np.ndarray]:
+    """Картинки из каталога (PNG/JPEG), иначе синтетические «дерматоскопии»."""
+    paths = sorted(p for p in Path(source).glob("*") if p.suffix.lower() in (".png", ".jpg", ".jpeg"))
+    images = [img for img in (cv2.imread(str(p)) for p in paths[:limit]) if img is not None]
+    if images:
+        return images
+
+    from benchmarks.bench_encode import make_photo
+
+    return [make_photo(size) for size in (512, 768, 1024)[:limit]]
+
+
+def _vm_hwm_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _predict_fn(backend: str):
+    from app.yolo import pr2_yolo
+
+    if backend == "torch":
+        model = pr2_yolo.get_pr2_model()
+
+        def predict(images, imgsz, conf, iou):
+            preds = model.predict(source=images, imgsz=imgsz, conf=conf, iou=iou, verbose=False)
+            return [pr2_yolo._from_ultralytics(p) for p in preds]
+
+        return predict
+
+    from app.yolo.onnx_backend import get_onnx_model
+
+    return get_onnx_model(int8=backend == "onnx-int8").predict
+
+
+def child(backend: str, args: argparse.Namespace) -> None:
+    from app.segmentation.maskcodec import mask_to_rle
+    from app.yolo.pr2_yolo import detections_of
+
+    images = load_images(args.images, args.limit)
+    t0 = time.perf_counter()
+    predict = _predict_fn(backend)
+    predict(images[:1], args.imgsz, args.conf, args.iou)  # прогрев
+    load_s = time.perf_counter() - t0
+
+    single = []
+    for _ in range(args.runs):
+        for img in images:
+            t0 = time.perf_counter()
+            predict([img], args.imgsz, args.conf, args.iou)
+            single.append((time.perf_counter() - t0) * 1e3)
+    batch = []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        preds = predict(images, args.imgsz, args.conf, args.iou)
+        batch.append((time.perf_counter() - t0) * 1e3 / len(images))
+
+    print(
+        json.dumps(
+            {
+                "backend": backend,
+                "load_s": round(load_s, 3),
+                "single_ms": {"p50": round(float(np.percentile(single, 50)), 2),
+                              "p95": round(float(np.percentile(single, 95)), 2)},
+                "batch_ms_per_image": round(float(np.median(batch)), 2),
+                "peak_rss_mb": round(_vm_hwm_mb(), 1),
+                "detections": [
+                    [det | {"rle": mask_to_rle(m)} for det, m in zip(detections_of(p), p.masks())]
+                    for p in preds
+                ],
+            }
+        )
+    )
+
+
+def _box_iou(a: List[float], b: List[float]) -> float:
+    iw = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 1.0
+
+
+def _mask_iou(a: Dict, b: Dict) -> float:
+    from app.segmentation.maskcodec import rle_to_mask
+
+    ma, mb = rle_to_mask(a) > 0, rle_to_mask(b) > 0
+    union = np.count_nonzero(ma | mb)
+    return np.count_nonzero(ma & mb) / union if union else 1.0
+
+
+def compare(ref: Dict, other: Dict) -> Dict[str, float]:
+    """Худшие по всем картинкам: разница conf, IoU боксов и масок; число несовпавших детекций."""
+    worst = {"conf": 0.0, "box_iou": 1.0, "mask_iou": 1.0, "unmatched": 0}
+    for dets_a, dets_b in zip(ref["detections"], other["detections"]):
+        used = set()
+        for a in dets_a:
+            cands = [(j, _box_iou(a["bbox_xyxy"], b["bbox_xyxy"])) for j, b in enumerate(dets_b)
+                     if j not in used and b["class_id"] == a["class_id"]]
+            if not cands:
+                worst["unmatched"] += 1
+                continue
+            j, iou = max(cands, key=lambda c: c[1])
+            used.add(j)
+            b = dets_b[j]
+            worst["conf"] = max(worst["conf"], abs(a["confidence"] - b["confidence"]))
+            worst["box_iou"] = min(worst["box_iou"], iou)
+            worst["mask_iou"] = min(worst["mask_iou"], _mask_iou(a["rle"], b["rle"]))
+        worst["unmatched"] += len(dets_b) - len(used)
+    return worst
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", default="static/uploads")
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args)
+        return
+
+    missing = missing_requirements(args.backends)
+    if missing:
+        print(f"parity check skipped, missing: {', '.join(missing)}")
+        return
+
+    results = {}
+    for backend in args.backends:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_pr2_backends", "--child", backend,
+             *sys.argv[1:]],
+            check=True, stdout=subprocess.PIPE, text=True,
+        )
+        results[backend] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    print(f"{'backend':>10} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'batch ms/img':>13} {'peak MB':>8}")
+    for backend, r in results.items():
+        print(f"{backend:>10} {r['load_s']:>7.2f} {r['single_ms']['p50']:>8.1f} {r['single_ms']['p95']:>8.1f} "
+              f"{r['batch_ms_per_image']:>13.1f} {r['peak_rss_mb']:>8.1f}")
+
+    if "torch" not in results:
+        return
+    for backend, r in results.items():
+        if backend == "torch":
+            continue
+        worst = compare(results["torch"], r)
+        print(f"parity {backend} vs torch: {worst}")
+        tol = INT8_TOLERANCE if backend == "onnx-int8" else FP32_TOLERANCE
+        ok = (
+            worst["unmatched"] == 0
+            and worst["conf"] <= tol["conf"]
+            and worst["box_iou"] >= tol["box_iou"]
+            and worst["mask_iou"] >= tol["mask_iou"]
+        )
+        if not ok and backend == "onnx":
+            raise AssertionError(f"{backend} differs from torch beyond {tol}")
+        if not ok:
+            print(f"  {backend}: outside {tol}")
+
+
+if __name__ == "__main__":
+    main()
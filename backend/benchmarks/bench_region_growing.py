@@ -0,0 +1,58 @@
+# benchmarks/bench_region_growing.py
+"""
+Сравнение движков region growing ("bfs" vs "band") на синтетике.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_region_growing
+    python -m benchmarks.bench_region_growing --sizes 256 512 1024 2048 --repeat 3
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.segmentation.core import region_growing
+from benchmarks.synthetic import make_lesion_image
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512, 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--diff-thresh", type=int, default=12)
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'bfs, s':>10} {'band, s':>10} {'speedup':>8} {'IoU':>7}")
+    for size in args.sizes:
+        gray = make_lesion_image(size)
+        seed = (size // 2, size // 2)
+
+        results = {}
+        timings = {}
+        for engine in ("bfs", "band"):
+            results[engine] = region_growing(gray, seed, args.diff_thresh, engine=engine)
+            timings[engine] = _time(
+                lambda: region_growing(gray, seed, args.diff_thresh, engine=engine),
+                args.repeat,
+            )
+
+        a = results["bfs"] > 0
+        b = results["band"] > 0
+        iou = np.logical_and(a, b).sum() / max(1, np.logical_or(a, b).sum())
+        print(
+            f"{size:>6} {timings['bfs']:>10.4f} {timings['band']:>10.4f} "
+            f"{timings['bfs'] / timings['band']:>8.1f} {iou:>7.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
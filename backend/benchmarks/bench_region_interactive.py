@@ -0,0 +1,107 @@
+# benchmarks/bench_region_interactive.py
+"""
+Интерактивный region growing (app/segmentation/interactive.py) на сессии
+кликов, движки "tree" (α-дерево) и "band", против region_growing(engine=...).
+
+Сессия: для каждого diff_thresh — серия кликов в случайные точки
+«пятна» и фона (как пользователь, который подбирает seed). Каждый ответ
+сверяется с region_growing того же движка побитово (при расхождении скрипт
+падает). Печатаются p50/p95 задержки: все клики, отдельно построение
+α-дерева (первый клик по изображению), промахи и попадания кэша масок; в
+задержку входит RLE (как в ответе API). Для tree p95 всех кликов сверяется
+с целью --target-ms (при превышении скрипт падает).
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_region_interactive
+    python -m benchmarks.bench_region_interactive --size 2048 --clicks 40 --thresholds 5 12 20
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app.segmentation.core import region_growing
+from app.segmentation.interactive import RegionCache, region_growing_interactive
+from benchmarks.synthetic import make_lesion_image
+
+ENGINES = ("tree", "band")
+
+
+def _pct(values, q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+def make_clicks(gray: np.ndarray, n: int, seed: int = 0):
+    """Половина кликов внутри «пятна» (тёмная область), половина — в фоне."""
+    rng = np.random.default_rng(seed)
+    dark = gray < 125
+    inside = np.argwhere(dark)
+    outside = np.argwhere(~dark)
+    picks = []
+    for i in range(n):
+        pool = inside if i % 2 == 0 else outside
+        r, c = pool[rng.integers(len(pool))]
+        picks.append((int(r), int(c)))
+    return picks
+
+
+def run_session(gray, clicks, thresholds, engine: str, budget_bytes: int):
+    cache = RegionCache(budget_bytes)
+    ref_ms, build_ms, hit_ms, miss_ms = [], [], [], []
+    for diff_thresh in thresholds:
+        for seed in clicks:
+            t0 = time.perf_counter()
+            ref = region_growing(gray, seed, diff_thresh, engine=engine)
+            ref_ms.append((time.perf_counter() - t0) * 1e3)
+
+            builds = cache.misses["tree"]
+            t0 = time.perf_counter()
+            result, cached = region_growing_interactive(gray, "bench", seed, diff_thresh, cache, engine=engine)
+            result.rle()
+            dt = (time.perf_counter() - t0) * 1e3
+            if cache.misses["tree"] > builds:
+                build_ms.append(dt)
+            else:
+                (hit_ms if cached else miss_ms).append(dt)
+
+            assert np.array_equal(result.mask, ref), f"{engine} seed={seed} diff_thresh={diff_thresh}: mask differs"
+            assert result.area == cv2.countNonZero(ref)
+    return ref_ms, build_ms, hit_ms, miss_ms, cache
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--clicks", type=int, default=40, help="кликов на каждый diff_thresh")
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[12, 5, 20])
+    parser.add_argument("--noise", type=float, default=3.0)
+    parser.add_argument("--budget-mb", type=int, default=256)
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=ENGINES)
+    parser.add_argument("--target-ms", type=float, default=50.0, help="цель p95 для tree")
+    args = parser.parse_args()
+
+    gray = make_lesion_image(args.size, noise=args.noise)
+    clicks = make_clicks(gray, args.clicks)
+
+    for engine in args.engines:
+        ref_ms, build_ms, hit_ms, miss_ms, cache = run_session(
+            gray, clicks, args.thresholds, engine, args.budget_mb * 1024 * 1024
+        )
+        all_ms = build_ms + hit_ms + miss_ms
+        print(f"{engine}: {args.size}x{args.size}, {len(all_ms)} clicks, thresholds {args.thresholds}, "
+              f"masks identical to region_growing(engine={engine!r})")
+        print(f"{'':>14} {'n':>5} {'p50 ms':>8} {'p95 ms':>8}")
+        rows = (("region_growing", ref_ms), ("interactive", all_ms), ("  tree build", build_ms),
+                ("  miss", miss_ms), ("  hit", hit_ms))
+        for name, values in rows:
+            print(f"{name:>14} {len(values):>5} {_pct(values, 50):>8.1f} {_pct(values, 95):>8.1f}")
+        print(f"cache: {cache.stats()}")
+        if engine == "tree":
+            p95 = _pct(all_ms, 95)
+            assert p95 < args.target_ms, f"tree p95 {p95:.1f} ms >= {args.target_ms} ms"
+            print(f"tree p95 {p95:.1f} ms < {args.target_ms} ms target")
+
+
+if __name__ == "__main__":
+    main()
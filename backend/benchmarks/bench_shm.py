@@ -0,0 +1,94 @@
+# benchmarks/bench_shm.py
+"""
+Передача картинки процессу-исполнителю: pickle (обычный submit в пул
+процессов) против общей памяти (app/shm.py, submit_shared).
+
+Две задачи на один и тот же RGB:
+- "in"     — исполнитель только смотрит на форму (чистая стоимость передачи);
+- "in+out" — исполнитель строит маску порогом (h x w, uint8), маска
+  возвращается: через pickle или через заранее выделенный сегмент (result_like).
+Маски обоих путей сверяются с посчитанной на месте (иначе скрипт падает).
+"work" — время самой задачи в текущем процессе, для масштаба.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_shm
+    python -m benchmarks.bench_shm --sizes 512 2048 --repeat 10
+"""
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from app.segmentation.core import threshold_manual_inv
+from app.shm import SharedArrayPool, submit_shared
+from benchmarks.synthetic import make_lesion_image
+
+
+def _shape(img: np.ndarray):
+    return img.shape
+
+
+def _mask(img: np.ndarray) -> np.ndarray:
+    return threshold_manual_inv(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), 120)
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 2048, 8192])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    pool.submit(_shape, np.zeros(1)).result()  # процесс поднят и прогрет
+    arrays = SharedArrayPool(max_idle_bytes=1 << 30)
+
+    print(f"{'size':>6} {'MB':>6} {'task':>7} {'pickle, ms':>11} {'shm, ms':>8} {'speedup':>8} {'work, ms':>9}")
+    for size in args.sizes:
+        img = cv2.cvtColor(make_lesion_image(size), cv2.COLOR_GRAY2RGB)
+        ref = _mask(img)
+        repeat = max(1, args.repeat if size <= 2048 else args.repeat // 2)
+
+        assert np.array_equal(pool.submit(_mask, img).result(), ref), f"{size}: pickle mask differs"
+        shared = submit_shared(pool, _mask, img, result_like=ref, pool=arrays, min_bytes=0).result()
+        assert np.array_equal(shared, ref), f"{size}: shared-memory mask differs"
+
+        cases = {
+            "in": (
+                lambda: pool.submit(_shape, img).result(),
+                lambda: submit_shared(pool, _shape, img, pool=arrays, min_bytes=0).result(),
+                lambda: _shape(img),
+            ),
+            "in+out": (
+                lambda: pool.submit(_mask, img).result(),
+                lambda: submit_shared(pool, _mask, img, result_like=ref, pool=arrays, min_bytes=0).result(),
+                lambda: _mask(img),
+            ),
+        }
+        for task, (pickled, shm, local) in cases.items():
+            pickle_s = _time(pickled, repeat)
+            shm_s = _time(shm, repeat)
+            work_s = _time(local, repeat)
+            print(
+                f"{size:>6} {img.nbytes / 2**20:>6.1f} {task:>7} {pickle_s * 1e3:>11.2f} {shm_s * 1e3:>8.2f} "
+                f"{pickle_s / shm_s:>7.1f}x {work_s * 1e3:>9.2f}"
+            )
+        del img, ref, shared
+    print(f"segments: {arrays.stats()}")
+    arrays.close()
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
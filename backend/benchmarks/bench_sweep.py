@@ -0,0 +1,132 @@
+# benchmarks/bench_sweep.py
+"""
+Перебор параметра (app/segmentation/sweep.py) против наивного цикла по
+значениям и одного segment_all_methods.
+
+Сначала проверка: маски и статистика (площадь, bbox) перебора совпадают с
+threshold_manual_inv / adaptive_mean / adaptive_gaussian /
+watershed_segmentation для каждого значения — иначе скрипт падает.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_sweep
+    python -m benchmarks.bench_sweep --sizes 512 2048 --values 50 --repeat 3
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app.segmentation.core import (
+    adaptive_gaussian,
+    adaptive_mean,
+    segment_all_methods,
+    threshold_manual_inv,
+    watershed_segmentation,
+)
+from app.segmentation.sweep import (
+    adaptive_diff,
+    adaptive_sweep_masks,
+    adaptive_sweep_stats,
+    mask_stats,
+    threshold_sweep_masks,
+    threshold_sweep_stats,
+    watershed_sweep_masks,
+)
+from benchmarks.synthetic import make_lesion_image
+
+BLOCK_SIZE = 35
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _sweep_values(n: int):
+    thresholds = [int(v) for v in np.linspace(0, 255, n)]
+    Cs = [int(v) for v in np.linspace(-20, 20, n)]
+    fractions = [round(float(v), 4) for v in np.linspace(0.1, 0.9, n)]
+    return thresholds, Cs, fractions
+
+
+def check(img_rgb: np.ndarray, gray: np.ndarray, img_bgr: np.ndarray, n: int) -> None:
+    thresholds, Cs, fractions = _sweep_values(n)
+
+    stats = threshold_sweep_stats(gray, thresholds)
+    for t, mask, st in zip(thresholds, threshold_sweep_masks(gray, thresholds), stats):
+        ref = threshold_manual_inv(gray, t)
+        assert np.array_equal(mask, ref), f"manual_thresh={t}: mask differs"
+        assert st == mask_stats(ref), f"manual_thresh={t}: {st} != {mask_stats(ref)}"
+
+    for method, fn in (("adapt_mean", adaptive_mean), ("adapt_gauss", adaptive_gaussian)):
+        diff = adaptive_diff(gray, BLOCK_SIZE, method)
+        stats = adaptive_sweep_stats(diff, Cs)
+        for C, mask, st in zip(Cs, adaptive_sweep_masks(diff, Cs), stats):
+            ref = fn(gray, BLOCK_SIZE, C)
+            assert np.array_equal(mask, ref), f"{method} C={C}: mask differs"
+            assert st == mask_stats(ref), f"{method} C={C}: {st} != {mask_stats(ref)}"
+
+    for fraction, mask in zip(fractions, watershed_sweep_masks(img_bgr, gray, fractions)):
+        ref = watershed_segmentation(img_rgb, fraction, img_bgr=img_bgr, gray=gray)
+        assert np.array_equal(mask, ref), f"watershed fg_fraction={fraction}: mask differs"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--values", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--check-values", type=int, default=24, help="сколько значений проверять на совпадение")
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'parameter':>22} {'sweep, ms':>10} {'naive, ms':>10} {'speedup':>8} {'x seg_all':>9}")
+    for size in args.sizes:
+        gray = make_lesion_image(size)
+        img_rgb = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+        img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+        check(img_rgb, gray, img_bgr, args.check_values)
+
+        seg_all = _time(
+            lambda: segment_all_methods(
+                img_rgb, manual_thresh=120, adaptive_block_size=BLOCK_SIZE, adaptive_C=2,
+                region_seed=(size // 2, size // 2), region_diff_thresh=12,
+                watershed_fg_fraction=0.5, region_engine="band",
+            ),
+            args.repeat,
+        )
+
+        thresholds, Cs, fractions = _sweep_values(args.values)
+        cases = {
+            "manual_thresh": (
+                lambda: threshold_sweep_stats(gray, thresholds),
+                lambda: [mask_stats(threshold_manual_inv(gray, t)) for t in thresholds],
+            ),
+            "adaptive_C": (
+                lambda: [adaptive_sweep_stats(adaptive_diff(gray, BLOCK_SIZE, m), Cs)
+                         for m in ("adapt_mean", "adapt_gauss")],
+                lambda: [mask_stats(fn(gray, BLOCK_SIZE, C))
+                         for fn in (adaptive_mean, adaptive_gaussian) for C in Cs],
+            ),
+            "watershed_fg_fraction": (
+                lambda: [mask_stats(m) for m in watershed_sweep_masks(img_bgr, gray, fractions)],
+                lambda: [mask_stats(watershed_segmentation(img_rgb, f, img_bgr=img_bgr, gray=gray))
+                         for f in fractions],
+            ),
+        }
+        for parameter, (sweep_fn, naive_fn) in cases.items():
+            sweep_s = _time(sweep_fn, args.repeat)
+            naive_s = _time(naive_fn, 1)
+            print(
+                f"{size:>6} {parameter:>22} {sweep_s * 1e3:>10.1f} {naive_s * 1e3:>10.1f} "
+                f"{naive_s / sweep_s:>7.1f}x {sweep_s / seg_all:>8.2f}x"
+            )
+        print(f"{size:>6} {'segment_all_methods':>22} {seg_all * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
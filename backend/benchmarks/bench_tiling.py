@@ -0,0 +1,109 @@
+# benchmarks/bench_tiling.py
+"""
+Тайловый режим (app.segmentation.tiling) против обычного: совпадение масок,
+время и прирост пикового RSS по каждому методу (VmHWM после сброса через
+/proc/self/clear_refs, Linux — учитывает и внутренние буферы OpenCV).
+
+Сначала проверяется точное совпадение на наборе небольших изображений с
+«неудобными» размерами и мелкими тайлами (края, тайлы меньше окна), затем
+замер на одном большом изображении. При расхождении скрипт падает.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_tiling
+    python -m benchmarks.bench_tiling --size 8192 --tile 2048
+"""
+import argparse
+import gc
+import time
+
+import cv2
+import numpy as np
+
+from app.segmentation.core import SEGMENTATION_METHODS, iter_segment_methods
+from app.segmentation.tiling import iter_segment_methods_tiled
+from benchmarks.synthetic import make_lesion_image
+
+
+def make_slide(h: int, w: int, seed: int = 0) -> np.ndarray:
+    """«Срез ткани»: пятно + мелкая текстура + плавный градиент фона, RGB."""
+    gray = make_lesion_image(max(h, w), noise=6.0, seed=seed)[:h, :w].astype(np.int16)
+    rng = np.random.default_rng(seed)
+    texture = cv2.GaussianBlur(rng.normal(0, 25, (h, w)).astype(np.float32), (0, 0), 3)
+    ramp = np.linspace(-20, 20, w, dtype=np.float32)[None, :]
+    gray = np.clip(gray + texture + ramp, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+
+
+def params(h: int, w: int) -> dict:
+    return dict(
+        manual_thresh=120,
+        adaptive_block_size=35,
+        adaptive_C=5,
+        region_seed=(h // 2, w // 2),
+        region_diff_thresh=12,
+        watershed_fg_fraction=0.5,
+        region_engine="band",
+    )
+
+
+def check_exact() -> None:
+    cases = [(97, 131, 16), (300, 257, 64), (515, 700, 128), (1024, 1024, 300)]
+    for h, w, tile in cases:
+        img = make_slide(h, w, seed=h)
+        for block in (3, 35, 101):
+            kw = dict(params(h, w), adaptive_block_size=block)
+            ref = dict(iter_segment_methods(img, **kw))
+            tiled = dict(iter_segment_methods_tiled(img, tile_size=tile, **kw))
+            for m in SEGMENTATION_METHODS:
+                if not np.array_equal(ref[m], tiled[m]):
+                    diff = int(np.count_nonzero(ref[m] != tiled[m]))
+                    raise AssertionError(f"{m}: {h}x{w} tile={tile} block={block}: {diff} px differ")
+    print(f"exact: {len(cases) * 3} cases x {len(SEGMENTATION_METHODS)} methods identical")
+
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(fn):
+    gc.collect()
+    before = _status_mb("VmRSS")
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # сброс VmHWM до текущего RSS
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    return result, elapsed, _status_mb("VmHWM") - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=6144)
+    parser.add_argument("--tile", type=int, default=2048)
+    args = parser.parse_args()
+
+    check_exact()
+
+    img = make_slide(args.size, args.size)
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    kw = params(args.size, args.size)
+
+    print(f"{args.size}x{args.size}, tile {args.tile}")
+    print(f"{'method':>15} {'full s':>8} {'tiled s':>8} {'full MB':>8} {'tiled MB':>9} {'equal':>6}")
+    for m in SEGMENTATION_METHODS:
+        ref, t_full, p_full = measure(lambda: dict(iter_segment_methods(img, methods=[m], gray=gray, **kw))[m])
+        til, t_tiled, p_tiled = measure(
+            lambda: dict(iter_segment_methods_tiled(img, methods=[m], gray=gray, tile_size=args.tile, **kw))[m]
+        )
+        print(
+            f"{m:>15} {t_full:>8.3f} {t_tiled:>8.3f} {p_full:>8.1f} {p_tiled:>9.1f} "
+            f"{str(np.array_equal(ref, til)):>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# benchmarks/bench_upload.py
+"""
+Задержка и пиковый RSS загрузки через POST /api/images/upload.
+
+Каждый прогон — в отдельном процессе на временной БД и временном каталоге
+static (APP_DB_PATH / APP_MEDIA_ROOT). Пик RSS берётся из VmHWM (Linux),
+счётчик сбрасывается перед самой загрузкой. Вторая загрузка того же файла
+показывает время ответа при дедупликации.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_upload --size-mb 50 --repeat 3
+Для сравнения «до/после» запускать на соответствующих коммитах.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.synthetic import dicom_side_for_mb, make_dicom
+
+_CHILD = r"""
+import json, sys, time, warnings
+warnings.filterwarnings("ignore")
+from fastapi.testclient import TestClient
+from app.main import app
+
+def status_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+path = sys.argv[1]
+with TestClient(app) as client:
+    client.get("/health")
+    with open(path, "rb") as f:
+        payload = f.read()
+    rss_before = status_mb("VmRSS")
+    reset_peak()
+    t0 = time.perf_counter()
+    r = client.post("/api/images/upload", files={"file": ("bench.dcm", payload, "application/dicom")})
+    elapsed = time.perf_counter() - t0
+    r.raise_for_status()
+    peak = status_mb("VmHWM")
+    # повторная загрузка того же файла (дедупликация по хэшу)
+    t0 = time.perf_counter()
+    r2 = client.post("/api/images/upload", files={"file": ("bench.dcm", payload, "application/dicom")})
+    dup_elapsed = time.perf_counter() - t0
+    r2.raise_for_status()
+print(json.dumps({
+    "latency_s": round(elapsed, 4),
+    "peak_rss_mb": round(peak, 1),
+    "peak_rss_growth_mb": round(peak - rss_before, 1),
+    "duplicate_latency_s": round(dup_elapsed, 4),
+    "duplicate_same_id": r2.json()["id"] == r.json()["id"],
+}))
+"""
+
+
+def run_once(dicom_path: Path, workdir: Path) -> dict:
+    env = dict(os.environ)
+    env["APP_DB_PATH"] = str(workdir / "bench.db")
+    env["APP_MEDIA_ROOT"] = str(workdir / "static")
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, str(dicom_path)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=50.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        side = dicom_side_for_mb(args.size_mb)
+        dicom_path = make_dicom(tmp / "bench.dcm", side, side)
+        size_mb = dicom_path.stat().st_size / 1024 / 1024
+        print(f"DICOM {side}x{side}, {size_mb:.1f} MB")
+
+        runs = [run_once(dicom_path, tmp / f"run{i}") for i in range(args.repeat)]
+        for i, r in enumerate(runs):
+            print(f"run {i}: {r}")
+        best = min(runs, key=lambda r: r["latency_s"])
+        print(json.dumps({"size_mb": round(size_mb, 1), "best": best}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_volume.py
+"""
+Сегментация объёма по срезам: время и пик памяти в зависимости от глубины.
+
+Каждая глубина — в отдельном процессе: запись .npy из многокадрового DICOM
+(write_volume) и все методы по всем срезам (iter_volume_masks). Пик памяти
+сегментации в основном процессе — tracemalloc (страницы memmap в него не
+входят, это кэш файла), воркеров пула — VmHWM, который воркер сообщает
+сам (Linux; RUSAGE_CHILDREN не годится — туда попадает пик родителя на fork).
+Память не должна расти с глубиной.
+
+Запуск из каталога backend:
+    python -m benchmarks.bench_volume
+    python -m benchmarks.bench_volume --depths 16 64 256 --side 512
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.synthetic import make_dicom
+
+_CHILD = r"""
+import json, sys, time, tracemalloc
+from pathlib import Path
+from app.segmentation.volume import iter_volume_masks, write_volume
+from app.segmentation.executor import get_volume_pool
+from benchmarks.bench_volume import worker_peak_rss_mb
+
+if __name__ == "__main__":
+    dicom, volume = Path(sys.argv[1]), Path(sys.argv[2])
+    t0 = time.perf_counter()
+    _, depth = write_volume(dicom, volume)
+    ingest = time.perf_counter() - t0
+    kwargs = dict(manual_thresh=120, adaptive_block_size=35, adaptive_C=5, region_seed=(10, 10),
+                  region_diff_thresh=12, watershed_fg_fraction=0.5, region_engine="band")
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n = sum(1 for _ in iter_volume_masks(volume, kwargs))
+    segment = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    pool = get_volume_pool()
+    workers = pool.submit(worker_peak_rss_mb).result() if pool is not None else 0.0
+    print(json.dumps({"depth": n, "ingest_s": round(ingest, 3), "segment_s": round(segment, 3),
+                      "slices_per_s": round(n / segment, 1), "segment_peak_mb": round(peak, 1),
+                      "worker_peak_rss_mb": round(workers, 1)}))
+"""
+
+
+def worker_peak_rss_mb() -> float:
+    """VmHWM текущего процесса (вызывается в воркере пула)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--depths", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--side", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, APP_MEDIA_ROOT=str(Path(tmp) / "static"), APP_DB_PATH=str(Path(tmp) / "b.db"))
+        for depth in args.depths:
+            dicom = make_dicom(Path(tmp) / f"vol{depth}.dcm", args.side, args.side, frames=depth)
+            out = subprocess.run(
+                [sys.executable, "-c", _CHILD, str(dicom), str(Path(tmp) / f"vol{depth}.npy")],
+                env=env, check=True, capture_output=True, text=True,
+            )
+            print(json.loads(out.stdout.strip().splitlines()[-1]))
+            dicom.unlink()
+
+
+if __name__ == "__main__":
+    main()
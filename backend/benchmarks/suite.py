@@ -0,0 +1,322 @@
+# benchmarks/suite.py
+"""
+Сводный бенчмарк: функции app/segmentation/core.py на синтетике нескольких
+размеров и эндпоинты upload / segment/all через TestClient.
+
+По каждому случаю — p50/p95/среднее (мс), пропускная способность (Мпикс/с и
+вызовов/с) и пик памяти: peak_alloc_mb — tracemalloc за один отдельный вызов
+(массивы numpy, в том числе результаты OpenCV; детерминирован, по нему и
+сравнение), peak_rss_mb — прирост VmHWM над RSS за прогоны (Linux; освобождённое
+и переиспользованное аллокатором не видно).
+Результат — JSON (--out), который можно сохранить как базовый и сравнивать
+с ним следующие прогоны (--baseline): случаи, ставшие медленнее (по p50)
+или прожорливее больше чем на --tolerance, печатаются, код выхода 1.
+
+Картинки детерминированные (benchmarks/synthetic.py): «пятно» на фоне для
+core, для эндпоинтов — PNG того же вида и 16-битный DICOM. Эндпоинты
+гоняются в отдельном процессе на временной БД и static (APP_DB_PATH /
+APP_MEDIA_ROOT); segment/all — «холодный» (каждый раз другие параметры,
+все маски считаются) и «тёплый» (повтор, маски из кэша).
+
+Запуск из каталога backend:
+    python -m benchmarks.suite --out bench.json
+    python -m benchmarks.suite --sizes 512 1024 --repeat 10 --baseline benchmarks/baseline.json
+    python -m benchmarks.suite --only core --out core.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+
+# bfs region growing — чистый Python, на больших картинках идёт секундами
+BFS_MAX_SIZE = 1024
+
+
+# ---------- измерения ----------
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _reset_peak() -> None:
+    """Сбросить VmHWM до текущего RSS (Linux >= 4.0)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def measure(fn: Callable[[], Any], repeat: int, pixels: int, warmup: int = 1) -> Dict[str, float]:
+    """Прогрев, repeat вызовов (задержки, пропускная способность, пик RSS), затем вызов под tracemalloc."""
+    for _ in range(warmup):
+        fn()
+    rss_before = _status_mb("VmRSS")
+    _reset_peak()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    peak = _status_mb("VmHWM")
+
+    tracemalloc.start()
+    fn()
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times_ms = np.asarray(times) * 1e3
+    mean_s = float(np.mean(times))
+    return {
+        "n": repeat,
+        "p50_ms": round(float(np.percentile(times_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(times_ms, 95)), 3),
+        "mean_ms": round(mean_s * 1e3, 3),
+        "ops_s": round(1.0 / mean_s, 2) if mean_s > 0 else None,
+        "mpx_s": round(pixels / 1e6 / mean_s, 2) if mean_s > 0 else None,
+        "peak_alloc_mb": round(peak_alloc / 1024 / 1024, 2),
+        "peak_rss_mb": round(max(0.0, peak - rss_before), 1),
+    }
+
+
+# ---------- функции core ----------
+
+def core_cases(size: int, workdir: Path) -> Dict[str, Callable[[], Any]]:
+    from app.segmentation import core
+    from benchmarks.synthetic import make_dicom, make_lesion_image
+
+    gray = make_lesion_image(size)
+    rgb = core.gray_to_rgb(gray)
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    png_path = workdir / f"lesion_{size}.png"
+    cv2.imwrite(str(png_path), bgr)
+    png_bytes = png_path.read_bytes()
+    dicom_path = make_dicom(workdir / f"lesion_{size}.dcm", size, size)
+    mask = core.threshold_otsu_inv(gray)[0]
+    seed = (size // 2, size // 2)
+    out_path = workdir / f"out_{size}.png"
+
+    cases = {
+        "load_rgb_image": lambda: core.load_rgb_image(png_path),
+        "load_planes": lambda: core.load_planes(png_path),
+        "decode_image_bytes": lambda: core.decode_image_bytes(png_bytes),
+        "dicom_to_rgb": lambda: core.dicom_to_rgb(dicom_path),
+        "save_mask": lambda: core.save_mask(mask, out_path),
+        "rgb_to_gray": lambda: core.rgb_to_gray(rgb),
+        "threshold_manual_inv": lambda: core.threshold_manual_inv(gray, 120),
+        "threshold_otsu_inv": lambda: core.threshold_otsu_inv(gray),
+        "adaptive_mean": lambda: core.adaptive_mean(gray, 35, 5),
+        "adaptive_gaussian": lambda: core.adaptive_gaussian(gray, 35, 5),
+        "region_growing_band": lambda: core.region_growing(gray, seed, 12, engine="band"),
+        "watershed_segmentation": lambda: core.watershed_segmentation(rgb, 0.5, img_bgr=bgr, gray=gray),
+        "segment_all_methods": lambda: core.segment_all_methods(
+            rgb,
+            manual_thresh=120,
+            adaptive_block_size=35,
+            adaptive_C=5,
+            region_seed=seed,
+            region_diff_thresh=12,
+            watershed_fg_fraction=0.5,
+            region_engine="band",
+            img_bgr=bgr,
+            gray=gray,
+        ),
+    }
+    if size <= BFS_MAX_SIZE:
+        cases["region_growing_bfs"] = lambda: core.region_growing(gray, seed, 12, engine="bfs")
+    return cases
+
+
+def run_core(sizes: List[int], repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            for name, fn in core_cases(size, Path(tmp)).items():
+                results[f"core/{name}/{size}"] = measure(fn, repeat, size * size)
+                print(f"  core/{name}/{size}: {results[f'core/{name}/{size}']['p50_ms']} ms", file=sys.stderr)
+    return results
+
+
+# ---------- эндпоинты (в дочернем процессе) ----------
+
+def _api_child(sizes: List[int], repeat: int, workdir: Path) -> Dict[str, Dict[str, float]]:
+    import warnings
+
+    warnings.filterwarnings("ignore")
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from benchmarks.synthetic import make_dicom, make_lesion_image
+
+    results = {}
+    with TestClient(app) as client:
+        client.get("/health")
+        for size in sizes:
+            ok, buf = cv2.imencode(".png", make_lesion_image(size))
+            png = buf.tobytes()
+            dicom = make_dicom(workdir / f"upload_{size}.dcm", size, size).read_bytes()
+
+            # каждая загрузка — новый файл (иначе сработает дедупликация по хэшу)
+            counter = iter(range(10 ** 6))
+
+            def upload(data: bytes, name: str, media_type: str) -> int:
+                k = next(counter)
+                if name.endswith(".dcm"):
+                    # PixelData — последний элемент файла: меняем два последних пикселя
+                    data = data[:-4] + np.array([k % 4096, k // 4096 % 4096], "<u2").tobytes()
+                else:
+                    # хвост после IEND декодер PNG игнорирует
+                    data = data + k.to_bytes(4, "little")
+                r = client.post("/api/images/upload", files={"file": (name, data, media_type)})
+                r.raise_for_status()
+                return r.json()["id"]
+
+            results[f"api/upload_png/{size}"] = measure(
+                lambda: upload(png, "bench.png", "image/png"), repeat, size * size
+            )
+            results[f"api/upload_dicom/{size}"] = measure(
+                lambda: upload(dicom, "bench.dcm", "application/dicom"), repeat, size * size
+            )
+
+            image_id = upload(png, "bench.png", "image/png")
+            params = iter(range(10 ** 6))
+
+            def segment_all(step: int) -> None:
+                r = client.post(
+                    f"/api/images/{image_id}/segment/all",
+                    json={
+                        "manual_thresh": 100 + step % 100,
+                        "adaptive_block_size": 35,
+                        "adaptive_C": 5 + step % 50,
+                        "region_growing": {
+                            "seed_x": size // 2,
+                            "seed_y": size // 2,
+                            "diff_thresh": 10 + step % 20,
+                            "engine": "band",
+                        },
+                        "watershed_fg_fraction": 0.3 + (step % 40) / 100,
+                    },
+                )
+                r.raise_for_status()
+
+            results[f"api/segment_all_cold/{size}"] = measure(
+                lambda: segment_all(next(params)), repeat, size * size
+            )
+            results[f"api/segment_all_warm/{size}"] = measure(lambda: segment_all(0), repeat, size * size)
+            for name in ("upload_png", "upload_dicom", "segment_all_cold", "segment_all_warm"):
+                print(f"  api/{name}/{size}: {results[f'api/{name}/{size}']['p50_ms']} ms", file=sys.stderr)
+    return results
+
+
+def run_api(sizes: List[int], repeat: int) -> Dict[str, Dict[str, float]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["APP_DB_PATH"] = str(Path(tmp) / "bench.db")
+        env["APP_MEDIA_ROOT"] = str(Path(tmp) / "static")
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.suite", "--api-child", tmp,
+             "--sizes", *map(str, sizes), "--repeat", str(repeat)],
+            env=env,
+            check=True,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+# ---------- отчёт и сравнение ----------
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Случаи, где p50 или пик памяти выросли больше чем на tolerance (доля)."""
+    regressions = []
+    print(f"\n{'case':<42} {'p50 base':>10} {'p50 now':>10} {'ratio':>7} {'MB base':>8} {'MB now':>8}")
+    for name, now in current["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            continue
+        ratio = now["p50_ms"] / base["p50_ms"] if base["p50_ms"] > 0 else 1.0
+        slower = ratio > 1 + tolerance
+        # прирост памяти меньше 1 МБ — шум
+        heavier = now["peak_alloc_mb"] > max(1.0, base["peak_alloc_mb"] * (1 + tolerance))
+        mark = " <-- slower" if slower else ""
+        mark += " <-- memory" if heavier else ""
+        print(f"{name:<42} {base['p50_ms']:>10.2f} {now['p50_ms']:>10.2f} {ratio:>7.2f} "
+              f"{base['peak_alloc_mb']:>8.1f} {now['peak_alloc_mb']:>8.1f}{mark}")
+        if slower or heavier:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", choices=("core", "api"))
+    parser.add_argument("--out", type=Path, help="куда записать JSON (иначе stdout)")
+    parser.add_argument("--baseline", type=Path, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p50/памяти, доля")
+    parser.add_argument("--api-child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.api_child:
+        print(json.dumps(_api_child(args.sizes, args.repeat, Path(args.api_child))))
+        return
+
+    cases: Dict[str, Dict[str, float]] = {}
+    if args.only in (None, "core"):
+        cases.update(run_core(args.sizes, args.repeat))
+    if args.only in (None, "api"):
+        cases.update(run_api(args.sizes, args.repeat))
+
+    report = {
+        "env": environment(),
+        "sizes": args.sizes,
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# benchmarks/synthetic.py
+"""Детерминированные синтетические данные для бенчмарков."""
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pydicom
+from pydicom.dataset import FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, SecondaryCaptureImageStorage, generate_uid
+
+
+def make_lesion_image(size: int, noise: float = 3.0, seed: int = 0) -> np.ndarray:
+    """Серый фон + тёмное однородное «пятно» в центре (как дерматоскопия)."""
+    rng = np.random.default_rng(seed)
+    img = np.full((size, size), 180.0, dtype=np.float32)
+    center = (size // 2, size // 2)
+    axes = (int(size * 0.3), int(size * 0.22))
+    lesion = np.zeros((size, size), dtype=np.uint8)
+    cv2.ellipse(lesion, center, axes, 20, 0, 360, 255, -1)
+    img[lesion > 0] = 70.0
+    img += rng.normal(0.0, noise, img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def make_dicom(
+    path: Path,
+    rows: int,
+    cols: int,
+    frames: int = 1,
+    seed: int = 0,
+    window: bool = True,
+) -> Path:
+    """
+    Несжатый 16-битный (12 значащих бит) DICOM MONOCHROME2: фон + яркий эллипс.
+    frames > 1 — многокадровый файл (NumberOfFrames).
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.ogrid[:rows, :cols]
+    lesion = ((yy - rows / 2) / (rows * 0.3)) ** 2 + ((xx - cols / 2) / (cols * 0.22)) ** 2 <= 1.0
+
+    pixels = np.empty((frames, rows, cols), dtype=np.uint16)
+    for i in range(frames):
+        frame = rng.normal(800, 40, (rows, cols))
+        frame[lesion] += 1500 + 10 * i
+        pixels[i] = np.clip(frame, 0, 4095).astype(np.uint16)
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = pydicom.Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = "OT"
+    ds.Rows = rows
+    ds.Columns = cols
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.RescaleSlope = 1
+    ds.RescaleIntercept = 0
+    if window:
+        ds.WindowCenter = 1500
+        ds.WindowWidth = 2500
+    if frames > 1:
+        ds.NumberOfFrames = frames
+    ds.PixelData = (pixels if frames > 1 else pixels[0]).tobytes()
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        ds.save_as(str(path), enforce_file_format=True)  # pydicom >= 3
+    except TypeError:
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.save_as(str(path), write_like_original=False)
+    return path
+
+
+def dicom_side_for_mb(size_mb: float) -> int:
+    """Сторона квадратного 16-битного кадра, дающего примерно size_mb мегабайт."""
+    return int(np.sqrt(size_mb * 1024 * 1024 / 2))